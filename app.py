@@ -1,23 +1,36 @@
 import streamlit as st
-import ee
-import folium
-from streamlit_folium import st_folium
-import geopandas as gpd
-import zipfile
-import tempfile
-import os
 from datetime import date, datetime
-import pandas as pd
-from io import BytesIO
-import io
-from fpdf import FPDF
-import json
+import os
+import tempfile
+import base64
+import hashlib
 import traceback
+import uuid
 import re
-import csv
-from shapely.ops import unary_union, orient as shapely_orient
-from shapely.geometry import Polygon, MultiPolygon
-import shapely
+
+# Imports pesados (ee, folium, geopandas, pandas, shapely, fpdf) ficam nos módulos/etapas que os usam:
+# a primeira tela (upload) não paga por eles.
+from darc.catalogo import resumo_catalogo
+from darc.cenas import buscar_cenas_periodos
+from darc.classificacao import (
+    calcular_areas_mudanca, calcular_mudanca, calcular_tabela_lotes, classificar_periodos, criar_samples,
+    ESCALA_PREVIA, JANELA_AMOSTRAGEM, OPCOES_JANELA_AMOSTRAGEM, lotes_por_impressao, palette_mudanca, PARAMS_RF,
+    processar_serie_anual, tipos_cobertura
+)
+from darc.estagios import (
+    estagio_em_cache, executar_estagio, hash_estagio, impressao, invalidar_estagios, registrar_estagio, saida_estagio
+)
+from darc.execucoes import carregar_execucao, listar_execucoes, mostrar_execucao, salvar_execucao, tabela_lotes_salva
+from darc.exportacao import arquivo_tabela_lotes, baixar_rasters_resultado, cog_resultado, png_resultado
+from darc.gee import agendador_gee, inicializar_gee, obter_info
+from darc.geo import (
+    calcular_area_ha, ler_arquivo_geo, limpar_gdf_para_folium, obter_roi, perimetro_dos_lotes, preparar_lotes
+)
+from darc.modelos import carregar_modelo, listar_modelos, registrar_modelo, remover_modelo, rotulo_modelo
+from darc.monitoramento import carregar_linha_base, congelar_linha_base, listar_linhas_base, mostrar_monitoramento
+from darc.multipa import agrupar_pas_por_cenas, processar_multipa
+from darc.relatorio import gerar_relatorio_pdf, gerar_relatorios_lotes_zip
+from darc.tarefas import acompanhar_tarefa, estagio_em_segundo_plano, submeter_tarefa, tarefa_da_sessao
 
 APP_VERSION = "v1.0.14"
 
@@ -28,116 +41,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Função para inicializar GEE apenas quando necessário (LAZY LOADING)
-def inicializar_gee():
-    """Inicializa o Google Earth Engine apenas uma vez"""
-    if 'gee_initialized' not in st.session_state:
-        with st.spinner("🌍 Conectando ao Google Earth Engine..."):
-            try:
-                if 'earth_engine' in st.secrets:
-                    # Streamlit Cloud: usar Service Account dos secrets
-                    # Usa google.oauth2 diretamente para evitar ambiguidade de tipos
-                    # do wrapper ee.ServiceAccountCredentials (espera str, não dict)
-                    from google.oauth2 import service_account as _google_sa
-                    from ee.oauth import SCOPES as _EE_SCOPES
-                    service_account_info = json.loads(st.secrets['earth_engine']['service_account'])
-                    credentials = _google_sa.Credentials.from_service_account_info(
-                        service_account_info, scopes=_EE_SCOPES
-                    )
-                    ee.Initialize(credentials)
-                else:
-                    # Desenvolvimento local: autenticação padrão
-                    ee.Initialize(project='graceful-fin-479914-k9')
-
-                st.session_state.gee_initialized = True
-            except Exception as e:
-                st.error(f"❌ Erro ao conectar GEE: {e}")
-                st.error("💡 Verifique sua conexão com a internet e tente novamente.")
-                st.code(traceback.format_exc())
-                st.stop()
-
-def obter_roi():
-    """Obtém ou cria o ROI (Region of Interest) do GEE"""
-    if 'roi' not in st.session_state or st.session_state.roi is None:
-        if st.session_state.gdf is not None:
-            inicializar_gee()  # Garante que GEE está inicializado
-            geom = st.session_state.gdf.geometry.iloc[0]
-            st.session_state.roi = _geom_para_gee(geom)
-    return st.session_state.roi
-
-
-def limpar_gdf_para_folium(gdf):
-    """
-    Remove colunas problemáticas (Timestamp, datetime) do GeoDataFrame
-    para evitar erro 'Timestamp is not JSON serializable' no folium
-    """
-    if gdf is None:
-        return None
-    
-    # Criar cópia só com geometria
-    gdf_limpo = gdf[['geometry']].copy()
-    
-    # Adicionar atributo 'nome' se existir (útil para popup)
-    if 'nome' in gdf.columns:
-        gdf_limpo['nome'] = gdf['nome'].astype(str)
-    elif 'Name' in gdf.columns:
-        gdf_limpo['nome'] = gdf['Name'].astype(str)
-    
-    return gdf_limpo
-
-
-def calcular_area_ha(gdf):
-    """Calcula área total em hectares reprojetando para UTM adequado à área"""
-    centroid = gdf.geometry.unary_union.centroid
-    utm_zone = int((centroid.x + 180) / 6) + 1
-    epsg = 32600 + utm_zone if centroid.y >= 0 else 32700 + utm_zone
-    return gdf.to_crs(epsg=epsg).geometry.area.sum() / 10000
-
-
-def _geom_para_gee(geom):
-    """Sanitiza geometria Shapely para aceite pelo GEE.
-    1. Corrige invalidade via buffer(0)
-    2. Aplica make_valid() se disponível (Shapely ≥ 1.8)
-    3. Garante winding order CCW exterior (exigido pelo GeoJSON do GEE)
-    4. Arredonda coordenadas para 7 casas decimais (~1 cm)
-    """
-    if not geom.is_valid:
-        geom = geom.buffer(0)
-    try:
-        geom = shapely.make_valid(geom)
-        # make_valid() pode retornar GeometryCollection — extrair só polígonos
-        if geom.geom_type == 'GeometryCollection':
-            polys = [g for g in geom.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
-            geom = unary_union(polys) if polys else geom.buffer(0)
-    except AttributeError:
-        pass
-    geom = shapely_orient(geom, sign=1.0)  # exterior CCW, interior CW
-
-    def _round_ring(coords):
-        return [(round(c[0], 7), round(c[1], 7)) for c in coords]
-
-    geojson = dict(geom.__geo_interface__)
-    if geojson['type'] == 'Polygon':
-        geojson['coordinates'] = [_round_ring(ring) for ring in geojson['coordinates']]
-    elif geojson['type'] == 'MultiPolygon':
-        geojson['coordinates'] = [
-            [_round_ring(ring) for ring in poly]
-            for poly in geojson['coordinates']
-        ]
-    return ee.Geometry(geojson)
-
-
-# Definir tipos de cobertura (usado em várias partes do código)
-tipos_cobertura = {
-    'Floresta': '#00FF00',        # Verde limão (bem visível)
-    'Pastagem': '#FFFF00',        # Amarelo puro
-    'Água': '#00FFFF',            # Ciano (azul claro)
-    'Outra Vegetação': '#FF00FF', # MAGENTA (roxo forte) - BEM DIFERENTE!
-    'Solo Exposto': '#FF8C00',    # Laranja forte
-    'Queimada': '#FF0000',        # Vermelho puro
-    'Agricultura': '#FFD700'      # Dourado
-}
-
 # Inicializar session_state
 if 'gdf' not in st.session_state:
     st.session_state.gdf = None
@@ -190,7 +93,13 @@ st.subheader("Instituto Federal de Rondônia")
 
 # Indicador simples de status
 if 'gee_initialized' in st.session_state and st.session_state.gee_initialized:
-    st.caption("✅ GEE conectado")
+    _partida = st.session_state.get('gee_partida', {})
+    if _partida.get('reaproveitado'):
+        st.caption(f"✅ GEE conectado — cliente do processo reaproveitado em {_partida['segundos_sessao']*1000:.0f} ms "
+                   f"(handshake de {_partida['segundos_inicializacao']:.1f}s evitado; "
+                   f"{_partida['sessoes_atendidas']} sessões atendidas)")
+    else:
+        st.caption("✅ GEE conectado")
 
 with st.expander("💡 Dicas"):
     st.markdown("""
@@ -198,8 +107,80 @@ with st.expander("💡 Dicas"):
     - 💾 Cache acelera carregamentos seguintes
     - 🔄 Use "Recarregar Imagens" se o mapa travar
     """)
+
+with st.expander("📶 Fila de requisições ao GEE"):
+    _metricas = agendador_gee().metricas()
+    _c1, _c2, _c3, _c4 = st.columns(4)
+    _c1.metric("Na fila", _metricas['na_fila'])
+    _c2.metric("Em andamento", f"{_metricas['ativas']}/{_metricas['max_simultaneas']}")
+    _c3.metric("Retentativas (limite de taxa)", _metricas['retentativas'])
+    _c4.metric("Falhas", _metricas['falhas'])
+    st.markdown("| Prioridade | Requisições | Espera média (s) | Espera p95 (s) |\n|---|---|---|---|\n" + "\n".join(
+        f"| {nome} | {e['n']} | {e['media']:.3f} | {e['p95']:.3f} |" for nome, e in _metricas['espera'].items()
+    ))
+
+# Execuções salvas: reabrir um resultado completo direto do disco (sem GEE)
+execucoes_salvas = listar_execucoes()
+if execucoes_salvas:
+    with st.expander(f"🗂️ Execuções salvas ({len(execucoes_salvas)})"):
+        _rotulos_execucoes = {
+            e['run_id']: f"{e['run_id']} — {e['nome_pa'] or 'PA'} ({e['date_ant']} → {e['date_pos']})"
+                         + (f" — {e['n_lotes']} lotes" if e['n_lotes'] else "")
+                         + (" — ⚠️ parcial" if e['parcial'] else "")
+            for e in execucoes_salvas
+        }
+        run_escolhido = st.selectbox("Execução", list(_rotulos_execucoes), format_func=_rotulos_execucoes.get,
+                                     key="run_escolhido")
+        if st.button("📂 Abrir execução"):
+            st.session_state['execucao_aberta'] = run_escolhido
+            st.rerun()
+
+# Monitoramento contínuo: linhas de base congeladas e histórico por data (novas datas sem refazer a base)
+linhas_base = listar_linhas_base()
+if linhas_base:
+    with st.expander(f"📡 Monitoramento ({len(linhas_base)} linha(s) de base)"):
+        _rotulos_bases = {
+            b['base_id']: f"{b['nome_pa'] or 'PA'} — base {b['date_base']} — {b['n_datas']} data(s)"
+                          + (f", última {b['ultima_data']}" if b['ultima_data'] else "")
+            for b in linhas_base
+        }
+        base_escolhida = st.selectbox("Linha de base", list(_rotulos_bases), format_func=_rotulos_bases.get,
+                                      key="base_escolhida")
+        if st.button("📡 Abrir monitoramento"):
+            st.session_state['monitoramento_aberto'] = base_escolhida
+            st.rerun()
+
+# Registro de modelos: classificadores treinados, reaplicáveis no passo 5 a cenas do mesmo sensor
+modelos_registrados = listar_modelos()
+if modelos_registrados:
+    with st.expander(f"📚 Modelos registrados ({len(modelos_registrados)})"):
+        _rotulos_modelos = {m['modelo_id']: rotulo_modelo(m) for m in modelos_registrados}
+        modelo_escolhido = st.selectbox("Modelo", list(_rotulos_modelos), format_func=_rotulos_modelos.get,
+                                        key="modelo_registrado")
+        _modelo = next(m for m in modelos_registrados if m['modelo_id'] == modelo_escolhido)
+        st.caption(f"Cena `{_modelo['cena_id'] or '?'}` · bandas: {', '.join(_modelo['esquema_bandas'])} · "
+                   f"registrado em {_modelo['criado_em']}")
+        if st.button("🗑️ Remover modelo"):
+            remover_modelo(modelo_escolhido)
+            st.rerun()
 st.markdown("---")
 
+if st.session_state.get('monitoramento_aberto'):
+    try:
+        mostrar_monitoramento(carregar_linha_base(st.session_state['monitoramento_aberto']))
+    except Exception as e:
+        st.error(f"❌ Erro ao abrir monitoramento: {e}")
+        del st.session_state['monitoramento_aberto']
+    st.stop()
+
+if st.session_state.get('execucao_aberta'):
+    try:
+        mostrar_execucao(carregar_execucao(st.session_state['execucao_aberta']))
+    except Exception as e:
+        st.error(f"❌ Erro ao abrir execução: {e}")
+        del st.session_state['execucao_aberta']
+    st.stop()
+
 # ETAPA 1: UPLOAD DO SHAPEFILE
 st.header("📂 1. Importar Projeto de Assentamento (PA)")
 st.caption("📋 Passo 1: Carregue os arquivos do mapa do assentamento")
@@ -225,170 +206,93 @@ with col2:
 st.info("💡 Dica: Você pode enviar apenas o arquivo de lotes — o perímetro será calculado automaticamente.")
 
 # Processar uploads - prioridade: lotes (se existir sozinho) ou perímetro
+# Estágio 'ingest': o parse só roda de novo se o conteúdo dos arquivos mudar
 if uploaded_parcelas is not None and uploaded_perimetro is None:
     # MODO: Só lotes - calcula perímetro automaticamente
     try:
+        def _ingest_lotes():
+            gdf_parcelas = ler_arquivo_geo(uploaded_parcelas.name, uploaded_parcelas.getvalue())
+            gdf_parcelas, gdf_perimetro, num_areas, sem_buracos = perimetro_dos_lotes(gdf_parcelas)
+            return {
+                'gdf': gdf_perimetro,
+                'gdf_parcelas': gdf_parcelas,
+                'num_areas': num_areas,
+                'sem_remocao_buracos': sem_buracos,
+                'area_ha': calcular_area_ha(gdf_perimetro),
+            }
         
-        if uploaded_parcelas.name.endswith('.zip'):
-            with tempfile.TemporaryDirectory() as tmpdir:
-                zip_path = os.path.join(tmpdir, "parcelas.zip")
-                with open(zip_path, "wb") as f:
-                    f.write(uploaded_parcelas.getbuffer())
-                
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(tmpdir)
-                
-                shp_files = [
-                    os.path.join(dp, fname)
-                    for dp, _, fnames in os.walk(tmpdir)
-                    for fname in fnames if fname.endswith('.shp')
-                ]
-                if len(shp_files) > 0:
-                    gdf_parcelas = gpd.read_file(shp_files[0])
-                    if not gdf_parcelas.crs or not gdf_parcelas.crs.equals("EPSG:4326"):
-                        gdf_parcelas = gdf_parcelas.to_crs("EPSG:4326")
-                    st.session_state.gdf_parcelas = gdf_parcelas
-                else:
-                    st.error("❌ Nenhum arquivo .shp encontrado no ZIP dos lotes.")
-                    st.info("💡 O ZIP deve conter os arquivos .shp, .dbf e .prj.")
-                    st.stop()
-
-        elif uploaded_parcelas.name.endswith(('.geojson', '.json')):
-            geojson_data = json.loads(uploaded_parcelas.read())
-            gdf_parcelas = gpd.GeoDataFrame.from_features(geojson_data['features'], crs="EPSG:4326")
-            if not gdf_parcelas.crs or not gdf_parcelas.crs.equals("EPSG:4326"):
-                gdf_parcelas = gdf_parcelas.to_crs("EPSG:4326")
-            st.session_state.gdf_parcelas = gdf_parcelas
-        
-        # Calcular perímetro a partir dos lotes - SEM divisões internas
-        
-        # Unir todos os lotes com validação de geometrias
-        try:
-            # Garantir geometrias válidas
-            st.session_state.gdf_parcelas['geometry'] = st.session_state.gdf_parcelas['geometry'].buffer(0)
-            uniao = unary_union(st.session_state.gdf_parcelas.geometry).buffer(0)
-        except Exception as e:
-            st.error(f"❌ Erro ao processar geometrias: {e}")
-            st.info("💡 Tente simplificar as geometrias ou usar outro arquivo.")
-            st.stop()
+        ingest = executar_estagio(
+            'ingest',
+            ['lotes', uploaded_parcelas.name, hashlib.sha256(uploaded_parcelas.getvalue()).hexdigest()],
+            _ingest_lotes
+        )
+        st.session_state.gdf_parcelas = ingest['gdf_parcelas']
+        st.session_state.gdf = ingest['gdf']
         
-        # Normalizar GeometryCollection → extrair só polígonos
-        if uniao.geom_type == 'GeometryCollection':
-            polys = [g for g in uniao.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
-            if not polys:
-                st.error("❌ Os lotes não contêm geometrias poligonais válidas.")
-                st.stop()
-            uniao = unary_union(polys)
-
-        # Remover buracos (holes) e manter só contornos externos
-        if uniao.geom_type == 'MultiPolygon':
-            poligonos_limpos = [Polygon(poly.exterior.coords) for poly in uniao.geoms]
-            perimetro_auto = MultiPolygon(poligonos_limpos)
-        elif uniao.geom_type == 'Polygon':
-            perimetro_auto = Polygon(uniao.exterior.coords)
-        else:
+        if ingest['sem_remocao_buracos']:
             st.warning("⚠️ Geometria inesperada — usando união direta sem remover buracos internos.")
-            perimetro_auto = uniao
-
-        gdf_perimetro = gpd.GeoDataFrame({'nome': ['PA']}, geometry=[perimetro_auto], crs="EPSG:4326")
-        st.session_state.gdf = gdf_perimetro
-        st.session_state.roi = None  # Será criado apenas quando necessário
-
-        num_areas = len(list(perimetro_auto.geoms)) if perimetro_auto.geom_type == 'MultiPolygon' else 1
         st.success(f"✅ {len(st.session_state.gdf_parcelas)} lotes carregados com sucesso!")
-        st.success(f"✅ Perímetro calculado automaticamente a partir dos lotes ({num_areas} área(s)).")
+        st.success(f"✅ Perímetro calculado automaticamente a partir dos lotes ({ingest['num_areas']} área(s)).")
         
-        area_ha = calcular_area_ha(st.session_state.gdf)
-        st.metric("📐 Área Total do PA", f"{area_ha:,.0f} ha")
+        st.metric("📐 Área Total do PA", f"{ingest['area_ha']:,.0f} ha")
 
+    except ValueError as e:
+        st.error(f"❌ Erro ao processar lotes: {e}")
+        st.info("💡 O ZIP deve conter os arquivos .shp, .dbf e .prj.")
+        st.stop()
     except Exception as e:
         st.error(f"❌ Erro ao processar lotes: {e}")
         st.code(traceback.format_exc())
         st.stop()
 
 elif uploaded_perimetro is not None:
+    def _ingest_perimetro():
+        saida = {'gdf': ler_arquivo_geo(uploaded_perimetro.name, uploaded_perimetro.getvalue()),
+                 'gdf_parcelas': None, 'erro_parcelas': None}
+        # Processar parcelas se foi enviado
+        if uploaded_parcelas is not None:
+            try:
+                saida['gdf_parcelas'] = ler_arquivo_geo(uploaded_parcelas.name, uploaded_parcelas.getvalue())
+            except Exception as e:
+                saida['erro_parcelas'] = str(e)
+        saida['area_ha'] = calcular_area_ha(saida['gdf'])
+        return saida
+    
     with st.spinner("🔄 Processando perímetro..."):
         try:
-            uploaded_file = uploaded_perimetro  # Usa o perímetro como principal
-            if uploaded_file.name.endswith('.zip'):
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    zip_path = os.path.join(tmpdir, "shapefile.zip")
-                    with open(zip_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        zip_ref.extractall(tmpdir)
-                    
-                    shp_files = [
-                        os.path.join(dp, fname)
-                        for dp, _, fnames in os.walk(tmpdir)
-                        for fname in fnames if fname.endswith('.shp')
-                    ]
-                    if len(shp_files) == 0:
-                        st.error("❌ Nenhum arquivo .shp encontrado no .zip")
-                        st.info("💡 O ZIP deve conter os arquivos .shp, .dbf e .prj.")
-                        st.stop()
-
-                    gdf = gpd.read_file(shp_files[0])
-                    if not gdf.crs or not gdf.crs.equals("EPSG:4326"):
-                        gdf = gdf.to_crs("EPSG:4326")
-                    st.session_state.gdf = gdf
-                    st.session_state.roi = None  # Será criado quando necessário
-
-            elif uploaded_file.name.endswith(('.geojson', '.json')):
-                geojson_data = json.loads(uploaded_file.read())
-                gdf = gpd.GeoDataFrame.from_features(geojson_data['features'], crs="EPSG:4326")
-                if not gdf.crs or not gdf.crs.equals("EPSG:4326"):
-                    gdf = gdf.to_crs("EPSG:4326")
-                
-                st.session_state.gdf = gdf
-                st.session_state.roi = None  # Será criado quando necessário
-            
-            st.success("✅ Arquivo carregado com sucesso!")
-            
+            ingest = executar_estagio(
+                'ingest',
+                ['perimetro', uploaded_perimetro.name, hashlib.sha256(uploaded_perimetro.getvalue()).hexdigest(),
+                 uploaded_parcelas.name if uploaded_parcelas is not None else None,
+                 hashlib.sha256(uploaded_parcelas.getvalue()).hexdigest() if uploaded_parcelas is not None else None],
+                _ingest_perimetro
+            )
+        except ValueError as e:
+            st.error(f"❌ {e}")
+            st.info("💡 O ZIP deve conter os arquivos .shp, .dbf e .prj.")
+            st.stop()
         except Exception as e:
             st.error(f"❌ Erro ao processar arquivo: {e}")
             st.stop()
-        
-        # Processar parcelas se foi enviado
-        if uploaded_parcelas is not None:
-            with st.spinner(f"🔄 Processando lotes..."):
-                try:
-                    if uploaded_parcelas.name.endswith('.zip'):
-                        with tempfile.TemporaryDirectory() as tmpdir:
-                            zip_path = os.path.join(tmpdir, "parcelas.zip")
-                            with open(zip_path, "wb") as f:
-                                f.write(uploaded_parcelas.getbuffer())
-                            
-                            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                                zip_ref.extractall(tmpdir)
-                            
-                            shp_files = [
-                                os.path.join(dp, fname)
-                                for dp, _, fnames in os.walk(tmpdir)
-                                for fname in fnames if fname.endswith('.shp')
-                            ]
-                            if len(shp_files) > 0:
-                                gdf_parcelas = gpd.read_file(shp_files[0])
-                                if not gdf_parcelas.crs or not gdf_parcelas.crs.equals("EPSG:4326"):
-                                    gdf_parcelas = gdf_parcelas.to_crs("EPSG:4326")
-                                st.session_state.gdf_parcelas = gdf_parcelas
-                                st.info(f"✅ Parcelas carregadas: {len(gdf_parcelas)} lotes")
-                                
-                    elif uploaded_parcelas.name.endswith(('.geojson', '.json')):
-                        geojson_data = json.loads(uploaded_parcelas.read())
-                        gdf_parcelas = gpd.GeoDataFrame.from_features(geojson_data['features'], crs="EPSG:4326")
-                        if not gdf_parcelas.crs or not gdf_parcelas.crs.equals("EPSG:4326"):
-                            gdf_parcelas = gdf_parcelas.to_crs("EPSG:4326")
-                        st.session_state.gdf_parcelas = gdf_parcelas
-                        st.info(f"✅ Parcelas carregadas: {len(gdf_parcelas)} lotes")
-                except Exception as e:
-                    st.warning(f"⚠️ Erro ao processar parcelas: {e}")
-        
-        area_ha = calcular_area_ha(st.session_state.gdf)
-        st.metric("📐 Área Total do PA", f"{area_ha:,.0f} ha")
+    
+    st.session_state.gdf = ingest['gdf']
+    st.success("✅ Arquivo carregado com sucesso!")
+    
+    if ingest['gdf_parcelas'] is not None:
+        st.session_state.gdf_parcelas = ingest['gdf_parcelas']
+        st.info(f"✅ Parcelas carregadas: {len(ingest['gdf_parcelas'])} lotes")
+    elif ingest['erro_parcelas']:
+        st.warning(f"⚠️ Erro ao processar parcelas: {ingest['erro_parcelas']}")
+    
+    st.metric("📐 Área Total do PA", f"{ingest['area_ha']:,.0f} ha")
 
 if st.session_state.gdf is not None:
+    # Daqui em diante há PA carregado: mapas, tabelas e geometrias
+    import folium
+    import pandas as pd
+    import shapely
+    from streamlit_folium import st_folium
+    
     st.markdown("---")
     
     st.header("📅 2. Selecionar Período de Análise")
@@ -422,6 +326,7 @@ if st.session_state.gdf is not None:
     col_btn1, col_btn2 = st.columns([3, 1])
     with col_btn2:
         if st.button("🔄 Recarregar Imagens", help="Apaga as imagens carregadas e busca novamente"):
+            invalidar_estagios('cenas')
             # Limpar imagens
             if 'img_anterior' in st.session_state:
                 del st.session_state.img_anterior
@@ -456,162 +361,73 @@ if st.session_state.gdf is not None:
     st.header("🛰️ 3. Buscar Imagens de Satélite")
     st.caption("Clique no botão para baixar automaticamente as imagens de satélite Landsat dos dois períodos selecionados.")
     
+    modo_busca = st.radio(
+        "Modo de busca",
+        ['Cena única (menor nuvem)', 'Composição mediana sem nuvens'],
+        horizontal=True,
+        key='modo_busca',
+        help="A composição mascara nuvens e sombras pixel a pixel (QA_PIXEL) e usa a mediana de todas as "
+             "cenas da janela — útil na estação chuvosa, quando nenhuma cena única cobre a área sem nuvens. "
+             "Nesse modo o limite de nuvens por cena não é aplicado."
+    )
+    
+    if not modo_busca.startswith('Composição'):
+        catalogo = resumo_catalogo()
+        st.caption(f"🗂️ Catálogo local: {catalogo['cenas']} cenas"
+                   + (f" (sincronizado em {catalogo['sincronizado_em']})" if catalogo['sincronizado_em'] else
+                      " — será preenchido na primeira busca"))
+    
+    # Entradas do estágio 'cenas' (também conferidas antes de gravar a execução)
+    entradas_cenas = [hash_estagio('roi'), data_anterior.isoformat(), data_posterior.isoformat(),
+                      modo_busca, None if modo_busca.startswith('Composição') else cloud_cover]
+    
     if st.button("🔍 Buscar Imagens", type="primary"):
         st.session_state.buscar_clicked = True
         st.rerun()
     
     if st.session_state.get('buscar_clicked', False):
-        st.session_state.buscar_clicked = False
         # Inicializar GEE apenas agora (lazy loading)
         inicializar_gee()
         
-        with st.spinner("Buscando imagens no Google Earth Engine..."):
-            try:
-                def apply_scale_factors(image):
-                    optical = image.select('SR_B.').multiply(0.0000275).add(-0.2)
-                    return image.addBands(optical, None, True)
-                
-                def buscar_imagem(start_date, roi, cloud_max):
-                    # Determinar ano para escolher Landsat correto
-                    year = int(start_date.split('-')[0])
-                    
-                    # Escolher coleção baseada no ano (igual GEE)
-                    if year <= 2011:
-                        collections = ['LANDSAT/LT05/C02/T1_L2']  # Landsat 5
-                    elif year <= 2013:
-                        collections = ['LANDSAT/LE07/C02/T1_L2', 'LANDSAT/LT05/C02/T1_L2']  # L7 ou L5
-                    elif year <= 2021:
-                        collections = ['LANDSAT/LC08/C02/T1_L2', 'LANDSAT/LE07/C02/T1_L2']  # L8 ou L7
-                    else:
-                        collections = ['LANDSAT/LC09/C02/T1_L2', 'LANDSAT/LC08/C02/T1_L2']  # L9 ou L8
-                    
-                    # Obter bounds do ROI
-                    roi_bounds = roi.bounds().getInfo()['coordinates'][0]
-                    roi_lons = [p[0] for p in roi_bounds]
-                    roi_lats = [p[1] for p in roi_bounds]
-                    roi_min_lon, roi_max_lon = min(roi_lons), max(roi_lons)
-                    roi_min_lat, roi_max_lat = min(roi_lats), max(roi_lats)
-                    
-                    for col_name in collections:
-                        collection = ee.ImageCollection(col_name) \
-                            .filterBounds(roi) \
-                            .filterDate(
-                                ee.Date(start_date).advance(-6, 'month'),
-                                ee.Date(start_date).advance(12, 'month')
-                            ) \
-                            .filter(ee.Filter.lt('CLOUD_COVER', cloud_max)) \
-                            .sort('CLOUD_COVER')
-                        
-                        # Verificar cada imagem até encontrar uma que cubra completamente
-                        size = collection.size().getInfo()
-                        if size > 0:
-                            col_list = collection.toList(size)
-                            for i in range(min(size, 10)):  # Tentar até 10 imagens
-                                img = ee.Image(col_list.get(i))
-                                # Verificar cobertura real pelo footprint da cena (não bounding box)
-                                if img.geometry().contains(roi, maxError=100).getInfo():
-                                    return img.set('collection', col_name)
-                    
-                    # ── Fallback: mosaico de rows adjacentes (mesma data e path) ──
-                    for col_name in collections:
-                        collection = ee.ImageCollection(col_name) \
-                            .filterBounds(roi) \
-                            .filterDate(
-                                ee.Date(start_date).advance(-6, 'month'),
-                                ee.Date(start_date).advance(12, 'month')
-                            ) \
-                            .filter(ee.Filter.lt('CLOUD_COVER', cloud_max)) \
-                            .sort('CLOUD_COVER')
-
-                        # Uma única chamada ao servidor: retorna props + geometria de todas as imagens
-                        col_info = collection.limit(20).getInfo()
-                        features = col_info.get('features', [])
-                        if len(features) < 2:
-                            continue
-
-                        imgs_info = []
-                        for feature in features:
-                            props = feature['properties']
-                            geom = feature['geometry']
-                            coords = (geom['coordinates'][0] if geom['type'] == 'Polygon'
-                                      else [c for ring in geom['coordinates'] for c in ring[0]])
-                            imgs_info.append({
-                                'img': ee.Image(feature['id']),
-                                'props': props,
-                                'bounds': coords
-                            })
-
-                        # Agrupar por path + data (mesmo sobrevoo)
-                        grupos = {}
-                        for info in imgs_info:
-                            chave = (info['props'].get('WRS_PATH'), info['props'].get('DATE_ACQUIRED'))
-                            if chave not in grupos:
-                                grupos[chave] = []
-                            grupos[chave].append(info)
-
-                        # Verificar pares com rows adjacentes
-                        for chave, grupo in grupos.items():
-                            if len(grupo) < 2:
-                                continue
-                            grupo.sort(key=lambda x: x['props'].get('WRS_ROW', 0))
-                            for j in range(len(grupo) - 1):
-                                i1, i2 = grupo[j], grupo[j + 1]
-                                row1 = i1['props'].get('WRS_ROW', 0)
-                                row2 = i2['props'].get('WRS_ROW', 0)
-                                if abs(row1 - row2) != 1:
-                                    continue
-                                lons = [p[0] for p in i1['bounds']] + [p[0] for p in i2['bounds']]
-                                lats = [p[1] for p in i1['bounds']] + [p[1] for p in i2['bounds']]
-                                if (min(lons) <= roi_min_lon and max(lons) >= roi_max_lon and
-                                        min(lats) <= roi_min_lat and max(lats) >= roi_max_lat):
-                                    mosaic = ee.ImageCollection([i1['img'], i2['img']]).mosaic()
-                                    mosaic = mosaic \
-                                        .set('system:time_start', i1['props']['system:time_start']) \
-                                        .set('SPACECRAFT_ID', i1['props']['SPACECRAFT_ID']) \
-                                        .set('CLOUD_COVER', max(
-                                            i1['props'].get('CLOUD_COVER', 0),
-                                            i2['props'].get('CLOUD_COVER', 0)
-                                        )) \
-                                        .set('collection', col_name)
-                                    return mosaic
-
-                    return None
-
-                st.write("🔍 Buscando imagens de satélite que cobrem completamente a área...")
-                
-                # Obter ROI (cria ee.Geometry apenas agora)
-                roi = obter_roi()
-                
-                with st.spinner("Buscando imagem ANTERIOR..."):
-                    img_ant = buscar_imagem(data_anterior.strftime('%Y-%m-%d'), roi, cloud_cover)
-                
-                with st.spinner("Buscando imagem POSTERIOR..."):
-                    img_pos = buscar_imagem(data_posterior.strftime('%Y-%m-%d'), roi, cloud_cover)
+        try:
+            # Obter ROI (cria ee.Geometry apenas agora)
+            roi = obter_roi()
+            # Polígono real do ROI para checar cobertura localmente
+            roi_local = shapely.make_valid(st.session_state.gdf.geometry.iloc[0])
+            # Na primeira busca o estágio 'roi' só passa a existir agora: refaz a entrada com o hash dele
+            entradas_cenas = [hash_estagio('roi'), *entradas_cenas[1:]]
+            
+            # Estágio 'cenas' em segundo plano: mesma área, datas, nuvens e modo → reaproveita a busca anterior;
+            # enquanto a busca roda, o progresso aparece aqui e a sessão segue livre
+            cenas = estagio_em_segundo_plano(
+                'cenas', 'cenas', entradas_cenas, "Busca de imagens", buscar_cenas_periodos,
+                data_anterior.strftime('%Y-%m-%d'), data_posterior.strftime('%Y-%m-%d'),
+                modo_busca.startswith('Composição'), cloud_cover, roi, roi_local,
+                total_etapas=3 if modo_busca.startswith('Composição') else 2
+            )
+            
+            if cenas is not None:
+                st.session_state.buscar_clicked = False
+                img_ant, img_pos = cenas['img_ant'], cenas['img_pos']
                 
                 if img_ant is None:
+                    invalidar_estagios('cenas')
                     st.error(f"❌ Nenhuma imagem encontrada para {data_anterior}")
                     st.stop()
                 
                 if img_pos is None:
+                    invalidar_estagios('cenas')
                     st.error(f"❌ Nenhuma imagem encontrada para {data_posterior}")
                     st.stop()
                 
-                img_ant = apply_scale_factors(img_ant)
-                img_pos = apply_scale_factors(img_pos)
-                
-                date_ant = img_ant.date().format('YYYY-MM-dd').getInfo()
-                cloud_ant = img_ant.get('CLOUD_COVER').getInfo()
-                sat_ant = img_ant.get('SPACECRAFT_ID').getInfo()
-                
-                date_pos = img_pos.date().format('YYYY-MM-dd').getInfo()
-                cloud_pos = img_pos.get('CLOUD_COVER').getInfo()
-                sat_pos = img_pos.get('SPACECRAFT_ID').getInfo()
+                date_ant, cloud_ant, sat_ant = cenas['date_ant'], cenas['cloud_ant'], cenas['sat_ant']
+                date_pos, cloud_pos, sat_pos = cenas['date_pos'], cenas['cloud_pos'], cenas['sat_pos']
                 
                 # DEBUG: Mostrar IDs das imagens
                 with st.expander("🔍 Informações Técnicas"):
                     try:
-                        id_ant = img_ant.id().getInfo()
-                        id_pos = img_pos.id().getInfo()
+                        id_ant = cenas['id_ant']
+                        id_pos = cenas['id_pos']
                         
                         col_debug1, col_debug2 = st.columns(2)
                         with col_debug1:
@@ -640,13 +456,19 @@ if st.session_state.gdf is not None:
                 with col1:
                     st.write("**📸 Imagem Anterior:**")
                     st.write(f"📅 Data: {date_ant}")
-                    st.write(f"☁️ Nuvens: {cloud_ant:.1f}%")
+                    if cenas.get('cloud_cena_ant') is not None:
+                        st.write(f"☁️ Nuvens no PA: {cloud_ant:.1f}% (cena inteira: {cenas['cloud_cena_ant']:.1f}%)")
+                    else:
+                        st.write(f"☁️ Nuvens: {cloud_ant:.1f}%")
                     st.write(f"🛰️ Satélite: {sat_ant}")
                 
                 with col2:
                     st.write("**📸 Imagem Posterior:**")
                     st.write(f"📅 Data: {date_pos}")
-                    st.write(f"☁️ Nuvens: {cloud_pos:.1f}%")
+                    if cenas.get('cloud_cena_pos') is not None:
+                        st.write(f"☁️ Nuvens no PA: {cloud_pos:.1f}% (cena inteira: {cenas['cloud_cena_pos']:.1f}%)")
+                    else:
+                        st.write(f"☁️ Nuvens: {cloud_pos:.1f}%")
                     st.write(f"🛰️ Satélite: {sat_pos}")
                 
                 # VERIFICAÇÃO CRÍTICA: Datas iguais
@@ -702,10 +524,11 @@ if st.session_state.gdf is not None:
                 
                 # Salvar flag para mostrar mapas
                 st.session_state.mostrar_mapas_rgb = True
-                
-            except Exception as e:
-                st.error(f"❌ Erro: {e}")
-                st.code(traceback.format_exc())
+            
+        except Exception as e:
+            st.session_state.buscar_clicked = False
+            st.error(f"❌ Erro: {e}")
+            st.code(traceback.format_exc())
     
     # VISUALIZAÇÃO DOS MAPAS RGB - FORA DO BOTÃO
     if st.session_state.img_anterior is not None and st.session_state.get('mostrar_mapas_rgb', False):
@@ -715,8 +538,8 @@ if st.session_state.gdf is not None:
         date_pos = st.session_state.date_pos
         
         # Parâmetros de visualização
-        sat_ant = st.session_state.get('sat_ant_id') or st.session_state.img_anterior.get('SPACECRAFT_ID').getInfo()
-        sat_pos = st.session_state.get('sat_pos_id') or st.session_state.img_posterior.get('SPACECRAFT_ID').getInfo()
+        sat_ant = st.session_state.get('sat_ant_id') or obter_info(st.session_state.img_anterior.get('SPACECRAFT_ID'))
+        sat_pos = st.session_state.get('sat_pos_id') or obter_info(st.session_state.img_posterior.get('SPACECRAFT_ID'))
         
         if 'LANDSAT_5' in sat_ant or 'LT05' in sat_ant:
             vis_params_ant = {'bands': ['SR_B3', 'SR_B2', 'SR_B1'], 'min': 0.02, 'max': 0.35, 'gamma': 1.3}
@@ -729,8 +552,17 @@ if st.session_state.gdf is not None:
             vis_params_pos = {'bands': ['SR_B4', 'SR_B3', 'SR_B2'], 'min': 0.02, 'max': 0.35, 'gamma': 1.3}
         
         # Criar tile layers
-        tile_url_ant = st.session_state.img_anterior.resample('bilinear').getMapId({**vis_params_ant, 'bestEffort': True})
-        tile_url_pos = st.session_state.img_posterior.resample('bilinear').getMapId({**vis_params_pos, 'bestEffort': True})
+        # Estágio 'tiles_rgb': getMapId só quando as cenas ou a visualização mudam
+        tile_url_ant, tile_url_pos = executar_estagio(
+            'tiles_rgb',
+            [st.session_state.img_anterior, st.session_state.img_posterior, vis_params_ant, vis_params_pos],
+            lambda: (
+                agendador_gee().executar(st.session_state.img_anterior.resample('bilinear').getMapId,
+                                         {**vis_params_ant, 'bestEffort': True}),
+                agendador_gee().executar(st.session_state.img_posterior.resample('bilinear').getMapId,
+                                         {**vis_params_pos, 'bestEffort': True}),
+            )
+        )
         
         col1, col2 = st.columns(2)
         
@@ -789,8 +621,9 @@ if st.session_state.gdf is not None:
         # Expander de DEBUG
         with st.expander("🔍 Informações Técnicas"):
             try:
-                id_ant = st.session_state.img_anterior.id().getInfo()
-                id_pos = st.session_state.img_posterior.id().getInfo()
+                _cenas = saida_estagio('cenas') or {}
+                id_ant = _cenas.get('id_ant') or obter_info(st.session_state.img_anterior.id())
+                id_pos = _cenas.get('id_pos') or obter_info(st.session_state.img_posterior.id())
                 
                 col_debug1, col_debug2 = st.columns(2)
                 with col_debug1:
@@ -1025,7 +858,7 @@ if st.session_state.gdf is not None:
                 data_exibida = st.session_state.date_ant
                 if 'sat_ant_id' not in st.session_state:
                     st.session_state.sat_ant_id = (
-                        st.session_state.img_anterior.get('SPACECRAFT_ID').getInfo())
+                        obter_info(st.session_state.img_anterior.get('SPACECRAFT_ID')))
                 sat_exibido = st.session_state.sat_ant_id
                 img_para_mapa = st.session_state.img_anterior
                 data_mapa = st.session_state.date_ant
@@ -1033,7 +866,7 @@ if st.session_state.gdf is not None:
                 data_exibida = st.session_state.date_pos
                 if 'sat_pos_id' not in st.session_state:
                     st.session_state.sat_pos_id = (
-                        st.session_state.img_posterior.get('SPACECRAFT_ID').getInfo())
+                        obter_info(st.session_state.img_posterior.get('SPACECRAFT_ID')))
                 sat_exibido = st.session_state.sat_pos_id
                 img_para_mapa = st.session_state.img_posterior
                 data_mapa = st.session_state.date_pos
@@ -1069,8 +902,8 @@ if st.session_state.gdf is not None:
                         'bands': ['SR_B4', 'SR_B3', 'SR_B2'],
                         'min': 0.02, 'max': 0.35, 'gamma': 1.3
                     }
-                tile_info = img_para_mapa.resample('bilinear').getMapId(
-                    {**vis_params, 'bestEffort': True})
+                tile_info = agendador_gee().executar(img_para_mapa.resample('bilinear').getMapId,
+                                                     {**vis_params, 'bestEffort': True})
                 st.session_state[tile_cache_key] = tile_info['tile_fetcher'].url_format
 
             folium.TileLayer(
@@ -1271,11 +1104,33 @@ if st.session_state.gdf is not None:
         st.header("⚙️ 5. Processar Análise")
         st.caption("Quando terminar de marcar os exemplos nos dois períodos, clique no botão abaixo para iniciar a análise. O processo leva alguns minutos.")
         
+        # Registro de modelos: um período pode ser classificado com um classificador já treinado
+        # (outro PA ou outro ano do mesmo sensor), sem amostras e sem treino
+        modelos_escolhidos = {}
+        modelos_compativeis = {
+            p: listar_modelos(st.session_state[f'sat_{p}_id']) if st.session_state.get(f'sat_{p}_id') else []
+            for p in ('ant', 'pos')
+        }
+        if any(modelos_compativeis.values()):
+            with st.expander("📚 Usar modelo registrado (sem amostras nem treino)"):
+                st.caption("Só aparecem modelos do mesmo sensor e esquema de bandas da cena de cada período. "
+                           "Sem amostras de validação, a acurácia do período não é recalculada.")
+                for p, rotulo in (('ant', 'Período anterior'), ('pos', 'Período posterior')):
+                    opcoes = {m['modelo_id']: m for m in modelos_compativeis[p]}
+                    escolhido = st.selectbox(
+                        f"{rotulo} ({st.session_state.get(f'sat_{p}_id')})",
+                        [None, *opcoes],
+                        format_func=lambda m, opcoes=opcoes: "Treinar com as amostras coletadas" if m is None else rotulo_modelo(opcoes[m]),
+                        key=f'modelo_escolhido_{p}'
+                    )
+                    if escolhido is not None:
+                        modelos_escolhidos[p] = carregar_modelo(escolhido)
+        
         avisos = []
         
-        if total_ant == 0:
+        if total_ant == 0 and 'ant' not in modelos_escolhidos:
             avisos.append("❌ Nenhuma amostra coletada para o período anterior!")
-        if total_pos == 0:
+        if total_pos == 0 and 'pos' not in modelos_escolhidos:
             avisos.append("❌ Nenhuma amostra coletada para o período posterior!")
         
         for tipo in tipos_cobertura.keys():
@@ -1291,14 +1146,18 @@ if st.session_state.gdf is not None:
         classes_com_amostras_ant = sum(1 for tipo in tipos_cobertura.keys() if len(st.session_state.amostras_anterior[tipo]) > 0)
         classes_com_amostras_pos = sum(1 for tipo in tipos_cobertura.keys() if len(st.session_state.amostras_posterior[tipo]) > 0)
         
+        # Período com modelo registrado não precisa de amostras (a série anual e o multi-PA ainda precisam)
+        faltam_classes_ant = classes_com_amostras_ant < 2 and 'ant' not in modelos_escolhidos
+        faltam_classes_pos = classes_com_amostras_pos < 2 and 'pos' not in modelos_escolhidos
+        
         # VALIDAÇÃO CRÍTICA: Precisa de pelo menos 2 classes
-        if classes_com_amostras_ant < 2:
+        if faltam_classes_ant:
             st.error(f"🚨 PERÍODO ANTERIOR: {classes_com_amostras_ant} classe(s) coletada(s)")
             st.error("❌ INSUFICIENTE! Mínimo necessário: 2 classes")
             st.info("✅ Exemplo válido: Floresta (10 amostras) + Pastagem (10 amostras)")
             avisos.append("❌ BLOQUEADO: Período anterior precisa de 2+ classes")
         
-        if classes_com_amostras_pos < 2:
+        if faltam_classes_pos:
             st.error(f"🚨 PERÍODO POSTERIOR: {classes_com_amostras_pos} classe(s) coletada(s)")
             st.error("❌ INSUFICIENTE! Mínimo necessário: 2 classes")
             st.info("✅ Exemplo válido: Floresta (10 amostras) + Pastagem (10 amostras)")
@@ -1306,16 +1165,33 @@ if st.session_state.gdf is not None:
         
         if avisos:
             st.warning('\n\n'.join(avisos))
-            if classes_com_amostras_ant >= 2 and classes_com_amostras_pos >= 2:
+            if not faltam_classes_ant and not faltam_classes_pos:
                 st.info("💡 Você pode continuar, mas a acurácia pode ser menor.")
         
         # Desabilitar botão se não tiver classes suficientes
         botao_desabilitado = classes_com_amostras_ant < 2 or classes_com_amostras_pos < 2
         
-        if st.button("🚀 Iniciar Análise de Desmatamento", type="primary", disabled=botao_desabilitado):
+        # Janela de amostragem do treino: muda o conjunto de treino, então entra na impressão da classificação
+        janela_amostragem = st.selectbox(
+            "🔲 Pixels lidos por ponto de treino", list(OPCOES_JANELA_AMOSTRAGEM),
+            index=list(OPCOES_JANELA_AMOSTRAGEM).index(JANELA_AMOSTRAGEM),
+            format_func=OPCOES_JANELA_AMOSTRAGEM.get, key='janela_amostragem',
+            help="Janela k×k na grade da cena em torno de cada ponto (janelas com pixel mascarado são descartadas). "
+                 "Trocar a janela retreina os dois períodos."
+        )
+        
+        st.toggle(f"⚡ Prévia rápida ({ESCALA_PREVIA} m)", key='modo_previa',
+                  help=f"Mapas e áreas de mudança em {ESCALA_PREVIA} m: áreas aproximadas em segundos, para conferir as "
+                       "amostras. Depois, a resolução completa (30 m) reaproveita treino, classificação e acurácia.")
+        
+        if st.button("🚀 Iniciar Análise de Desmatamento", type="primary", disabled=faltam_classes_ant or faltam_classes_pos):
             # ===== VERIFICAÇÃO FAILSAFE (dupla segurança) =====
             classes_ant_final = sum(1 for tipo in tipos_cobertura.keys() if len(st.session_state.amostras_anterior[tipo]) > 0)
             classes_pos_final = sum(1 for tipo in tipos_cobertura.keys() if len(st.session_state.amostras_posterior[tipo]) > 0)
+            if 'ant' in modelos_escolhidos:
+                classes_ant_final = len(modelos_escolhidos['ant']['class_names'])
+            if 'pos' in modelos_escolhidos:
+                classes_pos_final = len(modelos_escolhidos['pos']['class_names'])
             
             if classes_ant_final < 2:
                 st.error(f"🚨 BLOQUEADO: Período Anterior tem {classes_ant_final} classe(s)")
@@ -1338,235 +1214,218 @@ if st.session_state.gdf is not None:
                 st.error("❌ Erro: ROI não pôde ser criado. Reimporte o perímetro.")
                 st.stop()
             
-            with st.spinner("Processando... Isso pode levar alguns minutos..."):
+            # Estágios 'classificacao_ant' / 'classificacao_pos': impressão por período (cena, amostras,
+            # parâmetros do RF e ROI; ou cena, modelo registrado e ROI). Só o período cuja impressão mudou
+            # é retreinado e reclassificado; o outro reaproveita classificador, imagem classificada e acurácia.
+            impressoes = {
+                'ant': impressao('classificacao_ant', st.session_state.img_anterior, st.session_state.amostras_anterior,
+                                 PARAMS_RF, janela_amostragem, hash_estagio('roi')),
+                'pos': impressao('classificacao_pos', st.session_state.img_posterior, st.session_state.amostras_posterior,
+                                 PARAMS_RF, janela_amostragem, hash_estagio('roi')),
+            }
+            imagens = {'ant': st.session_state.img_anterior, 'pos': st.session_state.img_posterior}
+            for p, modelo in modelos_escolhidos.items():
+                impressoes[p] = impressao(f'classificacao_{p}', imagens[p], 'modelo', modelo['modelo_id'], hash_estagio('roi'))
+            periodos = tuple(
+                p for p in ('ant', 'pos')
+                if not estagio_em_cache(f'classificacao_{p}', impressoes[p]) or f'classified_{p}' not in st.session_state
+            )
+            h_classificacao = impressao('classificacao', impressoes['ant'], impressoes['pos'])
+            # Identidade de cada período para o diff por lote: cena e modelo registrado (ou amostras, parâmetros
+            # do RF e janela) — sem o ROI, que muda quando só o perímetro é revisado
+            _ids_cenas = saida_estagio('cenas') if estagio_em_cache('cenas', impressao('cenas', entradas_cenas)) else {}
+            identidades = {
+                p: impressao(_ids_cenas.get(f'id_{p}') or imagens[p],
+                             ['modelo', modelos_escolhidos[p]['modelo_id']] if p in modelos_escolhidos
+                             else [amostras_periodo, PARAMS_RF, janela_amostragem])
+                for p, amostras_periodo in (('ant', st.session_state.amostras_anterior),
+                                            ('pos', st.session_state.amostras_posterior))
+            }
+            if not periodos:
+                st.info("♻️ Imagens e amostras não mudaram desde a última análise — resultados reaproveitados.")
+            else:
+                if periodos == ('pos',):
+                    st.info("♻️ Período anterior sem mudanças — classificação reaproveitada; só o posterior será reclassificado.")
+                elif periodos == ('ant',):
+                    st.info("♻️ Período posterior sem mudanças — classificação reaproveitada; só o anterior será reclassificado.")
                 try:
-                    def preparar_bandas(image, is_l5=False):
-                        if is_l5:
-                            bands = image.select(['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'])
-                            ndvi = image.normalizedDifference(['SR_B4', 'SR_B3']).rename('NDVI')
-                            savi = image.expression(
-                                '(((NIR - RED) / (NIR + RED + 0.5))*(1+0.5))',
-                                {'NIR': image.select('SR_B4'), 'RED': image.select('SR_B3')}
-                            ).rename('SAVI')
-                            nbr = image.normalizedDifference(['SR_B4', 'SR_B7']).rename('NBR')
-                            mndwi = image.normalizedDifference(['SR_B2', 'SR_B5']).rename('MNDWI')
-                        else:
-                            bands = image.select(['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'])
-                            ndvi = image.normalizedDifference(['SR_B5', 'SR_B4']).rename('NDVI')
-                            savi = image.expression(
-                                '(((NIR - RED) / (NIR + RED + 0.5))*(1+0.5))',
-                                {'NIR': image.select('SR_B5'), 'RED': image.select('SR_B4')}
-                            ).rename('SAVI')
-                            nbr = image.normalizedDifference(['SR_B5', 'SR_B7']).rename('NBR')
-                            mndwi = image.normalizedDifference(['SR_B3', 'SR_B6']).rename('MNDWI')
-                        
-                        return bands.addBands(ndvi).addBands(savi).addBands(nbr).addBands(mndwi)
-                    
-                    sat_ant = st.session_state.get('sat_ant_id') or st.session_state.img_anterior.get('SPACECRAFT_ID').getInfo()
-                    sat_pos = st.session_state.get('sat_pos_id') or st.session_state.img_posterior.get('SPACECRAFT_ID').getInfo()
-
-                    is_l5_ant = 'LANDSAT_5' in sat_ant or 'LT05' in sat_ant
-                    is_l5_pos = 'LANDSAT_5' in sat_pos or 'LT05' in sat_pos
-                    
-                    bands_ant = preparar_bandas(st.session_state.img_anterior, is_l5_ant)
-                    bands_pos = preparar_bandas(st.session_state.img_posterior, is_l5_pos)
-                    
-                    def criar_samples(amostras_dict, class_map):
-                        features = []
-                        for tipo, pontos in amostras_dict.items():
-                            if len(pontos) > 0:
-                                class_num = class_map[tipo]
-                                for ponto in pontos:
-                                    features.append(ee.Feature(
-                                        ee.Geometry.Point(ponto),
-                                        {'class': class_num}
-                                    ))
-                        return ee.FeatureCollection(features)
-                    
                     class_map = {tipo: i for i, tipo in enumerate(tipos_cobertura.keys())}
-                    
-                    samples_ant_all = criar_samples(st.session_state.amostras_anterior, class_map)
-                    samples_pos_all = criar_samples(st.session_state.amostras_posterior, class_map)
-                    
-                    n_samples_ant = samples_ant_all.size().getInfo()
-                    n_samples_pos = samples_pos_all.size().getInfo()
-                    
-                    st.info(f"📊 Total de amostras: Anterior={n_samples_ant}, Posterior={n_samples_pos}")
-
-                    # Split adaptativo baseado na menor classe de cada período
-                    min_ant = min((len(v) for v in st.session_state.amostras_anterior.values() if v), default=0)
-                    min_pos = min((len(v) for v in st.session_state.amostras_posterior.values() if v), default=0)
-
-                    if min_ant < 6:
-                        split_ant = None
-                        st.warning("⚠️ Período Anterior: alguma classe tem menos de 6 amostras. Usando todos os pontos para treino — indicadores de acurácia não serão calculados.")
-                    elif min_ant < 10:
-                        split_ant = 0.8
-                        st.info("ℹ️ Período Anterior: poucas amostras — usando divisão 80/20 para maximizar o treino.")
-                    else:
-                        split_ant = 0.7
-
-                    if min_pos < 6:
-                        split_pos = None
-                        st.warning("⚠️ Período Posterior: alguma classe tem menos de 6 amostras. Usando todos os pontos para treino — indicadores de acurácia não serão calculados.")
-                    elif min_pos < 10:
-                        split_pos = 0.8
-                        st.info("ℹ️ Período Posterior: poucas amostras — usando divisão 80/20 para maximizar o treino.")
-                    else:
-                        split_pos = 0.7
-
-                    # Split treino/validação com randomColumn
-                    if split_ant is not None:
-                        samples_ant_all = samples_ant_all.randomColumn('random', seed=0)
-                        training_ant   = samples_ant_all.filter(ee.Filter.lt('random', split_ant))
-                        validation_ant = samples_ant_all.filter(ee.Filter.gte('random', split_ant))
-                    else:
-                        training_ant   = samples_ant_all
-                        validation_ant = None
-
-                    if split_pos is not None:
-                        samples_pos_all = samples_pos_all.randomColumn('random', seed=42)
-                        training_pos   = samples_pos_all.filter(ee.Filter.lt('random', split_pos))
-                        validation_pos = samples_pos_all.filter(ee.Filter.gte('random', split_pos))
-                    else:
-                        training_pos   = samples_pos_all
-                        validation_pos = None
-
-                    # Verificar tamanho da validação antes de prosseguir
-                    if validation_ant is not None:
-                        n_val_ant = validation_ant.size().getInfo()
-                        if n_val_ant == 0:
-                            st.error("❌ Validação ANTERIOR vazia após split! Colete mais amostras (mínimo 10 por classe).")
-                            st.stop()
-                    if validation_pos is not None:
-                        n_val_pos = validation_pos.size().getInfo()
-                        if n_val_pos == 0:
-                            st.error("❌ Validação POSTERIOR vazia após split! Colete mais amostras (mínimo 10 por classe).")
-                            st.stop()
-
-                    # Buffer 30m por ponto de treino → captura ~5 pixels por amostra (replica GEE original)
-                    training_ant_buf = training_ant.map(lambda f: f.buffer(30))
-                    training_data_ant = bands_ant.sampleRegions(
-                        collection=training_ant_buf,
-                        properties=['class'],
-                        scale=30
-                    )
-                    
-                    # Verificar amostras extraídas
-                    n_training_ant = training_data_ant.size().getInfo()
-                    
-                    if n_training_ant == 0:
-                        st.error("❌ Amostras ANTERIOR fora da imagem!")
-                        st.stop()
-                    
-                    # VALIDAÇÃO CRÍTICA: Verificar classes únicas
-                    classes_unicas_ant = training_data_ant.aggregate_array('class').distinct().size().getInfo()
-                    st.info(f"🎯 Período ANTERIOR: {n_training_ant} amostras, {classes_unicas_ant} classes")
-                    
-                    if classes_unicas_ant < 2:
-                        st.error(f"❌ ERRO: Apenas {classes_unicas_ant} classe no período ANTERIOR!")
-                        st.error("💡 Colete amostras de pelo menos 2 tipos diferentes")
-                        st.stop()
-                    
-                    classifier_ant = ee.Classifier.smileRandomForest(
-                        numberOfTrees=50,
-                        minLeafPopulation=5,
-                        bagFraction=0.5
-                    ).train(
-                        features=training_data_ant,
-                        classProperty='class',
-                        inputProperties=bands_ant.bandNames()
-                    )
-                    
-                    training_pos_buf = training_pos.map(lambda f: f.buffer(30))
-                    training_data_pos = bands_pos.sampleRegions(
-                        collection=training_pos_buf,
-                        properties=['class'],
-                        scale=30
+                    # Cópias: a coleta pode continuar enquanto a tarefa roda
+                    amostras_ant = {t: list(p) for t, p in st.session_state.amostras_anterior.items()}
+                    amostras_pos = {t: list(p) for t, p in st.session_state.amostras_posterior.items()}
+                
+                    samples_ant_all, samples_pos_all = executar_estagio(
+                        'amostras',
+                        [amostras_ant, amostras_pos],
+                        lambda: (criar_samples(amostras_ant, class_map), criar_samples(amostras_pos, class_map))
                     )
-                    
-                    # Verificar amostras extraídas
-                    n_training_pos = training_data_pos.size().getInfo()
-                    
-                    if n_training_pos == 0:
-                        st.error("❌ Amostras POSTERIOR fora da imagem!")
-                        st.stop()
-                    
-                    # VALIDAÇÃO CRÍTICA: Verificar classes únicas
-                    classes_unicas_pos = training_data_pos.aggregate_array('class').distinct().size().getInfo()
-                    st.info(f"🎯 Período POSTERIOR: {n_training_pos} amostras, {classes_unicas_pos} classes")
-                    
-                    if classes_unicas_pos < 2:
-                        st.error(f"❌ ERRO: Apenas {classes_unicas_pos} classe no período POSTERIOR!")
-                        st.error("💡 Colete amostras de pelo menos 2 tipos diferentes")
-                        st.stop()
-                    
-                    classifier_pos = ee.Classifier.smileRandomForest(
-                        numberOfTrees=50,
-                        minLeafPopulation=5,
-                        bagFraction=0.5
-                    ).train(
-                        features=training_data_pos,
-                        classProperty='class',
-                        inputProperties=bands_pos.bandNames()
+                
+                    sat_ant = st.session_state.get('sat_ant_id') or obter_info(st.session_state.img_anterior.get('SPACECRAFT_ID'))
+                    sat_pos = st.session_state.get('sat_pos_id') or obter_info(st.session_state.img_posterior.get('SPACECRAFT_ID'))
+                
+                    def _aplicar_classificacao(resultado, h=h_classificacao, impressoes=impressoes, periodos=periodos,
+                                               janela=janela_amostragem, identidades=identidades):
+                        st.session_state.update(resultado)
+                        st.session_state['janela_classificacao'] = janela
+                        st.session_state.update({f'identidade_{p}': identidades[p] for p in ('ant', 'pos')})
+                        for p in periodos:
+                            registrar_estagio(f'classificacao_{p}', impressoes[p], p)
+                        st.session_state['run_id'] = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+                        registrar_estagio('classificacao', h, st.session_state['run_id'])
+                
+                    # Treino + classificação + acurácia em segundo plano; a sessão segue livre
+                    submeter_tarefa(
+                        'classificacao', "Classificação", classificar_periodos,
+                        st.session_state.img_anterior, st.session_state.img_posterior, sat_ant, sat_pos,
+                        samples_ant_all, samples_pos_all, amostras_ant, amostras_pos, roi, periodos,
+                        {p: m for p, m in modelos_escolhidos.items() if p in periodos}, janela_amostragem,
+                        total_etapas=1 + sum(1 if p in modelos_escolhidos else 2 for p in periodos),
+                        ao_concluir=_aplicar_classificacao, hash_entradas=h_classificacao
                     )
-                    
-                    classified_ant = bands_ant.classify(classifier_ant).clip(st.session_state.roi)
-                    classified_pos = bands_pos.classify(classifier_pos).clip(st.session_state.roi)
-                    
-                    st.info("📊 Calculando acurácia...")
-
-                    # Validação ANTERIOR
-                    if validation_ant is not None:
-                        test_ant = classified_ant.sampleRegions(
-                            collection=validation_ant,
-                            properties=['class'],
-                            scale=30
-                        )
-                        confusion_ant = test_ant.errorMatrix('class', 'classification')
-                        accuracy_ant = confusion_ant.accuracy().getInfo()
-                        kappa_ant = confusion_ant.kappa().getInfo()
-                        matrix_ant = confusion_ant.getInfo()
-                    else:
-                        accuracy_ant = kappa_ant = matrix_ant = None
-
-                    # Validação POSTERIOR
-                    if validation_pos is not None:
-                        test_pos = classified_pos.sampleRegions(
-                            collection=validation_pos,
-                            properties=['class'],
-                            scale=30
-                        )
-                        confusion_pos = test_pos.errorMatrix('class', 'classification')
-                        accuracy_pos = confusion_pos.accuracy().getInfo()
-                        kappa_pos = confusion_pos.kappa().getInfo()
-                        matrix_pos = confusion_pos.getInfo()
-                    else:
-                        accuracy_pos = kappa_pos = matrix_pos = None
-                    
-                    # Nomes de classes como dict {índice: nome} — robusto contra gaps na sequência
-                    class_names_ant = {class_map[t]: t for t in tipos_cobertura.keys()
-                                       if len(st.session_state.amostras_anterior[t]) > 0}
-                    class_names_pos = {class_map[t]: t for t in tipos_cobertura.keys()
-                                       if len(st.session_state.amostras_posterior[t]) > 0}
-
-                    st.session_state['classified_ant'] = classified_ant
-                    st.session_state['classified_pos'] = classified_pos
-                    st.session_state['accuracy_ant'] = accuracy_ant
-                    st.session_state['kappa_ant'] = kappa_ant
-                    st.session_state['matrix_ant'] = matrix_ant
-                    st.session_state['class_names_ant'] = class_names_ant
-                    st.session_state['accuracy_pos'] = accuracy_pos
-                    st.session_state['kappa_pos'] = kappa_pos
-                    st.session_state['matrix_pos'] = matrix_pos
-                    st.session_state['class_names_pos'] = class_names_pos
-                    
-                    st.success("✅ Classificação concluída! Role para baixo!")
-                    
+                
                 except Exception as e:
                     st.error(f"❌ Erro durante processamento: {e}")
                     st.code(traceback.format_exc())
         
+        acompanhar_tarefa('classificacao')
+        
+        # SÉRIE TEMPORAL ANUAL - todos os anos entre as duas datas
+        st.subheader("📈 Série Temporal Anual (opcional)")
+        st.caption("Classifica um composto sem nuvens para CADA ano entre as duas datas, com um único classificador "
+                   "treinado com as amostras dos dois períodos (bandas harmonizadas entre Landsat 5/7/8/9). "
+                   "Todas as áreas por ano, classe e lote são calculadas numa só requisição.")
+        
+        if st.button("📈 Classificar Todos os Anos", disabled=botao_desabilitado):
+            inicializar_gee()
+            roi = obter_roi()
+            try:
+                class_map = {tipo: i for i, tipo in enumerate(tipos_cobertura.keys())}
+                parcelas_fc, lotes_info = None, {}
+                if st.session_state.gdf_parcelas is not None:
+                    parcelas_fc, lotes_info, _ = preparar_lotes(st.session_state.gdf_parcelas)
+                
+                treino = [
+                    (data_anterior.year, criar_samples(st.session_state.amostras_anterior, class_map)),
+                    (data_posterior.year, criar_samples(st.session_state.amostras_posterior, class_map)),
+                ]
+                # Série anual em segundo plano: pode levar alguns minutos e a sessão segue livre
+                submeter_tarefa(
+                    'serie_anual', "Série anual", processar_serie_anual,
+                    data_anterior.year, data_posterior.year, data_anterior.month, roi, treino,
+                    parcelas_fc, lotes_info, janela_amostragem,
+                    total_etapas=3, ao_concluir=lambda resultado: st.session_state.update(serie_anual=resultado)
+                )
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Erro na série anual: {e}")
+                st.code(traceback.format_exc())
+        
+        acompanhar_tarefa('serie_anual')
+        
+        if 'serie_anual' in st.session_state:
+            serie = st.session_state['serie_anual']
+            st.write("**Área por classe (ha) em cada ano:**")
+            st.dataframe(serie['tabela'], use_container_width=True)
+            
+            desmat = serie['tabela']['Desmatamento'].dropna()
+            if len(desmat) > 0:
+                st.write("**🔴 Desmatamento anual (ha/ano):**")
+                st.bar_chart(desmat)
+                st.info(f"📈 Média: **{desmat.mean():.2f} ha/ano** | Pico: **{desmat.max():.2f} ha** em {desmat.idxmax()}")
+            
+            st.download_button(
+                label="📥 Baixar Série Anual (CSV)",
+                data=serie['tabela'].to_csv(),
+                file_name=f"serie_anual_{serie['anos'][0]}_{serie['anos'][-1]}.csv",
+                mime="text/csv"
+            )
+            if serie['lotes'] is not None:
+                st.download_button(
+                    label="📥 Baixar Série Anual por Lote (CSV)",
+                    data=serie['lotes'].to_csv(index=False),
+                    file_name=f"serie_anual_lotes_{serie['anos'][0]}_{serie['anos'][-1]}.csv",
+                    mime="text/csv"
+                )
+        
+        # MODO MULTI-PA - PAs vizinhos que compartilham as mesmas cenas Landsat
+        st.subheader("🗺️ Modo Multi-PA (opcional)")
+        st.caption("Envie PAs vizinhos (perímetro ou lotes). As cenas são buscadas uma vez por data para todos os PAs, "
+                   "que são agrupados pelas cenas (path/row WRS-2) que os cobrem. Cada grupo é classificado uma vez, "
+                   "com as amostras coletadas acima, e as áreas de todos os lotes do grupo saem numa só requisição. "
+                   "Usa a busca por cena única.")
+        arquivos_multipa = st.file_uploader(
+            "PAs vizinhos (ZIP com shapefile ou GeoJSON)",
+            type=['zip', 'geojson', 'json'],
+            accept_multiple_files=True,
+            key='uploader_multipa'
+        )
+        
+        if arquivos_multipa and st.button("🔎 Agrupar PAs por cena", disabled=botao_desabilitado):
+            inicializar_gee()
+            try:
+                pas_multipa = {'PA atual': st.session_state.gdf_parcelas if st.session_state.gdf_parcelas is not None
+                               else st.session_state.gdf}
+                for arquivo in arquivos_multipa:
+                    pas_multipa[arquivo.name.rsplit('.', 1)[0]] = ler_arquivo_geo(arquivo.name, arquivo.getvalue())
+                
+                def _aplicar_grupos(resultado, pas=pas_multipa):
+                    grupos, sem_cena = resultado
+                    st.session_state['multipa'] = {'pas': pas, 'grupos': grupos, 'sem_cena': sem_cena}
+                    st.session_state.pop('multipa_resultado', None)
+                
+                submeter_tarefa(
+                    'multipa_grupos', f"Busca de cenas para {len(pas_multipa)} PAs", agrupar_pas_por_cenas,
+                    pas_multipa, data_anterior.strftime('%Y-%m-%d'), data_posterior.strftime('%Y-%m-%d'), cloud_cover,
+                    total_etapas=2, ao_concluir=_aplicar_grupos
+                )
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Erro ao agrupar PAs: {e}")
+                st.code(traceback.format_exc())
+        
+        acompanhar_tarefa('multipa_grupos')
+        
+        if 'multipa' in st.session_state:
+            multipa = st.session_state['multipa']
+            st.write(f"**{len(multipa['pas'])} PAs em {len(multipa['grupos'])} grupo(s) de cenas** "
+                     f"(2 consultas ao catálogo de cenas em vez de {2 * len(multipa['pas'])} buscas)")
+            st.markdown("| Grupo | PAs | Path/Row anterior | Path/Row posterior |\n|---|---|---|---|\n" + "\n".join(
+                f"| {n} | {', '.join(g['pas'])} | {', '.join(f'{p}/{r}' for p, r in g['tiles_ant'])} "
+                f"| {', '.join(f'{p}/{r}' for p, r in g['tiles_pos'])} |"
+                for n, g in enumerate(multipa['grupos'], start=1)
+            ))
+            if multipa['sem_cena']:
+                st.warning(f"⚠️ Sem cena em alguma das datas: {', '.join(multipa['sem_cena'])}")
+            
+            if multipa['grupos'] and st.button("▶️ Processar PAs agrupados", disabled=botao_desabilitado):
+                class_map = {tipo: i for i, tipo in enumerate(tipos_cobertura.keys())}
+                amostras_ant = {t: list(p) for t, p in st.session_state.amostras_anterior.items()}
+                amostras_pos = {t: list(p) for t, p in st.session_state.amostras_posterior.items()}
+                submeter_tarefa(
+                    'multipa', "Multi-PA", processar_multipa,
+                    multipa['grupos'], multipa['pas'],
+                    criar_samples(amostras_ant, class_map), criar_samples(amostras_pos, class_map),
+                    amostras_ant, amostras_pos, janela_amostragem,
+                    total_etapas=7 * len(multipa['grupos']),
+                    ao_concluir=lambda resultado: st.session_state.update(multipa_resultado=resultado)
+                )
+                st.rerun()
+            
+            acompanhar_tarefa('multipa')
+            if 'multipa_resultado' in st.session_state:
+                df_multipa = st.session_state['multipa_resultado']['lotes']
+                colunas_ha = [c for c in df_multipa.columns if c.endswith('_ha')]
+                st.write("**Áreas por PA (ha):**")
+                st.dataframe(df_multipa.groupby('PA')[colunas_ha].sum(min_count=1), use_container_width=True)
+                with st.expander(f"👁️ Áreas por lote ({len(df_multipa)} lotes)"):
+                    st.dataframe(df_multipa, hide_index=True)
+                st.download_button(
+                    label="📥 Baixar Multi-PA por Lote (CSV)",
+                    data=df_multipa.to_csv(index=False),
+                    file_name=f"multipa_lotes_{data_anterior}_{data_posterior}.csv",
+                    mime="text/csv"
+                )
+        
         if 'classified_ant' in st.session_state:
             st.markdown("---")
             st.header("📊 6. Resultados da Análise")
@@ -1598,6 +1457,8 @@ if st.session_state.gdf is not None:
                         columns=[f"Prev. {n}" for n in cn_ant],
                         index=[f"Real {n}" for n in cn_ant])
                     st.dataframe(df_matrix_ant, use_container_width=True)
+                elif st.session_state.get('modelo_ant'):
+                    st.info("📚 Classificado com um modelo registrado — sem amostras de validação nesta cena.")
                 else:
                     st.warning("⚠️ Acurácia não calculada — poucas amostras por classe (< 6). Colete mais pontos para obter indicadores confiáveis.")
 
@@ -1618,6 +1479,8 @@ if st.session_state.gdf is not None:
                         columns=[f"Prev. {n}" for n in cn_pos],
                         index=[f"Real {n}" for n in cn_pos])
                     st.dataframe(df_matrix_pos, use_container_width=True)
+                elif st.session_state.get('modelo_pos'):
+                    st.info("📚 Classificado com um modelo registrado — sem amostras de validação nesta cena.")
                 else:
                     st.warning("⚠️ Acurácia não calculada — poucas amostras por classe (< 6). Colete mais pontos para obter indicadores confiáveis.")
             
@@ -1626,37 +1489,55 @@ if st.session_state.gdf is not None:
             
             roi_resultados = obter_roi()
             palette_colors = [tipos_cobertura[tipo] for tipo in tipos_cobertura.keys()]
-
-            vis_params_class = {
-                'min': 0,
-                'max': len(palette_colors) - 1,
-                'palette': palette_colors
-            }
+            run_id = st.session_state.get('run_id')
+            
+            # Prévia: rasters e áreas em ESCALA_PREVIA; a resolução completa reaproveita todos os estágios
+            # que não dependem da escala (cenas, amostras, treino, classificação, acurácia, mapa de mudanças)
+            previa = st.session_state.get('modo_previa', False)
+            escala = ESCALA_PREVIA if previa else 30
+            id_rasters = f"{run_id}_{escala}m"
+            if previa:
+                st.warning(f"⚡ Prévia em {ESCALA_PREVIA} m: mapas e áreas aproximados. Análise por lote, "
+                           "relatório e gravação da execução só na resolução completa.")
+                st.button("🔍 Rodar em resolução completa (30 m)", type="primary",
+                          on_click=lambda: st.session_state.update(modo_previa=False))
+            
+            # Estágio 'mudanca': só muda quando a classificação (run_id) ou o ROI mudam
+            st.session_state['change_image'] = executar_estagio(
+                'mudanca',
+                [run_id, hash_estagio('roi')],
+                lambda: calcular_mudanca(st.session_state['classified_ant'], st.session_state['classified_pos'], roi_resultados)
+            )
+            
+            # Estágio 'rasters': baixados UMA vez por análise (em segundo plano), renderizados localmente depois
+            try:
+                rasters_resultado = estagio_em_segundo_plano(
+                    'rasters', 'rasters', [hash_estagio('mudanca'), escala], "Download dos rasters do resultado",
+                    baixar_rasters_resultado,
+                    {'ant': st.session_state['classified_ant'], 'pos': st.session_state['classified_pos'],
+                     'mudanca': st.session_state['change_image']},
+                    shapely.make_valid(st.session_state.gdf.geometry.iloc[0]), escala,
+                    total_etapas=3
+                ) or {}
+            except Exception as e:
+                st.error(f"Erro ao baixar rasters do resultado: {e}")
+                rasters_resultado = {}
+            st.session_state['rasters_resultado'] = rasters_resultado
             
             try:
-                url_class_ant = st.session_state['classified_ant'].getThumbURL({
-                    **vis_params_class,
-                    'region': roi_resultados.bounds(),
-                    'dimensions': 1200,
-                    'format': 'png'
-                })
-
-                url_class_pos = st.session_state['classified_pos'].getThumbURL({
-                    **vis_params_class,
-                    'region': roi_resultados.bounds(),
-                    'dimensions': 1200,
-                    'format': 'png'
-                })
-                
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     st.write(f"**Classificação Anterior ({st.session_state.date_ant})**")
-                    st.image(url_class_ant, use_container_width=True)
+                    if 'ant' in rasters_resultado:
+                        st.image(png_resultado(id_rasters, 'ant', palette_colors, 0, 1200, rasters_resultado['ant'][0]),
+                                 use_container_width=True)
                 
                 with col2:
                     st.write(f"**Classificação Posterior ({st.session_state.date_pos})**")
-                    st.image(url_class_pos, use_container_width=True)
+                    if 'pos' in rasters_resultado:
+                        st.image(png_resultado(id_rasters, 'pos', palette_colors, 0, 1200, rasters_resultado['pos'][0]),
+                                 use_container_width=True)
                 
                 st.write("### 🎨 Legenda")
                 legend_cols = st.columns(len(tipos_cobertura))
@@ -1671,45 +1552,11 @@ if st.session_state.gdf is not None:
             st.subheader("🔄 Análise de Mudanças")
             
             try:
-                from_list = list(range(len(tipos_cobertura)))
-                to_list = [1 if i == 0 else (3 if i == 2 else 2) for i in range(len(tipos_cobertura))]
-                
-                class_ant_remap = st.session_state['classified_ant'].remap(from_list, to_list, 0)
-                class_pos_remap = st.session_state['classified_pos'].remap(from_list, to_list, 0)
-                
-                FF = 1
-                AC = 2
-                CH = 3
-                DI = 4
-                FR = 5
-                
-                analise = ee.Image(1) \
-                    .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(FF)), FF) \
-                    .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(AC)), DI) \
-                    .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(CH)), DI) \
-                    .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(AC)), AC) \
-                    .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(FF)), FR) \
-                    .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(CH)), CH) \
-                    .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(CH)), CH) \
-                    .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(FF)), FR) \
-                    .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(AC)), AC) \
-                    .clip(st.session_state.roi)
+                analise = st.session_state['change_image']
                 
-                # Salvar imagem de análise para uso posterior
-                st.session_state['change_image'] = analise
-                
-                palette_mudanca = ['#228B22', '#F5DEB3', '#4169E1', '#FF0000', '#90EE90']
-                
-                url_analise = analise.getThumbURL({
-                    'min': 1,
-                    'max': 5,
-                    'palette': palette_mudanca,
-                    'region': roi_resultados.bounds(),
-                    'dimensions': 2048,
-                    'format': 'png'
-                })
-                
-                st.image(url_analise, caption="Mapa de Mudanças - VERMELHO = Desmatamento", use_container_width=True)
+                if 'mudanca' in rasters_resultado:
+                    st.image(png_resultado(id_rasters, 'mudanca', palette_mudanca, 1, 2048, rasters_resultado['mudanca'][0]),
+                             caption="Mapa de Mudanças - VERMELHO = Desmatamento", use_container_width=True)
                 
                 st.write("### 🎨 Legenda de Mudanças")
                 legend_mudanca = {
@@ -1725,15 +1572,58 @@ if st.session_state.gdf is not None:
                     with cols[i]:
                         st.markdown(f"<div style='background-color:{cor}; padding:10px; border-radius:5px; text-align:center; color:white; font-weight:bold;'>{tipo}</div>", unsafe_allow_html=True)
                 
+                # Mapa com zoom: overlays gerados dos mesmos arrays (sem chamadas ao GEE)
+                if rasters_resultado:
+                    with st.expander("🔍 Mapa interativo (zoom)"):
+                        _bounds = st.session_state.gdf.total_bounds
+                        m_res = folium.Map(location=[(_bounds[1] + _bounds[3]) / 2, (_bounds[0] + _bounds[2]) / 2],
+                                           zoom_start=12)
+                        _camadas = [
+                            ('ant', f"Classificação Anterior ({st.session_state.date_ant})", palette_colors, 0, False),
+                            ('pos', f"Classificação Posterior ({st.session_state.date_pos})", palette_colors, 0, False),
+                            ('mudanca', "Análise de Mudanças", palette_mudanca, 1, True),
+                        ]
+                        for _chave, _nome, _paleta, _vmin, _visivel in _camadas:
+                            if _chave not in rasters_resultado:
+                                continue
+                            _arr, _t = rasters_resultado[_chave]
+                            _png = png_resultado(id_rasters, _chave, _paleta, _vmin, 2048, _arr)
+                            folium.raster_layers.ImageOverlay(
+                                image="data:image/png;base64," + base64.b64encode(_png).decode(),
+                                bounds=[[_t.f + _t.e * _arr.shape[0], _t.c], [_t.f, _t.c + _t.a * _arr.shape[1]]],
+                                name=_nome,
+                                show=_visivel,
+                                opacity=0.85
+                            ).add_to(m_res)
+                        folium.GeoJson(
+                            limpar_gdf_para_folium(st.session_state.gdf),
+                            style_function=lambda x: {'fillColor': 'transparent', 'color': 'yellow', 'weight': 2}
+                        ).add_to(m_res)
+                        folium.LayerControl().add_to(m_res)
+                        st_folium(m_res, width=None, height=500, key="map_resultado", returned_objects=[])
+                
                 st.write("### 📐 Cálculo de Áreas")
                 
                 with st.spinner("Calculando áreas..."):
-                    areas = ee.Image.pixelArea().addBands(analise).reduceRegion(
-                        reducer=ee.Reducer.sum().group(1),
-                        geometry=st.session_state.roi,
-                        scale=30,
-                        maxPixels=1e13
-                    ).getInfo()
+                    # Estágio 'areas': a redução só roda de novo se o mapa de mudanças mudar
+                    areas = executar_estagio(
+                        'areas',
+                        [hash_estagio('mudanca'), escala],
+                        lambda: calcular_areas_mudanca(analise, st.session_state.roi, escala,
+                                                       shapely.make_valid(st.session_state.gdf.geometry.iloc[0]))
+                    )
+                    
+                    if areas.get('blocos'):
+                        # PA grande: redução feita em blocos paralelos, somas juntadas por classe
+                        _blocos = areas['blocos']
+                        with st.expander(f"⏱️ Tempo por bloco ({len(_blocos)} blocos, "
+                                         f"o mais lento {max(b['segundos'] for b in _blocos):.1f} s)"):
+                            st.dataframe(pd.DataFrame([
+                                {'Bloco': b['bloco'], 'Tempo (s)': round(b['segundos'], 2),
+                                 'Tentativas': b['tentativas'], 'Dividido': '✂️' if b['divisao'] else '',
+                                 'Limites': ', '.join(f"{v:.3f}" for v in b['bounds'])}
+                                for b in _blocos
+                            ]), use_container_width=True, hide_index=True)
                     
                     if 'groups' in areas:
                         areas_dict = {}
@@ -1784,251 +1674,71 @@ if st.session_state.gdf is not None:
             st.subheader("⬇️ Download GeoTIFF")
             st.caption("Baixe os rasters classificados para uso em QGIS, ArcGIS ou outro sistema SIG (SIRGAS 2000 / EPSG:4674).")
 
-            _col_dl1, _col_dl2, _col_dl3 = st.columns(3)
-            _roi_dl = roi_resultados
-
-            with _col_dl1:
-                try:
-                    _url_tiff_ant = st.session_state['classified_ant'].getDownloadURL({
-                        'scale': 30,
-                        'crs': 'EPSG:4674',
-                        'region': _roi_dl,
-                        'format': 'GeoTIFF'
-                    })
-                    st.link_button("⬇️ Baixar Classificação 2008 (GeoTIFF)", _url_tiff_ant, use_container_width=True)
-                except Exception as _e:
-                    st.warning(f"⚠️ Erro ao gerar link 2008: {_e}")
-
-            with _col_dl2:
-                try:
-                    _url_tiff_pos = st.session_state['classified_pos'].getDownloadURL({
-                        'scale': 30,
-                        'crs': 'EPSG:4674',
-                        'region': _roi_dl,
-                        'format': 'GeoTIFF'
-                    })
-                    st.link_button("⬇️ Baixar Classificação 2025 (GeoTIFF)", _url_tiff_pos, use_container_width=True)
-                except Exception as _e:
-                    st.warning(f"⚠️ Erro ao gerar link 2025: {_e}")
-
-            with _col_dl3:
-                if 'change_image' in st.session_state:
+            _rasters_dl = [
+                ('ant', "Classificação 2008"),
+                ('pos', "Classificação 2025"),
+                ('mudanca', "Análise de Mudanças"),
+            ]
+
+            _cols_dl = st.columns(3)
+            for _col_dl, (_chave, _rotulo) in zip(_cols_dl, _rasters_dl):
+                with _col_dl:
+                    if _chave not in rasters_resultado:
+                        continue
                     try:
-                        _url_tiff_change = st.session_state['change_image'].getDownloadURL({
-                            'scale': 30,
-                            'crs': 'EPSG:4674',
-                            'region': _roi_dl,
-                            'format': 'GeoTIFF'
-                        })
-                        st.link_button("⬇️ Baixar Análise de Mudanças (GeoTIFF)", _url_tiff_change, use_container_width=True)
+                        st.download_button(
+                            f"⬇️ Baixar {_rotulo} (GeoTIFF)",
+                            data=cog_resultado(id_rasters, _chave, *rasters_resultado[_chave]),
+                            file_name=f"darc_{_chave}_{st.session_state.date_ant}_{st.session_state.date_pos}{f'_previa{escala}m' if previa else ''}.tif",
+                            mime="image/tiff",
+                            use_container_width=True
+                        )
                     except Exception as _e:
-                        st.warning(f"⚠️ Erro ao gerar link mudanças: {_e}")
+                        st.warning(f"⚠️ Erro ao gerar GeoTIFF ({_rotulo}): {_e}")
 
+            # Entradas do estágio 'lotes' (também conferidas antes de gravar a execução)
+            entradas_lotes = [hash_estagio('mudanca'), hash_estagio('ingest')]
+            # Identidade da classificação para o diff por lote (ver 'identidade_ant'/'identidade_pos' no passo 5)
+            identidade_lotes = (impressao('lotes', st.session_state['identidade_ant'], st.session_state['identidade_pos'])
+                                if 'identidade_ant' in st.session_state else None)
+            
             # ANÁLISE POR LOTE - GERAR CSV
-            if st.session_state.gdf_parcelas is not None:
+            if st.session_state.gdf_parcelas is not None and not previa:
                 st.markdown("---")
                 st.subheader("📊 Análise por Lote")
                 
-                with st.spinner("Calculando áreas por lote... Isso pode levar alguns minutos..."):
-                    try:
-                        
-                        st.info(f"⚡ Processando {len(st.session_state.gdf_parcelas)} lotes em formato simplificado...")
-                        
-                        # Pegar imagens classificadas
-                        classified_ant = st.session_state['classified_ant']
-                        change_image = st.session_state['change_image']
-                        
-                        # ===== FORMATO COMPLETO conforme solicitado pela professora =====
-                        # Header: Lote, Area_Total_ha, classes_2008, classes_mudanca
-                        csv_data = []
-                        header = ['Lote', 'Area_Total_ha']
-                        
-                        # Adicionar colunas das classes de 2008
-                        for tipo in tipos_cobertura.keys():
-                            header.append(f"{tipo}_2008_ha")
-                        
-                        # Adicionar colunas das classes de mudança (FF, AC, CH, DI, FR)
-                        header.extend(['FF_ha', 'AC_ha', 'CH_ha', 'DI_ha', 'FR_ha'])
-                        
-                        csv_data.append(header)
-                        
-                        st.write("⚡ Processando classificação e análise de mudança por lote...")
-                        
-                        # Converter parcelas para FeatureCollection do GEE
-                        st.write("📦 Preparando lotes...")
-                        
-                        # CRÍTICO: Garantir que GEE está inicializado
-                        inicializar_gee()
-                        
-                        parcelas_features = []
-                        lotes_info = {}  # Guardar nome e área
-                        lotes_com_erro = []
-
-                        # Reprojetar parcelas para UTM para cálculo de área preciso
-                        _c = st.session_state.gdf_parcelas.geometry.unary_union.centroid
-                        _zone = int((_c.x + 180) / 6) + 1
-                        _epsg_utm = 32600 + _zone if _c.y >= 0 else 32700 + _zone
-                        _gdf_parcelas_utm = st.session_state.gdf_parcelas.to_crs(epsg=_epsg_utm)
-
-                        for idx, row in st.session_state.gdf_parcelas.iterrows():
-                            try:
-                                geom = row.geometry
-                                
-                                # Validar geometria
-                                if geom is None or geom.is_empty:
-                                    lotes_com_erro.append(idx)
-                                    continue
-                                
-                                # Garantir geometria válida
-                                if not geom.is_valid:
-                                    geom = geom.buffer(0)
-                                
-                                _COLS_LOTE = ['NOM_LOT', 'nom_lot', 'NUM_LOTE', 'num_lote',
-                                              'Lote', 'lote', 'LOTE', 'PARCELA', 'parcela',
-                                              'Name', 'name', 'ID_LOTE', 'id_lote']
-                                nome = None
-                                for _col in _COLS_LOTE:
-                                    if _col in st.session_state.gdf_parcelas.columns:
-                                        _val = str(row[_col]).strip()
-                                        if _val and _val not in ('nan', 'None', ''):
-                                            nome = _val
-                                            break
-                                if not nome:
-                                    nome = f'Lote_{idx + 1}'
-                                geom_utm = _gdf_parcelas_utm.loc[idx].geometry
-                                if not geom_utm.is_valid:
-                                    geom_utm = geom_utm.buffer(0)
-                                area_lote_ha = geom_utm.area / 10000
-                                
-                                lotes_info[idx] = {
-                                    'nome': nome,
-                                    'area_ha': round(area_lote_ha, 2)
-                                }
-                                
-                                ee_geom = _geom_para_gee(geom)
-                                feature = ee.Feature(ee_geom, {'lote_id': idx})
-                                parcelas_features.append(feature)
-                                
-                            except Exception as e:
-                                lotes_com_erro.append(idx)
-                                st.warning(f"⚠️ Erro no lote {idx}: {e}")
-                        
-                        if lotes_com_erro:
-                            st.warning(f"⚠️ {len(lotes_com_erro)} lotes com geometrias inválidas foram ignorados.")
-                        
-                        if len(parcelas_features) == 0:
-                            st.error("❌ Nenhum lote válido para processar!")
-                            st.stop()
-                        
-                        parcelas_fc = ee.FeatureCollection(parcelas_features)
-                        st.success(f"✅ {len(parcelas_features)} lotes preparados para análise.")
-
-                        
-                        # Dicionário para armazenar áreas das classes de 2008
-                        classes_2008 = {tipo: {} for tipo in tipos_cobertura.keys()}
-                        
-                        # Processar cada classe de 2008 em BATCH
-                        st.write("⏳ Calculando áreas - Classificação 2008...")
-                        for idx_tipo, tipo in enumerate(tipos_cobertura.keys()):
-                            try:
-                                classe_num = idx_tipo
-                                st.write(f"   → {tipo}...")
-                                
-                                classe_mask = classified_ant.eq(classe_num).multiply(ee.Image.pixelArea())
-                                
-                                results = classe_mask.reduceRegions(
-                                    collection=parcelas_fc,
-                                    reducer=ee.Reducer.sum(),
-                                    scale=30
-                                ).getInfo()
-                                
-                                for feature in results['features']:
-                                    lote_id = feature['properties']['lote_id']
-                                    area_m2 = feature['properties'].get('sum') or 0
-                                    area_ha = area_m2 / 10000
-                                    classes_2008[tipo][lote_id] = round(area_ha, 2) if area_ha > 0.05 else 0.0
-                            
-                            except Exception as e:
-                                st.warning(f"⚠️ Erro ao processar classe '{tipo}': {e}")
-                                # Inicializar com zeros para não quebrar CSV
-                                for idx in lotes_info.keys():
-                                    classes_2008[tipo][idx] = 0.0
-                        
-                        # Dicionário para armazenar áreas das 5 classes de mudança
-                        classes_mudanca = {
-                            1: {},  # FF - Floresta mantida
-                            2: {},  # AC - Área consolidada
-                            3: {},  # CH - Corpos d'água
-                            4: {},  # DI - Desmatamento
-                            5: {}   # FR - Floresta regenerada
-                        }
-                        
-                        # Processar cada classe de mudança em BATCH
-                        st.write("⏳ Calculando áreas - Análise de Mudança...")
-                        nomes_classes = {
-                            1: 'FF (Floresta Mantida)',
-                            2: 'AC (Área Consolidada)',
-                            3: 'CH (Corpos d\'Água)',
-                            4: 'DI (Desmatamento)',
-                            5: 'FR (Regeneração)'
+                try:
+                    # Estágio 'lotes': as 12 reduções por lote só rodam se o mapa de mudanças ou os lotes mudarem.
+                    # Com a mesma classificação (cenas, modelos ou amostras) e um arquivo de lotes ou perímetro
+                    # revisado, só os lotes novos ou redesenhados vão ao servidor; os demais herdam as áreas da
+                    # tabela anterior (diff por impressão), da sessão ou de uma execução salva
+                    inicializar_gee()
+                    lotes_anteriores = st.session_state.get('_lotes_anteriores')
+                    if identidade_lotes and (not lotes_anteriores or lotes_anteriores['identidade'] != identidade_lotes):
+                        lotes_anteriores = st.session_state['_lotes_anteriores'] = {
+                            'identidade': identidade_lotes, 'lotes': None,
+                            'tabela': tabela_lotes_salva(identidade_lotes),
                         }
+                    resultado_lotes = estagio_em_segundo_plano(
+                        'lotes', 'lotes', entradas_lotes, "Análise por lote",
+                        calcular_tabela_lotes,
+                        st.session_state.gdf_parcelas, st.session_state['classified_ant'], st.session_state['change_image'],
+                        lotes_anteriores['tabela'] if identidade_lotes and lotes_anteriores else None,
+                        total_etapas=len(tipos_cobertura) + 7  # preparação + classes + 5 mudanças + planilha
+                    )
+                    
+                    if resultado_lotes is not None:
+                        df_lotes = resultado_lotes
+                        if identidade_lotes and lotes_anteriores['lotes'] != hash_estagio('lotes'):
+                            # Lotes da tabela anterior que saíram do arquivo continuam lá para uma próxima revisão
+                            st.session_state['_lotes_anteriores'] = {
+                                'identidade': identidade_lotes, 'lotes': hash_estagio('lotes'),
+                                'tabela': lotes_por_impressao(df_lotes, st.session_state.gdf_parcelas,
+                                                              lotes_anteriores['tabela']),
+                            }
+                        n_lotes = len(df_lotes)
                         
-                        for classe_num in [1, 2, 3, 4, 5]:
-                            try:
-                                st.write(f"   → {nomes_classes[classe_num]}...")
-                                
-                                classe_mask = change_image.eq(classe_num).multiply(ee.Image.pixelArea())
-                                
-                                results = classe_mask.reduceRegions(
-                                    collection=parcelas_fc,
-                                    reducer=ee.Reducer.sum(),
-                                    scale=30
-                                ).getInfo()
-                                
-                                for feature in results['features']:
-                                    lote_id = feature['properties']['lote_id']
-                                    area_m2 = feature['properties'].get('sum') or 0
-                                    area_ha = area_m2 / 10000
-                                    classes_mudanca[classe_num][lote_id] = round(area_ha, 2) if area_ha > 0.05 else 0.0
-                            
-                            except Exception as e:
-                                st.warning(f"⚠️ Erro ao processar {nomes_classes[classe_num]}: {e}")
-                                # Inicializar com zeros
-                                for idx in lotes_info.keys():
-                                    classes_mudanca[classe_num][idx] = 0.0
-                        
-                        # Montar CSV com TODAS as colunas
-                        st.write("📊 Montando planilha...")
-                        for idx in sorted(lotes_info.keys()):
-                            # Linha: Nome, Área, Classes_2008, Classes_Mudança
-                            lote_row = [
-                                lotes_info[idx]['nome'],
-                                lotes_info[idx]['area_ha']
-                            ]
-                            
-                            # Adicionar áreas das classes de 2008
-                            for tipo in tipos_cobertura.keys():
-                                area = classes_2008[tipo].get(idx, 0.0)
-                                lote_row.append(area if area > 0 else '')
-                            
-                            # Adicionar áreas das classes de mudança (FF, AC, CH, DI, FR)
-                            for classe_num in [1, 2, 3, 4, 5]:
-                                area = classes_mudanca[classe_num].get(idx, 0.0)
-                                lote_row.append(area if area > 0 else '')
-                            
-                            csv_data.append(lote_row)
-                        
-                        # Converter para CSV no formato correto
-                        csv_buffer = io.StringIO()
-                        writer = csv.writer(csv_buffer, quoting=csv.QUOTE_ALL)
-                        for row_data in csv_data:
-                            row_str = ['' if (val == '' or val is None) else str(val) for val in row_data]
-                            writer.writerow(row_str)
-                        
-                        csv_string = csv_buffer.getvalue()
-                        st.session_state['csv_lotes'] = csv_string
-                        
-                        st.success(f"✅ Análise concluída! {len(csv_data)-1} lotes processados com classificação 2008 e análise de mudança.")
+                        st.success(f"✅ Análise concluída! {n_lotes} lotes processados com classificação 2008 e análise de mudança.")
                         
                         # Mostrar legenda atualizada
                         st.info("""
@@ -2043,112 +1753,225 @@ if st.session_state.gdf is not None:
                         - **FR_ha:** Floresta Regenerada (verde claro)
                         """)
                         
-                        # Botão download
-                        st.download_button(
-                            label="📥 Baixar Planilha de Lotes (CSV)",
-                            data=csv_string,
-                            file_name=f"analise_lotes_{st.session_state.date_ant}_{st.session_state.date_pos}.csv",
-                            mime="text/csv"
-                        )
+                        # Downloads: arquivos gravados uma vez por análise (hash do estágio 'lotes') e formato
+                        nome_base_lotes = f"analise_lotes_{st.session_state.date_ant}_{st.session_state.date_pos}"
+                        formatos_lotes = [
+                            ('csv', "📥 Baixar Planilha de Lotes (CSV)", "text/csv"),
+                            ('parquet', "📥 Baixar Tabela de Lotes (Parquet)", "application/vnd.apache.parquet"),
+                            ('gpkg', "📥 Baixar Lotes com Geometria (GeoPackage)", "application/geopackage+sqlite3"),
+                        ]
+                        for _col_lotes, (_formato, _rotulo, _mime) in zip(st.columns(len(formatos_lotes)), formatos_lotes):
+                            with _col_lotes:
+                                try:
+                                    _caminho = arquivo_tabela_lotes(hash_estagio('lotes')[:16], _formato, df_lotes,
+                                                                    st.session_state.gdf_parcelas)
+                                    with open(_caminho, 'rb') as _arquivo:
+                                        st.download_button(_rotulo, data=_arquivo, file_name=f"{nome_base_lotes}.{_formato}",
+                                                           mime=_mime, use_container_width=True)
+                                except Exception as _e:
+                                    st.warning(f"⚠️ Erro ao gerar {_formato.upper()}: {_e}")
                         
                         # Mostrar preview
                         with st.expander("👁️ Visualizar dados"):
-                            st.dataframe(pd.read_csv(io.StringIO(csv_string)))
-                    
+                            st.dataframe(df_lotes, hide_index=True)
+                        
+                        # Relatórios por lote: um PDF por lote (áreas, transições e recorte do mapa) num ZIP
+                        st.markdown("**📦 Relatórios por Lote (PDF)**")
+                        entradas_rel_lotes = [hash_estagio('lotes'), hash_estagio('rasters'),
+                                              st.session_state.date_ant, st.session_state.date_pos]
+                        h_rel_lotes = impressao('relatorios_lotes', entradas_rel_lotes)
+                        if not estagio_em_cache('relatorios_lotes', h_rel_lotes) and tarefa_da_sessao('relatorios_lotes') is None:
+                            if st.button(f"📦 Gerar {n_lotes} relatórios por lote (ZIP)"):
+                                caminho_zip = os.path.join(tempfile.gettempdir(), 'darc_relatorios',
+                                                           f"{run_id or 'analise'}_{h_rel_lotes[:12]}.zip")
+                                submeter_tarefa(
+                                    'relatorios_lotes', "Relatórios por lote", gerar_relatorios_lotes_zip,
+                                    df_lotes, list(df_lotes.index), st.session_state.gdf_parcelas,
+                                    rasters_resultado.get('mudanca'), palette_mudanca,
+                                    st.session_state.date_ant, st.session_state.date_pos, caminho_zip,
+                                    total_etapas=n_lotes + 1, hash_entradas=h_rel_lotes,
+                                    ao_concluir=lambda r, h=h_rel_lotes: registrar_estagio('relatorios_lotes', h, r)
+                                )
+                                st.rerun()
+                        acompanhar_tarefa('relatorios_lotes')
+                        if estagio_em_cache('relatorios_lotes', h_rel_lotes):
+                            zip_lotes = saida_estagio('relatorios_lotes')
+                            if os.path.exists(zip_lotes['caminho']):
+                                with open(zip_lotes['caminho'], 'rb') as arquivo_zip:
+                                    st.download_button(
+                                        label=f"📥 Baixar {zip_lotes['n_relatorios']} relatórios "
+                                              f"({zip_lotes['bytes'] / 1e6:.1f} MB, ZIP)",
+                                        data=arquivo_zip,
+                                        file_name=f"relatorios_lotes_{st.session_state.date_ant}_{st.session_state.date_pos}.zip",
+                                        mime="application/zip"
+                                    )
+                
+                except Exception as e:
+                    st.error(f"❌ Erro ao processar lotes: {e}")
+                    st.code(traceback.format_exc())
+            
+            # Gravação da execução e linha de base só usam saídas de estágio calculadas com as entradas
+            # atuais; as demais ficam de fora (execução marcada como parcial)
+            cenas_atuais = estagio_em_cache('cenas', impressao('cenas', entradas_cenas))
+            lotes_atuais = (st.session_state.gdf_parcelas is not None
+                            and estagio_em_cache('lotes', impressao('lotes', entradas_lotes)))
+            parcial = ([] if cenas_atuais else ['cenas']) + (
+                [] if lotes_atuais or st.session_state.gdf_parcelas is None else ['lotes'])
+            
+            # Estágio 'persistencia': grava a execução em disco uma vez, para reabrir sem o GEE
+            if run_id and rasters_resultado and 'areas_dict' in st.session_state and tarefa_da_sessao('lotes') is None and not previa:
+                def _salvar_execucao():
+                    cenas = saida_estagio('cenas') if cenas_atuais else {}
+                    lotes = saida_estagio('lotes') if lotes_atuais else None
+                    arquivo_pa = uploaded_perimetro or uploaded_parcelas
+                    registro = {
+                        'nome_pa': arquivo_pa.name if arquivo_pa is not None else None,
+                        'date_ant': st.session_state.date_ant,
+                        'date_pos': st.session_state.date_pos,
+                        'intervalo_anos': intervalo_anos,
+                        'cena_ant': cenas.get('id_ant'),
+                        'cena_pos': cenas.get('id_pos'),
+                        'sat_ant': st.session_state.get('sat_ant_id'),
+                        'sat_pos': st.session_state.get('sat_pos_id'),
+                        'parametros': {
+                            'modo_busca': st.session_state.get('modo_busca'),
+                            'classificador': 'smileRandomForest',
+                            'janela_amostragem': st.session_state.get('janela_classificacao', JANELA_AMOSTRAGEM),
+                            'modelos': {p: st.session_state.get(f'modelo_{p}') for p in ('ant', 'pos')},
+                            **PARAMS_RF
+                        },
+                        'acuracia': {
+                            periodo: {campo: st.session_state.get(f"{campo}_{periodo}")
+                                      for campo in ('accuracy', 'kappa', 'matrix', 'class_names')}
+                            for periodo in ('ant', 'pos')
+                        },
+                        'areas': st.session_state['areas_dict'],
+                        'parcial': parcial or None,
+                        'identidade_lotes': identidade_lotes,
+                        'amostras': {
+                            'anterior': st.session_state.amostras_anterior,
+                            'posterior': st.session_state.amostras_posterior
+                        },
+                    }
+                    return salvar_execucao(
+                        run_id, registro, rasters_resultado, st.session_state.gdf, lotes,
+                        lotes_por_impressao(lotes, st.session_state.gdf_parcelas) if lotes is not None and identidade_lotes else None
+                    )
+                
+                try:
+                    executar_estagio('persistencia', [run_id, hash_estagio('areas'), hash_estagio('lotes'), parcial],
+                                     _salvar_execucao)
+                    st.caption(f"💾 Execução salva: `{run_id}` (reabra em \"🗂️ Execuções salvas\", sem GEE)"
+                               + (f" — parcial, sem {' e '.join(parcial)} (desatualizado(s) para esta análise)"
+                                  if parcial else ""))
+                except Exception as e:
+                    st.warning(f"⚠️ Não foi possível salvar a execução: {e}")
+            
+            # Registro de modelos: os classificadores treinados nesta análise ficam disponíveis para outros
+            # PAs e anos do mesmo sensor (passo 5, "📚 Usar modelo registrado")
+            periodos_treinados = [p for p in ('ant', 'pos')
+                                  if f'classifier_{p}' in st.session_state and not st.session_state.get(f'modelo_{p}')
+                                  and hash_estagio(f'classificacao_{p}')]
+            if run_id and periodos_treinados:
+                arquivo_pa = uploaded_perimetro or uploaded_parcelas
+                nome_pa = arquivo_pa.name if arquivo_pa is not None else None
+                nome_modelo = st.text_input("Nome do modelo", value=f"{nome_pa or 'PA'} — RF", key="nome_modelo")
+                if st.button("📚 Registrar classificadores para reutilizar em outros PAs/anos"):
+                    try:
+                        with st.spinner("Lendo as árvores dos classificadores treinados..."):
+                            cenas = saida_estagio('cenas') or {}
+                            amostras = {'ant': st.session_state.amostras_anterior, 'pos': st.session_state.amostras_posterior}
+                            datas = {'ant': st.session_state.date_ant, 'pos': st.session_state.date_pos}
+                            for p in periodos_treinados:
+                                modelo_id = registrar_modelo(
+                                    f"{nome_modelo} ({datas[p]})", st.session_state[f'classifier_{p}'],
+                                    st.session_state.get(f'sat_{p}_id') or '', hash_estagio(f'classificacao_{p}'),
+                                    {
+                                        'cena_id': cenas.get(f'id_{p}'), 'data': datas[p], 'nome_pa': nome_pa,
+                                        'parametros': {**PARAMS_RF, 'janela_amostragem': st.session_state.get(
+                                            'janela_classificacao', JANELA_AMOSTRAGEM)},
+                                        'class_names': st.session_state.get(f'class_names_{p}'), 'amostras': amostras[p],
+                                        'accuracy': st.session_state.get(f'accuracy_{p}'),
+                                        'kappa': st.session_state.get(f'kappa_{p}'),
+                                    }
+                                )
+                                st.success(f"✅ Modelo `{modelo_id}` registrado ({datas[p]}).")
+                    except Exception as e:
+                        st.error(f"❌ Erro ao registrar modelo: {e}")
+            
+            # Monitoramento: congela o período anterior (classificação exportada para asset, árvores do
+            # classificador, áreas por lote) como linha de base; o período posterior fica como primeira
+            # data pendente e, como as novas datas, é processado em "📡 Monitoramento", sem refazer a base
+            if run_id and 'classifier_ant' in st.session_state and tarefa_da_sessao('lotes') is None and not previa:
+                if st.button("🧊 Congelar período anterior como linha de base de monitoramento"):
+                    try:
+                        with st.spinner("Exportando a classificação da linha de base para um asset do GEE..."):
+                            cenas = saida_estagio('cenas') if cenas_atuais else {}
+                            arquivo_pa = uploaded_perimetro or uploaded_parcelas
+                            base_id = congelar_linha_base(
+                                run_id,
+                                {
+                                    'nome_pa': arquivo_pa.name if arquivo_pa is not None else None,
+                                    'date_base': st.session_state.date_ant,
+                                    'cena_base': cenas.get('id_ant'),
+                                    'sat_base': st.session_state.get('sat_ant_id'),
+                                    'amostras': {
+                                        'anterior': st.session_state.amostras_anterior,
+                                        'posterior': st.session_state.amostras_posterior
+                                    },
+                                    'imagem': st.session_state.img_anterior,
+                                    'classificada': st.session_state['classified_ant'],
+                                    'classificador': st.session_state['classifier_ant'],
+                                    # Período aplicado com modelo registrado: as árvores já estão no registro
+                                    'arvores': (carregar_modelo(st.session_state['modelo_ant'])['arvores']
+                                                if st.session_state.get('modelo_ant') else None),
+                                },
+                                st.session_state.gdf, st.session_state.gdf_parcelas,
+                                saida_estagio('lotes') if lotes_atuais else None,
+                                primeira_data={
+                                    'data': st.session_state.date_pos, 'cena': cenas.get('id_pos'),
+                                    'sat': st.session_state.get('sat_pos_id'), 'imagem': st.session_state.img_posterior,
+                                }
+                            )
+                            st.success(f"✅ Linha de base `{base_id}` congelada — a classificação segue sendo exportada "
+                                       "para o GEE; abra em \"📡 Monitoramento\" no topo e processe a primeira data "
+                                       f"({st.session_state.date_pos}) quando a exportação terminar.")
                     except Exception as e:
-                        st.error(f"❌ Erro ao processar lotes: {e}")
-                        st.code(traceback.format_exc())
+                        st.error(f"❌ Erro ao congelar linha de base: {e}")
             
             st.markdown("---")
             st.subheader("📄 Gerar Relatório")
             
-            if st.button("📥 Gerar Relatório PDF", type="primary"):
+            # Estágio 'relatorio': PDF refeito só se áreas, acurácias, datas ou PA mudarem
+            entradas_relatorio = [
+                hash_estagio('areas'), hash_estagio('ingest'),
+                st.session_state.get('accuracy_ant'), st.session_state.get('kappa_ant'),
+                st.session_state.get('accuracy_pos'), st.session_state.get('kappa_pos'),
+                st.session_state.date_ant, st.session_state.date_pos, intervalo_anos
+            ]
+            
+            if st.button("📥 Gerar Relatório PDF", type="primary", disabled=previa):
                 try:
-                    pdf = FPDF()
-                    pdf.add_page()
-                    pdf.set_font("Arial", "B", 16)
-                    pdf.cell(0, 10, "DARC - Relatorio de Analise de Desmatamento", ln=True, align="C")
-                    pdf.ln(5)
-                    
-                    pdf.set_font("Arial", "", 12)
-                    pdf.cell(0, 10, "Instituto Federal de Rondonia", ln=True, align="C")
-                    pdf.ln(10)
-                    
-                    pdf.set_font("Arial", "B", 14)
-                    pdf.cell(0, 10, "1. Informacoes do Projeto", ln=True)
-                    pdf.set_font("Arial", "", 11)
-                    area_ha = calcular_area_ha(st.session_state.gdf)
-                    pdf.cell(0, 7, f"Area Total: {area_ha:,.2f} ha", ln=True)
-                    pdf.cell(0, 7, f"Periodo Anterior: {st.session_state.date_ant}", ln=True)
-                    pdf.cell(0, 7, f"Periodo Posterior: {st.session_state.date_pos}", ln=True)
-                    pdf.cell(0, 7, f"Intervalo: {intervalo_anos:.1f} anos", ln=True)
-                    pdf.ln(5)
-                    
-                    pdf.set_font("Arial", "B", 14)
-                    pdf.cell(0, 10, "2. Acuracia da Classificacao", ln=True)
-                    pdf.set_font("Arial", "", 11)
-                    
-                    pdf.cell(0, 7, f"Periodo Anterior (2008):", ln=True)
-                    _acc_ant = st.session_state.get('accuracy_ant')
-                    _kap_ant = st.session_state.get('kappa_ant')
-                    if _acc_ant is not None:
-                        pdf.cell(0, 7, f"  - Precisao Global: {_acc_ant*100:.2f}%", ln=True)
-                        pdf.cell(0, 7, f"  - Indice Kappa: {_kap_ant:.4f}", ln=True)
-                    else:
-                        pdf.cell(0, 7, "  - Precisao Global: N/A (poucas amostras)", ln=True)
-                        pdf.cell(0, 7, "  - Indice Kappa: N/A (poucas amostras)", ln=True)
-                    pdf.ln(3)
-
-                    pdf.cell(0, 7, f"Periodo Posterior (2025):", ln=True)
-                    _acc_pos = st.session_state.get('accuracy_pos')
-                    _kap_pos = st.session_state.get('kappa_pos')
-                    if _acc_pos is not None:
-                        pdf.cell(0, 7, f"  - Precisao Global: {_acc_pos*100:.2f}%", ln=True)
-                        pdf.cell(0, 7, f"  - Indice Kappa: {_kap_pos:.4f}", ln=True)
-                    else:
-                        pdf.cell(0, 7, "  - Precisao Global: N/A (poucas amostras)", ln=True)
-                        pdf.cell(0, 7, "  - Indice Kappa: N/A (poucas amostras)", ln=True)
-                    pdf.ln(5)
-                    
-                    pdf.set_font("Arial", "B", 14)
-                    pdf.cell(0, 10, "3. Areas de Mudanca", ln=True)
-                    pdf.set_font("Arial", "", 11)
-                    
-                    if 'areas_dict' in st.session_state:
-                        for classe, area in st.session_state['areas_dict'].items():
-                            pdf.cell(0, 7, f"{classe}: {area:,.2f} ha", ln=True)
-                        
-                        if 'Desmatamento' in st.session_state['areas_dict']:
-                            taxa = st.session_state['areas_dict']['Desmatamento'] / intervalo_anos
-                            pdf.ln(5)
-                            pdf.set_font("Arial", "B", 11)
-                            pdf.cell(0, 7, f"Taxa Anual: {taxa:.2f} ha/ano", ln=True)
-                    
-                    # Gerar PDF em memória
-                    pdf_output = BytesIO()
-                    pdf_content = pdf.output()
-                    
-                    # FPDF retorna bytearray, converter para bytes
-                    if isinstance(pdf_content, bytearray):
-                        pdf_output.write(bytes(pdf_content))
-                    elif isinstance(pdf_content, bytes):
-                        pdf_output.write(pdf_content)
-                    else:
-                        pdf_output.write(pdf_content.encode('latin1'))
-                    
-                    pdf_output.seek(0)
-                    
-                    st.download_button(
-                        label="📥 Baixar Relatório PDF",
-                        data=pdf_output,
-                        file_name=f"relatorio_darc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                        mime="application/pdf"
+                    pdf_bytes = gerar_relatorio_pdf(
+                        calcular_area_ha(st.session_state.gdf), st.session_state.date_ant, st.session_state.date_pos,
+                        intervalo_anos,
+                        st.session_state.get('accuracy_ant'), st.session_state.get('kappa_ant'),
+                        st.session_state.get('accuracy_pos'), st.session_state.get('kappa_pos'),
+                        st.session_state.get('areas_dict')
                     )
-                    
+                    registrar_estagio('relatorio', impressao('relatorio', entradas_relatorio), pdf_bytes)
                     st.success("✅ Relatório gerado!")
                 
                 except Exception as e:
                     st.error(f"Erro ao gerar relatório: {e}")
+            
+            if estagio_em_cache('relatorio', impressao('relatorio', entradas_relatorio)):
+                st.download_button(
+                    label="📥 Baixar Relatório PDF",
+                    data=saida_estagio('relatorio'),
+                    file_name=f"relatorio_darc_{st.session_state.date_ant}_{st.session_state.date_pos}.pdf",
+                    mime="application/pdf"
+                )
 
 else:
     st.info("👆 **Comece fazendo upload do shapefile do PA** (perímetro OU lotes - se enviar só lotes, o perímetro será calculado automaticamente)")
@@ -0,0 +1,138 @@
+"""Compara a extração das amostras de treino: buffer de 30 m por ponto (antes) × janela k×k na grade (agora).
+
+Cena sintética (grade de 30 m, 10 bandas, ~3% de pixels mascarados) e pontos de treino em posições
+aleatórias dentro dos pixels. Antes: um polígono de buffer de 30 m por ponto, enviado ao servidor, e
+leitura dos pixels cujo centro cai no polígono (regra do sampleRegions) — de 2 a 4 pixels conforme a
+posição do ponto no pixel. Agora: o ponto vai como ponto, é encaixado no pixel que o contém e lê uma
+janela fixa k×k (neighborhoodToArray no GEE; fatiamento do array aqui), descartando janelas com pixel
+mascarado. Mede o tempo de extração local, os pixels por amostra e o tamanho da coleção enviada
+(GeoJSON); o tempo no servidor do GEE depende de credenciais e fica fora da medição.
+
+Uso:
+    python benchmarks/amostragem.py [--pontos 5000] [--janela 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_PIXEL = 30.0
+_LINHAS = _COLUNAS = 2000
+_BANDAS = 10
+
+
+def cena_sintetica(semente=11):
+    """Array [linhas, colunas, bandas] e máscara de validade (nuvens em blocos, ~3% dos pixels)"""
+    import numpy as np
+
+    rng = np.random.default_rng(semente)
+    valores = rng.normal(0.2, 0.05, size=(_LINHAS, _COLUNAS, _BANDAS)).astype('float32')
+    valido = np.ones((_LINHAS, _COLUNAS), dtype=bool)
+    for _ in range(120):
+        r, c = rng.integers(0, _LINHAS - 30), rng.integers(0, _COLUNAS - 30)
+        valido[r:r + rng.integers(5, 30), c:c + rng.integers(5, 30)] = False
+    return valores, valido
+
+
+def pontos_sinteticos(n_pontos, semente=5):
+    """Coordenadas métricas (x, y) longe da borda da cena, em posição aleatória dentro do pixel"""
+    import numpy as np
+
+    rng = np.random.default_rng(semente)
+    margem = 10 * _PIXEL
+    x = rng.uniform(margem, _COLUNAS * _PIXEL - margem, n_pontos)
+    y = rng.uniform(margem, _LINHAS * _PIXEL - margem, n_pontos)
+    return np.column_stack([x, y])
+
+
+def extrair_buffer(valores, valido, pontos):
+    """Caminho antigo: polígono de buffer de 30 m por ponto e pixels com centro dentro dele"""
+    import numpy as np
+    import shapely
+
+    poligonos = shapely.buffer(shapely.points(pontos), 30, quad_segs=8)
+    amostras, por_ponto = [], []
+    for (x, y), poligono in zip(pontos, poligonos):
+        c0, r0 = int(x // _PIXEL) - 2, int(y // _PIXEL) - 2
+        cc, rr = np.meshgrid(np.arange(c0, c0 + 5), np.arange(r0, r0 + 5))
+        dentro = shapely.contains_xy(poligono, (cc + 0.5) * _PIXEL, (rr + 0.5) * _PIXEL)
+        dentro &= valido[rr, cc]
+        amostras.append(valores[rr[dentro], cc[dentro]])
+        por_ponto.append(int(dentro.sum()))
+    return np.concatenate(amostras), np.array(por_ponto), poligonos
+
+
+def extrair_janela(valores, valido, pontos, janela):
+    """Caminho novo: pixel que contém o ponto + janela fixa k×k, descartando janelas incompletas"""
+    import numpy as np
+
+    raio = janela // 2
+    colunas = (pontos[:, 0] // _PIXEL).astype(int)
+    linhas = (pontos[:, 1] // _PIXEL).astype(int)
+    deslocamentos = np.arange(-raio, raio + 1)
+    rr = linhas[:, None, None] + deslocamentos[None, :, None]
+    cc = colunas[:, None, None] + deslocamentos[None, None, :]
+    completas = valido[rr, cc].all(axis=(1, 2))
+    amostras = valores[rr[completas], cc[completas]].reshape(-1, valores.shape[2])
+    return amostras, np.where(completas, janela * janela, 0)
+
+
+def _payload(geometrias):
+    import shapely
+
+    return len(json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': json.loads(g), 'properties': {'class': 0}}
+        for g in shapely.to_geojson(geometrias)
+    ]}))
+
+
+def _cronometrar(funcao, *args, repeticoes=3):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def main():
+    import numpy as np
+    import shapely
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pontos', type=int, default=5000)
+    parser.add_argument('--janela', type=int, default=3)
+    args = parser.parse_args()
+
+    valores, valido = cena_sintetica()
+    pontos = pontos_sinteticos(args.pontos)
+    t_buffer, (amostras_buffer, n_buffer, poligonos) = _cronometrar(extrair_buffer, valores, valido, pontos)
+    t_janela, (amostras_janela, n_janela) = _cronometrar(extrair_janela, valores, valido, pontos, args.janela)
+
+    # Janela completa: exatamente k² pixels por ponto aproveitado, e o pixel central é o do ponto
+    aproveitados = n_janela > 0
+    assert len(amostras_janela) == aproveitados.sum() * args.janela ** 2
+    centro = args.janela ** 2 // 2
+    r, c = (pontos[aproveitados, 1] // _PIXEL).astype(int), (pontos[aproveitados, 0] // _PIXEL).astype(int)
+    assert np.array_equal(amostras_janela.reshape(-1, args.janela ** 2, _BANDAS)[:, centro], valores[r, c])
+
+    kb_buffer = _payload(poligonos) / 1e3
+    kb_janela = _payload(shapely.points(pontos)) / 1e3
+    contagem = {int(k): int(v) for k, v in zip(*np.unique(n_buffer, return_counts=True))}
+
+    print(f"{args.pontos} pontos, cena {_LINHAS}×{_COLUNAS} px, {_BANDAS} bandas\n")
+    print(f"{'':<22} {'tempo (ms)':>10} {'pixels':>8} {'px/ponto (mín–máx)':>20} {'coleção enviada':>16}")
+    print(f"{'antes (buffer 30 m)':<22} {t_buffer * 1e3:>10.1f} {len(amostras_buffer):>8} "
+          f"{f'{n_buffer.min()}–{n_buffer.max()}':>20} {kb_buffer:>13.0f} kB")
+    print(f"{f'agora (janela {args.janela}×{args.janela})':<22} {t_janela * 1e3:>10.1f} {len(amostras_janela):>8} "
+          f"{f'{args.janela ** 2}–{args.janela ** 2}':>20} {kb_janela:>13.0f} kB")
+    print(f"\nbuffer: pixels por ponto → número de pontos: {contagem}")
+    print(f"janela: {(~aproveitados).sum()} pontos descartados por janela com pixel mascarado; "
+          f"{t_buffer / t_janela:.0f}× mais rápido, coleção {kb_buffer / kb_janela:.0f}× menor")
+
+
+if __name__ == '__main__':
+    main()
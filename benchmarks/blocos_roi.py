@@ -0,0 +1,140 @@
+"""Compara a redução de áreas por classe num PA muito grande: uma redução no ROI inteiro × blocos paralelos.
+
+Mapa de mudanças sintético (classes 1–5 em manchas) na grade de 30 m em graus (EPSG:4326), sob um PA
+irregular de ~1,2° × 0,8° em Rondônia. A soma de pixelArea por classe (regra do centro do pixel, como
+o reduceRegion) é calculada aqui com numpy, no lugar do servidor, cujo tempo é simulado por uma latência
+proporcional aos pixels do pedido; um bloco falha uma vez por tempo esgotado e é dividido em quatro.
+Confere que as somas juntadas dos blocos batem com as do ROI inteiro (contagem de pixels idêntica) e
+mostra o tempo de cada bloco. O tempo real no GEE depende de credenciais e fica fora da medição.
+
+Uso:
+    python benchmarks/blocos_roi.py [--px-por-segundo 2e6] [--workers 4]
+"""
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from darc.classificacao import _RES_GRAUS_30M, blocos_roi, reduzir_agrupado_em_blocos  # noqa: E402
+
+_RAIO_TERRA = 6371008.8
+_OESTE, _NORTE = -63.9, -8.8
+
+
+def pa_sintetico():
+    """Polígono irregular (~1,2° × 0,8°) com um buraco, em graus"""
+    from shapely.geometry import Polygon
+
+    angulos = [2 * math.pi * k / 48 for k in range(48)]
+    raios = [1 + 0.18 * math.sin(5 * a) + 0.07 * math.cos(11 * a) for a in angulos]
+    externo = [(_OESTE + 0.6 + 0.55 * r * math.cos(a), _NORTE - 0.4 + 0.36 * r * math.sin(a))
+               for r, a in zip(raios, angulos)]
+    buraco = [(_OESTE + 0.5 + 0.08 * math.cos(a), _NORTE - 0.35 + 0.06 * math.sin(a)) for a in angulos]
+    return Polygon(externo, [buraco])
+
+
+def mapa_sintetico(semente=7):
+    """Classes 1–5 em manchas sobre a grade de 30 m que cobre o PA, com a transformação afim"""
+    import numpy as np
+    from rasterio.transform import from_origin
+
+    linhas, colunas = int(0.85 / _RES_GRAUS_30M), int(1.25 / _RES_GRAUS_30M)
+    rng = np.random.default_rng(semente)
+    grosso = rng.integers(1, 6, size=(linhas // 64 + 1, colunas // 64 + 1), dtype='uint8')
+    classes = np.kron(grosso, np.ones((64, 64), dtype='uint8'))[:linhas, :colunas]
+    # Origem na grade de 30 m com origem em (0, 0), como a projeção de saída do GEE
+    oeste, norte = math.floor(_OESTE / _RES_GRAUS_30M), math.ceil(_NORTE / _RES_GRAUS_30M)
+    return classes, from_origin(oeste * _RES_GRAUS_30M, norte * _RES_GRAUS_30M, _RES_GRAUS_30M, _RES_GRAUS_30M)
+
+
+def reduzir_local(classes, transform, parte):
+    """Soma de pixelArea por classe nos pixels com centro na geometria (como reduceRegion com sum().group(1))"""
+    import numpy as np
+    from rasterio import features, windows
+
+    x0, y0, x1, y1 = parte.bounds
+    c0, r0 = (math.floor(v) for v in ~transform * (x0, y1))
+    c1, r1 = (math.ceil(v) for v in ~transform * (x1, y0))
+    c0, r0, c1, r1 = max(c0, 0), max(r0, 0), min(c1, classes.shape[1]), min(r1, classes.shape[0])
+    if c1 <= c0 or r1 <= r0:
+        return {'groups': []}
+    janela = windows.Window(c0, r0, c1 - c0, r1 - r0)
+    t_janela = windows.transform(janela, transform)
+    bloco = classes[janela.toslices()]
+    dentro = features.geometry_mask([parte], bloco.shape, t_janela, invert=True)
+    linhas = np.nonzero(dentro)[0]
+    lat = t_janela.f + (linhas + 0.5) * t_janela.e
+    area = (_RAIO_TERRA * math.radians(_RES_GRAUS_30M)) ** 2 * np.cos(np.radians(lat))
+    valores = bloco[dentro]
+    return {'groups': [{'group': int(g), 'sum': float(area[valores == g].sum()), 'pixels': int((valores == g).sum())}
+                       for g in np.unique(valores)]}
+
+
+def servidor_simulado(classes, transform, px_por_segundo, falhar=()):
+    """Redução local com latência proporcional aos pixels e tempo esgotado (uma vez) nos blocos de `falhar`"""
+    ja_falharam = set()
+    trava = threading.Lock()
+
+    def reduzir_bloco(parte):
+        resultado = reduzir_local(classes, transform, parte)
+        time.sleep(sum(g['pixels'] for g in resultado['groups']) / px_por_segundo)
+        chave = tuple(round(v, 6) for v in parte.bounds)
+        with trava:
+            if any(parte.intersects(f) for f in falhar) and chave not in ja_falharam and parte.area > 0.02:
+                ja_falharam.add(chave)
+                raise RuntimeError("Computation timed out.")
+        return resultado
+
+    return reduzir_bloco
+
+
+def main():
+    import shapely
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--px-por-segundo', type=float, default=2e6)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    pa = shapely.make_valid(pa_sintetico())
+    classes, transform = mapa_sintetico()
+
+    inicio = time.perf_counter()
+    inteiro = servidor_simulado(classes, transform, args.px_por_segundo)(pa)
+    t_inteiro = time.perf_counter() - inicio
+
+    blocos = blocos_roi(pa)
+    falhar = [blocos[len(blocos) // 2][1].representative_point()]
+    inicio = time.perf_counter()
+    em_blocos = reduzir_agrupado_em_blocos(
+        None, pa, reduzir_bloco=servidor_simulado(classes, transform, args.px_por_segundo, falhar),
+        max_workers=args.workers
+    )
+    t_blocos = time.perf_counter() - inicio
+
+    # Os blocos particionam os centros de pixel do PA: mesmas classes e somas iguais até o arredondamento
+    somas_inteiro = {g['group']: g['sum'] for g in inteiro['groups']}
+    somas_blocos = {g['group']: g['sum'] for g in em_blocos['groups']}
+    assert somas_inteiro.keys() == somas_blocos.keys()
+    assert all(math.isclose(somas_inteiro[g], somas_blocos[g], rel_tol=1e-12) for g in somas_inteiro)
+    n_pixels = sum(g['pixels'] for g in inteiro['groups'])
+
+    print(f"PA sintético: {pa.area:.2f} grau², {n_pixels / 1e6:.1f} milhões de pixels de 30 m, "
+          f"{len(blocos)} blocos de {blocos[0][0][2] - blocos[0][0][0]:.3f}°\n")
+    print(f"{'bloco':<8} {'tempo (s)':>9} {'tentativas':>10} {'dividido':>9}")
+    for b in em_blocos['blocos']:
+        print(f"{b['bloco']:<8} {b['segundos']:>9.2f} {b['tentativas']:>10} {'sim' if b['divisao'] else '':>9}")
+    print(f"\n{'classe':<7} {'ROI inteiro (ha)':>17} {'blocos (ha)':>14} {'diferença relativa':>19}")
+    for g in sorted(somas_inteiro):
+        print(f"{g:<7} {somas_inteiro[g] / 1e4:>17,.2f} {somas_blocos[g] / 1e4:>14,.2f} "
+              f"{abs(somas_blocos[g] - somas_inteiro[g]) / somas_inteiro[g]:>19.1e}")
+    print(f"\nROI inteiro: {t_inteiro:.1f} s numa redução; blocos: {t_blocos:.1f} s com {args.workers} em paralelo "
+          f"(incluindo a nova tentativa do bloco que estourou o tempo) — {t_inteiro / t_blocos:.1f}× mais rápido")
+
+
+if __name__ == '__main__':
+    main()
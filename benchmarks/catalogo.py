@@ -0,0 +1,122 @@
+"""Mede a busca de cenas no catálogo local (SQLite + R-tree) com um catálogo sintético regional.
+
+Footprints sintéticos em grade WRS-2 aproximada (~185 km, inclinados) cobrindo Rondônia e arredores,
+uma cena a cada 16 dias por path/row e coleção, de 1990 até hoje. Mede a consulta ao catálogo
+(R-tree + filtro exato) e a escolha local de cena (escolher_cena) para PAs de tamanhos diferentes.
+A busca antiga (filterBounds/filterDate + getInfo no GEE, ~1–3 s por data) depende de credenciais
+e fica fora da medição.
+
+Uso:
+    python benchmarks/catalogo.py [--repeticoes 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DARC_DIR_CATALOGO'] = tempfile.mkdtemp(prefix='darc_catalogo_')
+
+from darc import catalogo  # noqa: E402
+from darc.cenas import colecoes_landsat, escolher_cena  # noqa: E402
+
+_COLECOES = {
+    'LANDSAT/LT05/C02/T1_L2': ('LANDSAT_5', 1990, 2011),
+    'LANDSAT/LE07/C02/T1_L2': ('LANDSAT_7', 1999, 2022),
+    'LANDSAT/LC08/C02/T1_L2': ('LANDSAT_8', 2013, 2026),
+    'LANDSAT/LC09/C02/T1_L2': ('LANDSAT_9', 2021, 2026),
+}
+
+
+def features_sinteticas(semente=3):
+    """Features no formato devolvido pelo GEE na sincronização, para a grade WRS-2 aproximada de Rondônia e arredores"""
+    from shapely import affinity
+    from shapely.geometry import box, mapping
+
+    rnd = random.Random(semente)
+    hoje_ms = datetime.now(timezone.utc).timestamp() * 1000
+    for col_name, (sat, ano_ini, ano_fim) in _COLECOES.items():
+        for i_path in range(8):
+            for i_row in range(7):
+                x, y = -68 + 1.5 * i_path, -15 + 1.5 * i_row  # ~1 cena a cada 1,5° (185 km com sobreposição)
+                footprint = affinity.rotate(box(x - 0.85, y - 0.85, x + 0.85, y + 0.85), 12)
+                inicio = datetime(ano_ini, 1, 1, tzinfo=timezone.utc).timestamp() * 1000 + rnd.uniform(0, 16) * 86400e3
+                fim = min(datetime(ano_fim, 12, 31, tzinfo=timezone.utc).timestamp() * 1000, hoje_ms)
+                n = 0
+                t = inicio
+                while t < fim:
+                    path, row = 220 + i_path, 60 + i_row
+                    yield {
+                        'type': 'Feature',
+                        'geometry': mapping(footprint),
+                        'properties': {
+                            'id': f"{col_name}/{sat}_{path:03d}{row:03d}_{n:05d}", 'collection': col_name,
+                            'CLOUD_COVER': round(rnd.betavariate(0.6, 1.2) * 100, 2), 'SPACECRAFT_ID': sat,
+                            'WRS_PATH': path, 'WRS_ROW': row, 'time_start': int(t),
+                        },
+                    }
+                    n += 1
+                    t += 16 * 86400e3
+
+
+def preencher_catalogo():
+    """Grava as cenas sintéticas e marca todas as células/anos como sincronizados (nada a buscar no GEE)"""
+    import time as _time
+
+    features = list(features_sinteticas())
+    con = catalogo._conectar_catalogo()
+    try:
+        with con:
+            catalogo._gravar_cenas(con, features)
+            con.executemany(
+                "INSERT OR REPLACE INTO sincronizacoes VALUES (?, ?, ?, ?, NULL, 1, ?)",
+                [(col_name, cx, cy, ano, _time.time())
+                 for col_name in _COLECOES for cx in range(-70, -54) for cy in range(-17, -3)
+                 for ano in range(1990, date.today().year + 1)]
+            )
+    finally:
+        con.close()
+    return len(features)
+
+
+def main():
+    from shapely.geometry import Point
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    n_cenas = preencher_catalogo()
+    print(f"catálogo sintético: {n_cenas} cenas gravadas em {time.perf_counter() - inicio:.1f} s "
+          f"({os.path.getsize(os.path.join(catalogo.DIR_CATALOGO, 'cenas.sqlite')) / 1e6:.1f} MB)\n")
+
+    print(f"{'PA':<20} {'data':<11} {'candidatas':>10} {'sinc (ms)':>10} {'consulta (ms)':>14} {'escolha (ms)':>13}")
+    for rotulo, raio in (('pequeno (~30 km²)', 0.03), ('médio (~3000 km²)', 0.3), ('grande (~10000 km²)', 0.55)):
+        roi = Point(-63.4, -9.2).buffer(raio)
+        for start_date in ('2008-07-15', '2025-07-15'):
+            collections = colecoes_landsat(int(start_date[:4]))
+            janela = catalogo.janela_busca(start_date)
+            t_sinc, t_consulta, t_escolha = [], [], []
+            for _ in range(args.repeticoes):
+                t0 = time.perf_counter()
+                requisicoes = catalogo.sincronizar_catalogo(collections, roi, *janela)
+                t1 = time.perf_counter()
+                candidatos = catalogo.consultar_catalogo(collections, roi, *janela, 80, limite=40)
+                t2 = time.perf_counter()
+                escolha = escolher_cena(candidatos, collections, roi)
+                t3 = time.perf_counter()
+                t_sinc.append(t1 - t0)
+                t_consulta.append(t2 - t1)
+                t_escolha.append(t3 - t2)
+            assert requisicoes == 0 and escolha is not None
+            print(f"{rotulo:<20} {start_date:<11} {len(candidatos):>10} {statistics.median(t_sinc) * 1e3:>10.1f} "
+                  f"{statistics.median(t_consulta) * 1e3:>14.1f} {statistics.median(t_escolha) * 1e3:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Confere a exportação GeoTIFF em blocos (baixar_raster + raster_para_cog) com um substituto local dos blocos do GEE.
+
+Um raster de classes sintético na grade de 30 m (EPSG:4674) faz o papel da imagem do GEE: cada bloco pedido
+por baixar_raster volta como GeoTIFF recortado dele, com 255 fora do PA (como unmask(255) no servidor). O
+PA é côncavo, então parte dos blocos da grade não é pedida, e os blocos da borda direita e de baixo são
+parciais. Uma fração dos pedidos falha (uma ou duas vezes por bloco, dentro das tentativas) e um bloco
+falha sempre numa segunda rodada. Confere a posição de cada bloco no mosaico, o 255 fora do PA e nos
+blocos não pedidos, as novas tentativas, e que o COG tem blocos internos de 512, overviews e DEFLATE.
+
+Uso:
+    python benchmarks/exportacao.py [--tile-px 512] [--falhas 0.3]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from darc.exportacao import _NODATA_EXPORT, _RES_GRAUS_30M, _grade_tiles, baixar_raster, raster_para_cog  # noqa: E402
+
+
+def pa_sintetico():
+    """PA em forma de L (~0,5° × 0,35°), de modo que o canto superior direito da grade fica fora dele"""
+    from shapely.geometry import Polygon
+
+    return Polygon([(-62.5, -9.35), (-62.0, -9.35), (-62.0, -9.2), (-62.3, -9.2), (-62.3, -9.0), (-62.5, -9.0)])
+
+
+def valor_esperado(linhas, colunas):
+    """Classe (1–7) do pixel de 30 m de linha/coluna globais, sem depender do bloco que o contém"""
+    return ((linhas * 7 + colunas * 13) // 97 % 7 + 1).astype('uint8')
+
+
+class BlocosSimulados:
+    """Substituto de _baixar_tile_gee: GeoTIFF de cada bloco, com falhas injetadas e contagem de pedidos"""
+
+    def __init__(self, roi, falhas, semente=1, sempre_falha=None):
+        self.roi = roi
+        self.falhas = falhas
+        self.sempre_falha = sempre_falha
+        self.rnd = random.Random(semente)
+        self.pedidos = Counter()
+        self.falhas_injetadas = Counter()
+        self._trava = threading.Lock()
+
+    def __call__(self, transform, w, h):
+        import numpy as np
+        import rasterio
+        from rasterio import features
+
+        chave = (round(transform.c, 9), round(transform.f, 9))
+        with self._trava:
+            self.pedidos[chave] += 1
+            falhar = chave == self.sempre_falha or (
+                self.falhas_injetadas[chave] < 2 and self.rnd.random() < self.falhas)
+            if falhar:
+                self.falhas_injetadas[chave] += 1
+        if falhar:
+            raise ConnectionError(f"falha simulada no bloco {chave}")
+
+        # Linha/coluna globais a partir da origem da grade de 30 m em (0, 0)
+        col0 = round(transform.c / _RES_GRAUS_30M)
+        lin0 = round(-transform.f / _RES_GRAUS_30M)
+        linhas, colunas = np.mgrid[lin0:lin0 + h, col0:col0 + w]
+        dados = valor_esperado(linhas, colunas)
+        fora = features.geometry_mask([self.roi], (h, w), transform)
+        dados[fora] = _NODATA_EXPORT
+
+        with rasterio.MemoryFile() as mem:
+            with mem.open(driver='GTiff', width=w, height=h, count=1, dtype='uint8',
+                          crs='EPSG:4674', transform=transform) as dst:
+                dst.write(dados, 1)
+            return mem.read()
+
+
+def conferir_mosaico(array, transform, roi, tile_px):
+    """Cada pixel do PA com a classe esperada, 255 fora do PA; blocos não pedidos inteiros em 255"""
+    import numpy as np
+    from rasterio import features
+
+    _, largura, altura, tiles = _grade_tiles(roi, tile_px=tile_px)
+    assert array.shape == (altura, largura)
+    col0 = round(transform.c / _RES_GRAUS_30M)
+    lin0 = round(-transform.f / _RES_GRAUS_30M)
+    linhas, colunas = np.mgrid[lin0:lin0 + altura, col0:col0 + largura]
+    dentro = ~features.geometry_mask([roi], array.shape, transform)
+    assert np.array_equal(array[dentro], valor_esperado(linhas, colunas)[dentro]), "bloco fora do lugar"
+    assert (array[~dentro] == _NODATA_EXPORT).all(), "pixel fora do PA sem 255"
+
+    pedidos = set(tiles)
+    grade = [(c, r, min(tile_px, largura - c), min(tile_px, altura - r))
+             for r in range(0, altura, tile_px) for c in range(0, largura, tile_px)]
+    for c, r, w, h in grade:
+        if (c, r, w, h) not in pedidos:
+            assert (array[r:r + h, c:c + w] == _NODATA_EXPORT).all()
+    parciais = [t for t in tiles if t[2] < tile_px or t[3] < tile_px]
+    return len(grade), len(tiles), len(parciais)
+
+
+def conferir_cog(conteudo):
+    """Perfil do COG: EPSG:4674, nodata 255, blocos 512, overviews e DEFLATE"""
+    import rasterio
+
+    with rasterio.MemoryFile(conteudo) as mem, mem.open() as src:
+        assert src.crs.to_epsg() == 4674
+        assert src.nodata == _NODATA_EXPORT
+        assert src.profile.get('tiled') and src.block_shapes[0] == (512, 512)
+        assert src.compression.name.upper() == 'DEFLATE'
+        assert src.tags(ns='IMAGE_STRUCTURE').get('LAYOUT') == 'COG'
+        overviews = src.overviews(1)
+        assert overviews, "COG sem overviews"
+        return overviews
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tile-px', type=int, default=512)
+    parser.add_argument('--falhas', type=float, default=0.3)
+    args = parser.parse_args()
+
+    roi = pa_sintetico()
+    blocos = BlocosSimulados(roi, args.falhas)
+    inicio = time.perf_counter()
+    array, transform = baixar_raster(None, roi, baixar_tile=blocos, tile_px=args.tile_px)
+    t_download = time.perf_counter() - inicio
+    n_grade, n_pedidos, n_parciais = conferir_mosaico(array, transform, roi, args.tile_px)
+
+    # Novas tentativas: todo bloco com falha injetada foi pedido de novo até dar certo (≤ 3 pedidos)
+    assert all(blocos.pedidos[k] == blocos.falhas_injetadas[k] + 1 for k in blocos.pedidos)
+    assert len(blocos.pedidos) == n_pedidos
+
+    inicio = time.perf_counter()
+    cog = raster_para_cog(array, transform)
+    t_cog = time.perf_counter() - inicio
+    overviews = conferir_cog(cog)
+
+    # Um bloco que falha sempre derruba o download depois de esgotar as tentativas
+    alvo = next(iter(blocos.pedidos))
+    sempre = BlocosSimulados(roi, 0, sempre_falha=alvo)
+    try:
+        baixar_raster(None, roi, baixar_tile=sempre, tile_px=args.tile_px)
+        raise AssertionError("falha permanente não foi propagada")
+    except ConnectionError:
+        pass
+    assert sempre.pedidos[alvo] == 3
+
+    print(f"mosaico {array.shape[1]}×{array.shape[0]} px: {n_grade} blocos na grade, {n_pedidos} pedidos "
+          f"({n_grade - n_pedidos} fora do PA, {n_parciais} parciais na borda)")
+    print(f"pedidos: {sum(blocos.pedidos.values())} ({sum(blocos.falhas_injetadas.values())} falhas injetadas, "
+          f"todas recuperadas) em {t_download:.1f} s")
+    print(f"COG: {len(cog) / 1e3:.0f} kB em {t_cog * 1e3:.0f} ms, blocos 512×512, DEFLATE, overviews {overviews}")
+    print(f"falha permanente: propagada após {sempre.pedidos[alvo]} tentativas no bloco")
+    print("ok: posição dos blocos, 255 fora do PA, novas tentativas e perfil do COG conferidos")
+
+
+if __name__ == '__main__':
+    main()
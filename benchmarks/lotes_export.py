@@ -0,0 +1,107 @@
+"""Compara a montagem/exportação da tabela por lote: planilha em texto (antes) × DataFrame tipado (agora).
+
+Antes: lista de listas com str() por célula → csv.writer (QUOTE_ALL) num StringIO → pd.read_csv
+para a prévia. Agora: montar_tabela_lotes() uma vez → CSV em blocos, Parquet e GeoPackage em disco.
+Lotes sintéticos (quadrados de ~25 ha); mede tempo e pico de memória (tracemalloc) de cada etapa.
+
+Uso:
+    python benchmarks/lotes_export.py [--lotes 50000]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from darc.classificacao import colunas_tabela_lotes, montar_tabela_lotes, tipos_cobertura  # noqa: E402
+from darc.exportacao import gravar_tabela_lotes  # noqa: E402
+
+
+def dados_sinteticos(n_lotes, semente=42):
+    """Entradas no formato que calcular_tabela_lotes acumula a partir das reduções do GEE"""
+    rnd = random.Random(semente)
+    lotes_info = {idx: {'nome': f"Lote {idx + 1}", 'area_ha': round(rnd.uniform(5, 60), 2)} for idx in range(n_lotes)}
+
+    def _areas():
+        return {idx: (round(rnd.uniform(0.1, 30), 2) if rnd.random() > 0.4 else 0.0) for idx in lotes_info}
+
+    return lotes_info, {tipo: _areas() for tipo in tipos_cobertura}, {c: _areas() for c in range(1, 6)}
+
+
+def planilha_texto(lotes_info, classes_2008, classes_mudanca):
+    """Caminho antigo: lista de listas + str() + csv.writer num StringIO"""
+    csv_data = [colunas_tabela_lotes()]
+    for idx in sorted(lotes_info.keys()):
+        lote_row = [lotes_info[idx]['nome'], lotes_info[idx]['area_ha']]
+        for tipo in tipos_cobertura.keys():
+            area = classes_2008[tipo].get(idx, 0.0)
+            lote_row.append(area if area > 0 else '')
+        for classe_num in [1, 2, 3, 4, 5]:
+            area = classes_mudanca[classe_num].get(idx, 0.0)
+            lote_row.append(area if area > 0 else '')
+        csv_data.append(lote_row)
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer, quoting=csv.QUOTE_ALL)
+    for row_data in csv_data:
+        writer.writerow(['' if (val == '' or val is None) else str(val) for val in row_data])
+    return csv_buffer.getvalue()
+
+
+def medir(rotulo, funcao, *args):
+    """Tempo sem tracemalloc (que deixa o Python bem mais lento) e pico de memória numa segunda execução"""
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    duracao = time.perf_counter() - inicio
+    tracemalloc.start()
+    funcao(*args)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{rotulo:<42} {duracao:>8.2f} s {pico / 1e6:>9.1f} MB")
+    return resultado
+
+
+def main():
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import box
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lotes', type=int, default=50000)
+    args = parser.parse_args()
+
+    lotes_info, classes_2008, classes_mudanca = dados_sinteticos(args.lotes)
+    lado = int(args.lotes ** 0.5) + 1
+    gdf_parcelas = gpd.GeoDataFrame(
+        geometry=[box(-62 + (i % lado) * 0.005, -9 - (i // lado) * 0.005,
+                      -62 + (i % lado) * 0.005 + 0.0045, -9 - (i // lado) * 0.005 + 0.0045)
+                  for i in range(args.lotes)],
+        crs="EPSG:4326"
+    )
+
+    print(f"{args.lotes} lotes\n{'etapa':<42} {'tempo':>10} {'pico mem':>12}")
+    texto = medir("antes: planilha em texto (csv.writer)", planilha_texto, lotes_info, classes_2008, classes_mudanca)
+    medir("antes: pd.read_csv para a prévia", lambda t: pd.read_csv(io.StringIO(t)), texto)
+
+    df_lotes = medir("agora: DataFrame tipado", montar_tabela_lotes, lotes_info, classes_2008, classes_mudanca)
+    with tempfile.TemporaryDirectory() as pasta:
+        caminhos = {}
+        for formato in ('csv', 'parquet', 'gpkg'):
+            caminhos[formato] = medir(f"agora: {formato} em disco", gravar_tabela_lotes, df_lotes,
+                                      os.path.join(pasta, f"lotes.{formato}"), formato, gdf_parcelas)
+        with open(caminhos['csv'], 'rb') as arquivo:
+            assert arquivo.read().decode('utf-8') == texto, "CSV em blocos difere da planilha antiga"
+        print("\nCSV em blocos idêntico byte a byte ao antigo")
+        for formato, caminho in caminhos.items():
+            print(f"{formato:<8} {os.path.getsize(caminho) / 1e6:>8.2f} MB")
+    print(f"memória do DataFrame: {df_lotes.memory_usage(deep=True).sum() / 1e6:.1f} MB "
+          f"× texto da planilha: {sys.getsizeof(texto) / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Compara a preparação dos lotes para o GEE: laço com iterrows (antes) × passe vetorizado (agora).
+
+Antes: para cada linha, validação, busca da coluna de nome, .loc na cópia UTM e sanitização da
+geometria uma a uma. Agora: lotes_para_geojson() — make_valid/orientação/arredondamento em arrays
+do shapely 2, uma resolução de nomes por coluna, áreas pelo cache de métricas (Albers) e FeatureCollection GeoJSON
+montada de uma vez. A construção dos objetos ee.* (igual nos dois caminhos e dependente de
+credenciais do GEE) fica fora da medição.
+
+Uso:
+    python benchmarks/preparar_lotes.py [--lotes 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from darc.geo import _COLS_LOTE, _cache_areas, lotes_para_geojson  # noqa: E402
+
+
+def lotes_sinteticos(n_lotes, semente=7):
+    """Quadrados de ~20 ha perto de Porto Velho; ~2% em gravata (inválidos), ~1% vazios, nomes faltando"""
+    import geopandas as gpd
+    from shapely.geometry import Polygon, box
+
+    rnd = random.Random(semente)
+    lado = int(n_lotes ** 0.5) + 1
+    geoms, nomes = [], []
+    for i in range(n_lotes):
+        x, y = -63.9 + (i % lado) * 0.005, -8.7 - (i // lado) * 0.005
+        sorteio = rnd.random()
+        if sorteio < 0.02:
+            geoms.append(Polygon([(x, y), (x + 0.004, y + 0.004), (x + 0.004, y), (x, y + 0.004)]))
+        elif sorteio < 0.03:
+            geoms.append(None)
+        else:
+            geoms.append(box(x, y, x + 0.004, y + 0.004))
+        nomes.append(f"{i + 1:05d}" if rnd.random() > 0.05 else None)
+    return gpd.GeoDataFrame({'NUM_LOTE': nomes}, geometry=geoms, crs="EPSG:4326")
+
+
+def _geojson_por_linha(geom):
+    """Sanitização antiga de geom_para_gee, uma geometria por vez (sem o ee.Geometry final)"""
+    import shapely
+    from shapely.ops import orient as shapely_orient
+    from shapely.ops import unary_union
+
+    if not geom.is_valid:
+        geom = geom.buffer(0)
+    geom = shapely.make_valid(geom)
+    if geom.geom_type == 'GeometryCollection':
+        polys = [g for g in geom.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
+        geom = unary_union(polys) if polys else geom.buffer(0)
+    geom = shapely_orient(geom, sign=1.0)
+
+    def _round_ring(coords):
+        return [(round(c[0], 7), round(c[1], 7)) for c in coords]
+
+    geojson = dict(geom.__geo_interface__)
+    if geojson['type'] == 'Polygon':
+        geojson['coordinates'] = [_round_ring(ring) for ring in geojson['coordinates']]
+    elif geojson['type'] == 'MultiPolygon':
+        geojson['coordinates'] = [[_round_ring(ring) for ring in poly] for poly in geojson['coordinates']]
+    return geojson
+
+
+def preparar_por_linha(gdf_parcelas):
+    """Caminho antigo: iterrows + busca de coluna + .loc UTM + sanitização por linha"""
+    features, lotes_info, lotes_com_erro = [], {}, []
+    # O original usava gdf_parcelas.geometry.unary_union, que dá TopologyException com lotes
+    # inválidos; aqui o centroide sai das geometrias corrigidas para o caminho antigo conseguir rodar
+    _c = gdf_parcelas.geometry.buffer(0).union_all().centroid
+    _zone = int((_c.x + 180) / 6) + 1
+    _epsg_utm = 32600 + _zone if _c.y >= 0 else 32700 + _zone
+    _gdf_parcelas_utm = gdf_parcelas.to_crs(epsg=_epsg_utm)
+
+    for idx, row in gdf_parcelas.iterrows():
+        geom = row.geometry
+        if geom is None or geom.is_empty:
+            lotes_com_erro.append((idx, ''))
+            continue
+        if not geom.is_valid:
+            geom = geom.buffer(0)
+        nome = None
+        for _col in _COLS_LOTE:
+            if _col in gdf_parcelas.columns:
+                _val = str(row[_col]).strip()
+                if _val and _val not in ('nan', 'None', ''):
+                    nome = _val
+                    break
+        if not nome:
+            nome = f'Lote_{idx + 1}'
+        geom_utm = _gdf_parcelas_utm.loc[idx].geometry
+        if not geom_utm.is_valid:
+            geom_utm = geom_utm.buffer(0)
+        lotes_info[idx] = {'nome': nome, 'area_ha': round(geom_utm.area / 10000, 2)}
+        features.append({'type': 'Feature', 'geometry': _geojson_por_linha(geom), 'properties': {'lote_id': idx}})
+    return {'type': 'FeatureCollection', 'features': features}, lotes_info, lotes_com_erro
+
+
+def _coordenadas(geometria):
+    import shapely
+    from shapely.geometry import shape
+
+    return shapely.get_coordinates(shape(geometria))
+
+
+def _vetorizado_sem_cache(gdf_parcelas):
+    """lotes_para_geojson com o cache de áreas vazio (mede a primeira preparação, não a repetição)"""
+    _cache_areas()['areas'].clear()
+    return lotes_para_geojson(gdf_parcelas)
+
+
+def _cronometrar(funcao, *args, repeticoes=3):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def main():
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lotes', type=int, default=10000)
+    args = parser.parse_args()
+
+    gdf_parcelas = lotes_sinteticos(args.lotes)
+    t_antes, (fc_antes, info_antes, erros_antes) = _cronometrar(preparar_por_linha, gdf_parcelas)
+    t_agora, (fc_agora, info_agora, erros_agora) = _cronometrar(_vetorizado_sem_cache, gdf_parcelas)
+
+    # Mesmos lotes, nomes e coordenadas (a menos do arredondamento em 7 casas); áreas: UTM (antes)
+    # × Albers/Brasil (agora) diferem só pela distorção do UTM
+    assert erros_antes == erros_agora
+    assert info_antes.keys() == info_agora.keys()
+    assert all(info_antes[idx]['nome'] == info_agora[idx]['nome'] for idx in info_agora)
+    assert np.allclose([info_antes[idx]['area_ha'] for idx in info_agora],
+                       [info_agora[idx]['area_ha'] for idx in info_agora], rtol=5e-3, atol=0.01)
+    assert len(fc_antes['features']) == len(fc_agora['features'])
+    for a, b in zip(fc_antes['features'], fc_agora['features']):
+        assert a['properties'] == b['properties'] and a['geometry']['type'] == b['geometry']['type']
+        assert np.allclose(_coordenadas(a['geometry']), _coordenadas(b['geometry']), atol=1e-7)
+
+    print(f"{args.lotes} lotes ({len(erros_agora)} vazios)")
+    print(f"antes (iterrows):    {t_antes:7.2f} s")
+    print(f"agora (vetorizado):  {t_agora:7.2f} s  ({t_antes / t_agora:.1f}× mais rápido)")
+    print("saídas equivalentes: nomes, lote_id, coordenadas e áreas (UTM × Albers, < 0,5%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Mede o custo de importação dos módulos e o tempo até a primeira tela do app.
+
+Cada medição roda em um processo Python novo, para que nenhum import fique
+em cache entre elas.
+
+Uso:
+    python benchmarks/startup.py [--repeticoes 3]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULOS = [
+    'streamlit', 'ee', 'folium', 'streamlit_folium', 'geopandas', 'shapely', 'fpdf', 'pandas',
+    'darc.gee', 'darc.estagios', 'darc.tarefas', 'darc.geo', 'darc.catalogo', 'darc.cenas',
+    'darc.classificacao', 'darc.exportacao', 'darc.execucoes', 'darc.relatorio', 'darc.multipa',
+    'darc.modelos', 'darc.monitoramento',
+]
+
+PESADOS = ['ee', 'folium', 'streamlit_folium', 'geopandas', 'pandas', 'fpdf']
+
+CODIGO_IMPORT = """
+import time, sys
+inicio = time.perf_counter()
+import {modulo}
+print(time.perf_counter() - inicio)
+"""
+
+CODIGO_PRIMEIRA_TELA = """
+import time, sys
+sys.path.insert(0, {raiz!r})
+from streamlit.testing.v1 import AppTest
+inicio = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.run()
+duracao = time.perf_counter() - inicio
+assert not at.exception, [e.value for e in at.exception]
+pesados = [m for m in {pesados!r} if m in sys.modules]
+print(duracao)
+print(','.join(pesados))
+"""
+
+
+def _rodar(codigo):
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, capture_output=True, text=True)
+    if saida.returncode != 0:
+        raise RuntimeError(saida.stderr.strip().splitlines()[-1])
+    return saida.stdout.strip().splitlines()
+
+
+def medir_import(modulo, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        tempos.append(float(_rodar(CODIGO_IMPORT.format(modulo=modulo))[0]))
+    return statistics.median(tempos)
+
+
+def medir_primeira_tela(repeticoes):
+    tempos, pesados = [], ''
+    codigo = CODIGO_PRIMEIRA_TELA.format(raiz=RAIZ, app=os.path.join(RAIZ, 'app.py'), pesados=PESADOS)
+    for _ in range(repeticoes):
+        linhas = _rodar(codigo)
+        tempos.append(float(linhas[0]))
+        pesados = linhas[1] if len(linhas) > 1 else ''
+    return statistics.median(tempos), pesados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'módulo':<22} {'import (s)':>10}")
+    for modulo in MODULOS:
+        try:
+            print(f"{modulo:<22} {medir_import(modulo, args.repeticoes):>10.3f}")
+        except RuntimeError as e:
+            print(f"{modulo:<22} {'erro':>10}  {e}")
+
+    duracao, pesados = medir_primeira_tela(args.repeticoes)
+    print(f"\nPrimeira tela (AppTest, processo novo): {duracao:.2f} s")
+    print(f"Bibliotecas pesadas carregadas na primeira tela: {pesados or 'nenhuma'}")
+
+
+if __name__ == '__main__':
+    main()
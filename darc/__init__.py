@@ -0,0 +1 @@
+"""DARC - módulos do sistema de análise de desmatamento (a interface fica em app.py)."""
@@ -0,0 +1,306 @@
+"""Catálogo local de cenas Landsat (SQLite + R-tree) com sincronização incremental com o GEE."""
+import math
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from darc.gee import obter_info
+
+
+# ===== Catálogo local de cenas =====
+# Metadados das cenas (ID, data, sensor, nuvens, path/row e footprint) ficam num SQLite com
+# índice R-tree sobre o bbox do footprint e o dia da cena (x, y, t). A sincronização é por (coleção, célula de 1°, ano):
+# anos encerrados são baixados uma vez; o ano corrente é atualizado de forma incremental, só
+# com as cenas a partir da última já conhecida. A busca e a escolha de cenas rodam localmente;
+# o GEE só é consultado para sincronizar o que falta e, depois, para montar a imagem final.
+# As frações de céu limpo de cada cena dentro de um ROI (QA_PIXEL) ficam no mesmo SQLite, por
+# (cena, impressão do ROI): uma cena já avaliada para o PA não volta ao servidor.
+
+DIR_CATALOGO = os.environ.get('DARC_DIR_CATALOGO', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'catalogo'))
+_TAMANHO_CELULA = 1  # graus
+_VALIDADE_ANO_ABERTO = 24 * 3600  # segundos até reconsultar um ano ainda não encerrado
+_MARGEM_INCREMENTAL = 30  # dias antes da última cena conhecida (cenas publicadas com atraso)
+_DIAS_ENCERRAMENTO = 90  # ano considerado completo este tanto de dias depois de 31/12
+_UNIDADES_POR_REQUISICAO = 8  # (coleção, célula, ano) por getInfo, para ficar longe do limite de 5000 features
+
+
+def _conectar_catalogo():
+    os.makedirs(DIR_CATALOGO, exist_ok=True)
+    con = sqlite3.connect(os.path.join(DIR_CATALOGO, 'cenas.sqlite'), timeout=30)
+    con.row_factory = sqlite3.Row
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS cenas (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT UNIQUE NOT NULL,
+            collection TEXT NOT NULL,
+            time_start INTEGER NOT NULL,
+            spacecraft TEXT,
+            cloud REAL,
+            wrs_path INTEGER,
+            wrs_row INTEGER,
+            footprint BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cenas_colecao_data ON cenas (collection, time_start);
+        CREATE VIRTUAL TABLE IF NOT EXISTS cenas_rtree USING rtree (rowid, min_x, max_x, min_y, max_y, min_dia, max_dia);
+        CREATE TABLE IF NOT EXISTS sincronizacoes (
+            collection TEXT NOT NULL,
+            celula_x INTEGER NOT NULL,
+            celula_y INTEGER NOT NULL,
+            ano INTEGER NOT NULL,
+            ate INTEGER,
+            completo INTEGER NOT NULL,
+            sincronizado_em REAL NOT NULL,
+            PRIMARY KEY (collection, celula_x, celula_y, ano)
+        );
+        CREATE TABLE IF NOT EXISTS nuvens_roi (
+            id TEXT NOT NULL,
+            roi TEXT NOT NULL,
+            limpo REAL,
+            calculado_em REAL NOT NULL,
+            PRIMARY KEY (id, roi)
+        );
+    """)
+    return con
+
+
+def janela_busca(start_date):
+    """Janela de datas das buscas de cena: 6 meses antes a 12 meses depois de start_date (date, date)"""
+    from dateutil.relativedelta import relativedelta
+
+    inicio = date.fromisoformat(start_date)
+    return inicio - relativedelta(months=6), inicio + relativedelta(months=12)
+
+
+def _celulas(geom):
+    """Células de 1° (canto inferior esquerdo) que tocam a geometria"""
+    from shapely.geometry import box
+    from shapely.prepared import prep
+
+    x0, y0, x1, y1 = geom.bounds
+    geom_prep = prep(geom)
+    return [
+        (cx, cy)
+        for cx in range(math.floor(x0 / _TAMANHO_CELULA), math.floor(x1 / _TAMANHO_CELULA) + 1)
+        for cy in range(math.floor(y0 / _TAMANHO_CELULA), math.floor(y1 / _TAMANHO_CELULA) + 1)
+        if geom_prep.intersects(box(cx * _TAMANHO_CELULA, cy * _TAMANHO_CELULA,
+                                    (cx + 1) * _TAMANHO_CELULA, (cy + 1) * _TAMANHO_CELULA))
+    ]
+
+
+def _ms(dia):
+    return int(datetime(dia.year, dia.month, dia.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _dia(ms):
+    """Dias desde 1970 — o R-tree guarda float32, exato para dias mas não para milissegundos"""
+    return int(ms // 86400000)
+
+
+def _pendencias(con, collections, celulas, anos):
+    """Unidades (coleção, célula, ano) a sincronizar, com o instante a partir do qual buscar"""
+    agora = time.time()
+    pendentes = []
+    for col_name in collections:
+        for cx, cy in celulas:
+            for ano in anos:
+                linha = con.execute(
+                    "SELECT ate, completo, sincronizado_em FROM sincronizacoes "
+                    "WHERE collection = ? AND celula_x = ? AND celula_y = ? AND ano = ?",
+                    (col_name, cx, cy, ano)
+                ).fetchone()
+                if linha is None:
+                    pendentes.append((col_name, cx, cy, ano, _ms(date(ano, 1, 1))))
+                elif not linha['completo'] and agora - linha['sincronizado_em'] > _VALIDADE_ANO_ABERTO:
+                    desde = _ms(date(ano, 1, 1)) if linha['ate'] is None else \
+                        max(_ms(date(ano, 1, 1)), linha['ate'] - _MARGEM_INCREMENTAL * 86400 * 1000)
+                    pendentes.append((col_name, cx, cy, ano, desde))
+    return pendentes
+
+
+def _consultar_unidades(unidades):
+    """Footprints e propriedades das cenas de várias unidades numa única chamada ao servidor"""
+    import ee
+
+    def _footprint(img):
+        return ee.Feature(img.geometry(), {
+            'id': img.id(),
+            'CLOUD_COVER': img.get('CLOUD_COVER'),
+            'SPACECRAFT_ID': img.get('SPACECRAFT_ID'),
+            'WRS_PATH': img.get('WRS_PATH'),
+            'WRS_ROW': img.get('WRS_ROW'),
+            'time_start': img.get('system:time_start'),
+        })
+
+    fc_total = None
+    for col_name, cx, cy, ano, desde in unidades:
+        celula = ee.Geometry.Rectangle([cx * _TAMANHO_CELULA, cy * _TAMANHO_CELULA,
+                                        (cx + 1) * _TAMANHO_CELULA, (cy + 1) * _TAMANHO_CELULA])
+        fc = ee.ImageCollection(col_name) \
+            .filterBounds(celula) \
+            .filterDate(ee.Date(desde), ee.Date(_ms(date(ano + 1, 1, 1)))) \
+            .map(_footprint) \
+            .map(lambda f, col_name=col_name: f.set('collection', col_name))
+        fc_total = fc if fc_total is None else fc_total.merge(fc)
+    return obter_info(ee.FeatureCollection(fc_total)).get('features', [])
+
+
+def _gravar_cenas(con, features):
+    import shapely
+    from shapely.geometry import shape
+
+    for feature in features:
+        props = feature['properties']
+        geom = shape(feature['geometry'])
+        cursor = con.execute(
+            """INSERT INTO cenas (id, collection, time_start, spacecraft, cloud, wrs_path, wrs_row, footprint)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (id) DO UPDATE SET cloud = excluded.cloud, footprint = excluded.footprint
+               RETURNING rowid""",
+            (props['id'], props['collection'], int(props['time_start']), props.get('SPACECRAFT_ID'),
+             props.get('CLOUD_COVER', 100), props.get('WRS_PATH'), props.get('WRS_ROW'), shapely.to_wkb(geom))
+        )
+        rowid = cursor.fetchone()[0]
+        x0, y0, x1, y1 = geom.bounds
+        dia = _dia(props['time_start'])
+        con.execute("INSERT OR REPLACE INTO cenas_rtree VALUES (?, ?, ?, ?, ?, ?, ?)", (rowid, x0, x1, y0, y1, dia, dia))
+
+
+def sincronizar_catalogo(collections, geom, inicio, fim):
+    """Traz do GEE as cenas que faltam no catálogo para a área (Shapely, EPSG:4326) e o intervalo de datas.
+
+    Anos futuros são ignorados; anos encerrados e sincronizados não voltam a ser consultados.
+    Retorna o número de requisições feitas ao servidor (0 se o catálogo já estava em dia).
+    """
+    hoje = date.today()
+    anos = range(inicio.year, min(fim.year, hoje.year) + 1)
+    con = _conectar_catalogo()
+    try:
+        pendentes = _pendencias(con, collections, _celulas(geom), anos)
+        for i in range(0, len(pendentes), _UNIDADES_POR_REQUISICAO):
+            lote = pendentes[i:i + _UNIDADES_POR_REQUISICAO]
+            features = _consultar_unidades(lote)
+            agora = time.time()
+            with con:
+                _gravar_cenas(con, features)
+                for col_name, cx, cy, ano, _ in lote:
+                    ate = con.execute(
+                        "SELECT MAX(c.time_start) FROM cenas_rtree r JOIN cenas c ON c.rowid = r.rowid "
+                        "WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ? "
+                        "AND r.max_dia >= ? AND r.min_dia <= ? AND c.collection = ?",
+                        (cx * _TAMANHO_CELULA, (cx + 1) * _TAMANHO_CELULA,
+                         cy * _TAMANHO_CELULA, (cy + 1) * _TAMANHO_CELULA,
+                         _dia(_ms(date(ano, 1, 1))), _dia(_ms(date(ano + 1, 1, 1))) - 1, col_name)
+                    ).fetchone()[0]
+                    completo = hoje > date(ano, 12, 31) + timedelta(days=_DIAS_ENCERRAMENTO)
+                    con.execute(
+                        "INSERT OR REPLACE INTO sincronizacoes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (col_name, cx, cy, ano, ate, int(completo), agora)
+                    )
+        return math.ceil(len(pendentes) / _UNIDADES_POR_REQUISICAO)
+    finally:
+        con.close()
+
+
+def consultar_catalogo(collections, geom, inicio, fim, cloud_max, limite=None):
+    """Cenas do catálogo que tocam a geometria, na janela de datas e abaixo do limite de nuvens (local, sem GEE).
+
+    Mesma forma de retorno das candidatas da busca no servidor: lista de
+    {'id', 'collection', 'props', 'cloud', 'geom'}, menor nuvem primeiro dentro de cada coleção,
+    até `limite` por coleção.
+    """
+    import shapely
+    from shapely.prepared import prep
+
+    x0, y0, x1, y1 = geom.bounds
+    geom_prep = prep(geom)
+    con = _conectar_catalogo()
+    try:
+        candidatos = []
+        for col_name in collections:
+            linhas = con.execute(
+                """SELECT c.* FROM cenas_rtree r JOIN cenas c ON c.rowid = r.rowid
+                   WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?
+                     AND r.max_dia >= ? AND r.min_dia <= ?
+                     AND c.collection = ? AND c.time_start >= ? AND c.time_start < ? AND c.cloud < ?
+                   ORDER BY c.cloud""",
+                (x0, x1, y0, y1, _dia(_ms(inicio)), _dia(_ms(fim)), col_name, _ms(inicio), _ms(fim), cloud_max)
+            )
+            n = 0
+            for linha in linhas:
+                footprint = shapely.from_wkb(linha['footprint'])
+                if not geom_prep.intersects(footprint):
+                    continue
+                candidatos.append({
+                    'id': linha['id'],
+                    'collection': col_name,
+                    'props': {
+                        'id': linha['id'], 'collection': col_name, 'CLOUD_COVER': linha['cloud'],
+                        'SPACECRAFT_ID': linha['spacecraft'], 'WRS_PATH': linha['wrs_path'],
+                        'WRS_ROW': linha['wrs_row'], 'time_start': linha['time_start'],
+                    },
+                    'cloud': linha['cloud'],
+                    'geom': footprint,
+                })
+                n += 1
+                if limite is not None and n >= limite:
+                    break
+        return candidatos
+    finally:
+        con.close()
+
+
+def impressao_roi(geom):
+    """Impressão da geometria do ROI (Shapely, EPSG:4326) normalizada numa grade de 1e-7°"""
+    import hashlib
+
+    import shapely
+
+    wkb = shapely.to_wkb(shapely.normalize(shapely.set_precision(geom, 1e-7)))
+    return hashlib.blake2b(wkb, digest_size=16).hexdigest()
+
+
+def nuvens_roi_em_cache(ids, roi):
+    """Frações limpas já calculadas para o ROI (impressão): {id: limpo}; limpo None = cena sem pixels no ROI"""
+    if not ids:
+        return {}
+    con = _conectar_catalogo()
+    try:
+        notas = {}
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            notas.update(con.execute(
+                f"SELECT id, limpo FROM nuvens_roi WHERE roi = ? AND id IN ({', '.join('?' * len(lote))})",
+                [roi, *lote]
+            ).fetchall())
+        return notas
+    finally:
+        con.close()
+
+
+def gravar_nuvens_roi(roi, notas):
+    """Grava {id: limpo} calculados para o ROI (impressão)"""
+    con = _conectar_catalogo()
+    try:
+        with con:
+            agora = time.time()
+            con.executemany("INSERT OR REPLACE INTO nuvens_roi VALUES (?, ?, ?, ?)",
+                            [(id_cena, roi, limpo, agora) for id_cena, limpo in notas.items()])
+    finally:
+        con.close()
+
+
+def resumo_catalogo():
+    """Número de cenas e última sincronização — sem abrir o GEE, roda na primeira tela"""
+    if not os.path.exists(os.path.join(DIR_CATALOGO, 'cenas.sqlite')):
+        return {'cenas': 0, 'sincronizado_em': None}
+    con = _conectar_catalogo()
+    try:
+        n_cenas = con.execute("SELECT COUNT(*) FROM cenas").fetchone()[0]
+        ultima = con.execute("SELECT MAX(sincronizado_em) FROM sincronizacoes").fetchone()[0]
+    finally:
+        con.close()
+    return {
+        'cenas': n_cenas,
+        'sincronizado_em': None if ultima is None else datetime.fromtimestamp(ultima).isoformat(sep=' ', timespec='minutes'),
+    }
@@ -0,0 +1,326 @@
+"""Busca de cenas Landsat: cobertura do ROI, máscara de nuvens e composição mediana."""
+from darc.catalogo import (
+    consultar_catalogo, gravar_nuvens_roi, impressao_roi, janela_busca, nuvens_roi_em_cache, sincronizar_catalogo
+)
+from darc.gee import obter_info
+from darc.geo import geom_para_gee
+
+# Bits do QA_PIXEL (Landsat Collection 2) tratados como nuvem: nuvem dilatada, cirrus, nuvem, sombra
+_BITS_NUVEM = (1 << 1) | (1 << 2) | (1 << 3) | (1 << 4)
+# Escala (m) da nota de nuvens no ROI: a fração limpa não precisa de 30 m e a redução fica leve
+_ESCALA_NUVENS_ROI = 90
+
+
+def cobertura_gulosa(roi_geom, candidatos, tolerancia=1e-4, campo_nuvem='cloud'):
+    """Set cover guloso do polígono real do ROI com footprints de cenas (local, sem GEE).
+
+    candidatos: lista de dicts com 'geom' (Shapely, EPSG:4326) e `campo_nuvem` ('cloud' = CLOUD_COVER
+    da cena, 'nuvem_roi' = nuvens dentro do ROI).
+    Para cada limiar de nuvens (em ordem crescente) tenta cobrir o ROI só com cenas
+    abaixo do limiar — o primeiro limiar viável é a combinação de menor nuvem máxima.
+    Dentro do limiar, escolhe gulosamente a cena que mais cobre a área restante,
+    desempatando pela menor nuvem.
+    Retorna a lista de candidatos escolhidos ou None se nenhuma combinação cobre o ROI.
+    """
+    from shapely.ops import unary_union
+    from shapely.prepared import prep
+
+    roi_prep = prep(roi_geom)
+    area_min = roi_geom.area * tolerancia
+    uteis = [c for c in candidatos if roi_prep.intersects(c['geom'])]
+    if not uteis:
+        return None
+
+    # Descarta de cara limiares cuja união não cobre o ROI
+    for limiar in sorted({c[campo_nuvem] for c in uteis}):
+        pool = [c for c in uteis if c[campo_nuvem] <= limiar]
+        if roi_geom.difference(unary_union([c['geom'] for c in pool])).area > area_min:
+            continue
+
+        restante = roi_geom
+        escolhidos = []
+        while restante.area > area_min and pool:
+            restante_prep = prep(restante)
+            ganhos = [
+                (restante.intersection(c['geom']).area, -c[campo_nuvem], i)
+                for i, c in enumerate(pool) if restante_prep.intersects(c['geom'])
+            ]
+            if not ganhos:
+                break
+            melhor_area, _, i_melhor = max(ganhos)
+            if melhor_area <= 0:
+                break
+            melhor = pool[i_melhor]
+            escolhidos.append(melhor)
+            pool.remove(melhor)
+            restante = restante.difference(melhor['geom'])
+
+        if restante.area <= area_min:
+            return escolhidos
+    return None
+
+
+def colecoes_landsat(year):
+    """Coleções Landsat C2 L2 candidatas para o ano, em ordem de prioridade (igual GEE)"""
+    if year <= 2011:
+        return ['LANDSAT/LT05/C02/T1_L2']  # Landsat 5
+    elif year <= 2013:
+        return ['LANDSAT/LE07/C02/T1_L2', 'LANDSAT/LT05/C02/T1_L2']  # L7 ou L5
+    elif year <= 2021:
+        return ['LANDSAT/LC08/C02/T1_L2', 'LANDSAT/LE07/C02/T1_L2']  # L8 ou L7
+    else:
+        return ['LANDSAT/LC09/C02/T1_L2', 'LANDSAT/LC08/C02/T1_L2']  # L9 ou L8
+
+
+def mascara_qa_pixel(image):
+    """Mascara nuvem, sombra e cirrus pelos bits do QA_PIXEL (Landsat Collection 2).
+    Bit 1: nuvem dilatada | Bit 2: cirrus | Bit 3: nuvem | Bit 4: sombra de nuvem
+    """
+    qa = image.select('QA_PIXEL')
+    return image.updateMask(qa.bitwiseAnd(_BITS_NUVEM).eq(0))
+
+
+def compor_mediana(start_date, roi):
+    """Composição mediana por pixel, sem nuvens, na mesma janela da busca de cena única.
+
+    Usa só a família de sensor da coleção prioritária do ano (OLI ou TM/ETM+), para
+    manter os nomes de banda SR_B* esperados por preparar_bandas. Tudo numa única
+    expressão no servidor; retorna None se não houver cenas na janela.
+    A banda extra N_OBS traz o número de observações válidas por pixel.
+    """
+    import ee
+
+    collections = colecoes_landsat(int(start_date.split('-')[0]))
+    oli = 'LC08' in collections[0] or 'LC09' in collections[0]
+    familia = [c for c in collections if ('LC08' in c or 'LC09' in c) == oli]
+
+    colecao = None
+    for col_name in familia:
+        col = ee.ImageCollection(col_name) \
+            .filterBounds(roi) \
+            .filterDate(
+                ee.Date(start_date).advance(-6, 'month'),
+                ee.Date(start_date).advance(12, 'month')
+            )
+        colecao = col if colecao is None else colecao.merge(col)
+
+    if obter_info(colecao.size()) == 0:
+        return None
+
+    mascarada = colecao.map(mascara_qa_pixel).select('SR_B.')
+    n_obs = mascarada.select(0).count().rename('N_OBS').toInt16()
+    composicao = mascarada.median().addBands(n_obs)
+
+    return composicao \
+        .set('system:time_start', ee.Date(start_date).millis()) \
+        .set('system:id', f"MEDIANA/{familia[0]}/{start_date}") \
+        .set('SPACECRAFT_ID', colecao.sort('system:time_start', False).first().get('SPACECRAFT_ID')) \
+        .set('CLOUD_COVER', colecao.aggregate_mean('CLOUD_COVER')) \
+        .set('N_CENAS', colecao.size()) \
+        .set('collection', familia[0])
+
+
+def aplicar_fatores_escala(image):
+    """Reflectância de superfície: SR_B* × 0.0000275 − 0.2"""
+    optical = image.select('SR_B.').multiply(0.0000275).add(-0.2)
+    return image.addBands(optical, None, True)
+
+
+def buscar_candidatas(start_date, geom, cloud_max, limite=40):
+    """Candidatas do ano para a geometria (Shapely, EPSG:4326) pelo catálogo local de cenas.
+
+    Sincroniza antes o que faltar no catálogo (nenhuma chamada ao servidor se já estiver em dia).
+    Retorna uma lista de {'id', 'collection', 'props', 'cloud', 'geom'} (geom = footprint em Shapely),
+    até `limite` por coleção, menor nuvem primeiro.
+    """
+    collections = colecoes_landsat(int(start_date.split('-')[0]))
+    inicio, fim = janela_busca(start_date)
+    sincronizar_catalogo(collections, geom, inicio, fim)
+    return consultar_catalogo(collections, geom, inicio, fim, cloud_max, limite=limite)
+
+
+def pontuar_nuvens_roi(candidatos, roi_local):
+    """Nuvens dentro do ROI (QA_PIXEL) de todas as candidatas numa única redução mapeada no servidor.
+
+    Cada candidata ganha 'nuvem_roi': % dos pixels válidos do ROI cobertos por nuvem, cirrus ou sombra
+    (100 se a cena não tem pixels no ROI). As notas ficam no catálogo por (cena, impressão do ROI);
+    só as candidatas ainda sem nota vão ao GEE. Retorna o número de requisições (0 ou 1).
+    """
+    import ee
+
+    roi_hash = impressao_roi(roi_local)
+    notas = nuvens_roi_em_cache([c['id'] for c in candidatos], roi_hash)
+    pendentes = [c['id'] for c in candidatos if c['id'] not in notas]
+    if pendentes:
+        roi = geom_para_gee(roi_local)
+
+        def _nota(img):
+            qa = img.select('QA_PIXEL')
+            # Bit 0 do QA_PIXEL: preenchimento (fora da cena) — não conta no denominador
+            limpo = qa.bitwiseAnd(_BITS_NUVEM).eq(0).updateMask(qa.bitwiseAnd(1).eq(0))
+            media = limpo.reduceRegion(reducer=ee.Reducer.mean(), geometry=roi, scale=_ESCALA_NUVENS_ROI,
+                                       maxPixels=1e9, bestEffort=True)
+            return ee.Feature(None, {'cena': img.get('cena'), 'limpo': media.get('QA_PIXEL')})
+
+        colecao = ee.ImageCollection([ee.Image(id_cena).set('cena', id_cena) for id_cena in pendentes])
+        novas = {id_cena: None for id_cena in pendentes}
+        novas.update({f['properties']['cena']: f['properties'].get('limpo')
+                      for f in obter_info(colecao.map(_nota)).get('features', [])})
+        gravar_nuvens_roi(roi_hash, novas)
+        notas.update(novas)
+
+    for c in candidatos:
+        limpo = notas.get(c['id'])
+        c['nuvem_roi'] = 100.0 if limpo is None else round(100 * (1 - limpo), 2)
+    return 1 if pendentes else 0
+
+
+def escolher_cena(candidatos, collections, roi_local):
+    """Escolha local: cena de menor nuvem que cobre o ROI inteiro; senão set cover da mesma família de sensor.
+
+    Com as notas de pontuar_nuvens_roi, "menor nuvem" é a nuvem dentro do ROI; sem elas, o CLOUD_COVER da cena.
+    Retorna None ou {'cenas': [candidatos, menor nuvem primeiro], 'collection', 'cloud', 'nuvem_roi' (bool)}.
+    """
+    campo = 'nuvem_roi' if candidatos and all('nuvem_roi' in c for c in candidatos) else 'cloud'
+
+    # 1) Cena única que cobre todo o ROI — prioridade pela ordem das coleções
+    for col_name in collections:
+        inteiras = sorted(
+            (c for c in candidatos
+             if c['collection'] == col_name and c['geom'].covers(roi_local)),
+            key=lambda c: (c[campo], c['cloud'])
+        )
+        if inteiras:
+            return {'cenas': inteiras[:1], 'collection': col_name, 'cloud': inteiras[0][campo],
+                    'nuvem_roi': campo == 'nuvem_roi'}
+
+    # 2) Fallback: set cover guloso com cenas de qualquer path/row/data,
+    #    separado por família de sensor (mesmo layout de bandas)
+    familias = {}
+    for c in candidatos:
+        familia = 'OLI' if ('LC08' in c['collection'] or 'LC09' in c['collection']) else 'TM'
+        familias.setdefault(familia, []).append(c)
+
+    melhor = None
+    for grupo in familias.values():
+        escolhidos = cobertura_gulosa(roi_local, grupo, campo_nuvem=campo)
+        if not escolhidos:
+            continue
+        chave = (max(c[campo] for c in escolhidos), len(escolhidos))
+        if melhor is None or chave < melhor[0]:
+            melhor = (chave, escolhidos)
+
+    if melhor is None:
+        return None
+
+    escolhidos = sorted(melhor[1], key=lambda c: c[campo])
+    return {'cenas': escolhidos, 'collection': escolhidos[0]['collection'], 'cloud': melhor[0][0],
+            'nuvem_roi': campo == 'nuvem_roi'}
+
+
+def imagem_da_escolha(escolha):
+    """ee.Image da escolha de escolher_cena: a própria cena, ou o mosaico das cenas escolhidas"""
+    import ee
+
+    if len(escolha['cenas']) == 1:
+        return ee.Image(escolha['cenas'][0]['id']).set('collection', escolha['collection'])
+
+    escolhidos = escolha['cenas']
+    principal = escolhidos[0]
+    # mosaic() põe a última imagem por cima → menor nuvem por último
+    mosaic = ee.ImageCollection(
+        [ee.Image(c['id']) for c in reversed(escolhidos)]
+    ).mosaic()
+    mosaic = mosaic \
+        .set('system:time_start', principal['props']['time_start']) \
+        .set('SPACECRAFT_ID', principal['props']['SPACECRAFT_ID']) \
+        .set('CLOUD_COVER', escolha['cloud']) \
+        .set('CENAS_MOSAICO', [c['id'] for c in escolhidos]) \
+        .set('collection', principal['collection'])
+    return mosaic
+
+
+def buscar_cena(start_date, cloud_max, roi_local):
+    """Cena de menor nuvem no ROI que cobre o ROI inteiro; senão mosaico (set cover) de cenas da mesma família de sensor.
+
+    Candidatas do catálogo local, notas de nuvem no ROI numa única requisição (ou do cache) e escolha local;
+    retorna None ou a escolha de escolher_cena (a imagem sai de imagem_da_escolha).
+    """
+    candidatos = buscar_candidatas(start_date, roi_local, cloud_max)
+    if not candidatos:
+        return None
+    pontuar_nuvens_roi(candidatos, roi_local)
+    return escolher_cena(candidatos, colecoes_landsat(int(start_date.split('-')[0])), roi_local)
+
+
+def metadados_da_escolha(escolha, sufixo):
+    """Data, nuvens, satélite e ID de uma escolha de cena, direto do catálogo (sem chamada ao servidor).
+
+    Com notas de nuvem no ROI, cloud_* é a nuvem dentro do ROI e cloud_cena_* o maior CLOUD_COVER das cenas.
+    """
+    from datetime import datetime, timezone
+
+    principal = escolha['cenas'][0]
+    data = datetime.fromtimestamp(principal['props']['time_start'] / 1000, tz=timezone.utc)
+    metadados = {
+        f'date_{sufixo}': data.strftime('%Y-%m-%d'),
+        f'cloud_{sufixo}': escolha['cloud'],
+        f'sat_{sufixo}': principal['props']['SPACECRAFT_ID'],
+        f'id_{sufixo}': ' + '.join(c['id'] for c in escolha['cenas']),
+    }
+    if escolha.get('nuvem_roi'):
+        metadados[f'cloud_cena_{sufixo}'] = max(c['cloud'] for c in escolha['cenas'])
+    return metadados
+
+
+def buscar_cenas_periodos(tarefa, data_ant, data_pos, composicao, cloud_max, roi, roi_local):
+    """Imagens dos dois períodos com metadados (roda como Tarefa): composição mediana ou cena única do catálogo.
+
+    Retorna {'img_ant', 'img_pos', date_*, cloud_*, sat_*, id_*}; só {'img_ant', 'img_pos'} (com None)
+    se um dos períodos não tiver imagem.
+    """
+    if composicao:
+        tarefa.etapa("Compondo mediana ANTERIOR")
+        img_ant = compor_mediana(data_ant, roi)
+        tarefa.etapa("Compondo mediana POSTERIOR")
+        img_pos = compor_mediana(data_pos, roi)
+        if img_ant is None or img_pos is None:
+            return {'img_ant': img_ant, 'img_pos': img_pos}
+
+        img_ant = aplicar_fatores_escala(img_ant)
+        img_pos = aplicar_fatores_escala(img_pos)
+
+        # Metadados das duas cenas numa única chamada ao servidor
+        tarefa.etapa("Lendo metadados das composições")
+        return {'img_ant': img_ant, 'img_pos': img_pos, **metadados_cenas(img_ant, img_pos)}
+
+    # Cena única: escolha no catálogo local; o servidor só monta a imagem final
+    tarefa.etapa("Buscando imagem ANTERIOR no catálogo")
+    escolha_ant = buscar_cena(data_ant, cloud_max, roi_local)
+    tarefa.etapa("Buscando imagem POSTERIOR no catálogo")
+    escolha_pos = buscar_cena(data_pos, cloud_max, roi_local)
+    if escolha_ant is None or escolha_pos is None:
+        return {'img_ant': escolha_ant, 'img_pos': escolha_pos}
+
+    return {
+        'img_ant': aplicar_fatores_escala(imagem_da_escolha(escolha_ant)),
+        'img_pos': aplicar_fatores_escala(imagem_da_escolha(escolha_pos)),
+        **metadados_da_escolha(escolha_ant, 'ant'),
+        **metadados_da_escolha(escolha_pos, 'pos'),
+    }
+
+
+def metadados_cenas(img_ant, img_pos):
+    """Data, nuvens, satélite e ID das duas cenas numa única chamada ao servidor"""
+    import ee
+
+    return obter_info(ee.Dictionary({
+        'date_ant': img_ant.date().format('YYYY-MM-dd'),
+        'cloud_ant': img_ant.get('CLOUD_COVER'),
+        'sat_ant': img_ant.get('SPACECRAFT_ID'),
+        'id_ant': img_ant.id(),
+        'date_pos': img_pos.date().format('YYYY-MM-dd'),
+        'cloud_pos': img_pos.get('CLOUD_COVER'),
+        'sat_pos': img_pos.get('SPACECRAFT_ID'),
+        'id_pos': img_pos.id(),
+    }))
@@ -0,0 +1,851 @@
+"""Classificação Random Forest, série temporal anual, análise de mudança e tabela por lote."""
+from darc.cenas import colecoes_landsat, mascara_qa_pixel
+from darc.gee import PRIORIDADE_ANALISE, PRIORIDADE_LOTE, obter_info
+from darc.geo import geom_para_gee, impressoes_lotes, lotes_para_geojson
+
+
+# Definir tipos de cobertura (usado em várias partes do código)
+tipos_cobertura = {
+    'Floresta': '#00FF00',        # Verde limão (bem visível)
+    'Pastagem': '#FFFF00',        # Amarelo puro
+    'Água': '#00FFFF',            # Ciano (azul claro)
+    'Outra Vegetação': '#FF00FF', # MAGENTA (roxo forte) - BEM DIFERENTE!
+    'Solo Exposto': '#FF8C00',    # Laranja forte
+    'Queimada': '#FF0000',        # Vermelho puro
+    'Agricultura': '#FFD700'      # Dourado
+}
+
+# Paleta do mapa de mudanças (códigos 1 a 5: FF, AC, CH, DI, FR)
+palette_mudanca = ['#228B22', '#F5DEB3', '#4169E1', '#FF0000', '#90EE90']
+
+# Parâmetros do Random Forest (gravados junto com cada execução)
+PARAMS_RF = {'numberOfTrees': 50, 'minLeafPopulation': 5, 'bagFraction': 0.5}
+
+# Escala (m) da prévia rápida: classificação e áreas aproximadas no ROI em segundos. Treino,
+# acurácia e imagens classificadas não dependem da escala e são reaproveitados na resolução completa
+ESCALA_PREVIA = 120
+
+# Lado da janela de amostragem (k×k pixels da grade da cena em torno de cada ponto de treino).
+# None volta ao buffer de 30 m por ponto (número de pixels varia com a posição do ponto no pixel).
+# A janela muda o conjunto de treino: entra na impressão da classificação e nos parâmetros gravados
+# com cada execução e modelo registrado, para que resultados de janelas diferentes não se misturem
+JANELA_AMOSTRAGEM = 1
+OPCOES_JANELA_AMOSTRAGEM = {
+    1: "1×1 — só o pixel do ponto",
+    3: "3×3 — pixel do ponto e vizinhos",
+    5: "5×5 — pixel do ponto e vizinhos",
+    None: "Buffer de 30 m (método antigo)",
+}
+
+
+def criar_samples(amostras_dict, class_map):
+    """Converte {tipo: [[lon, lat], ...]} em FeatureCollection de pontos com propriedade 'class'"""
+    import ee
+
+    features = []
+    for tipo, pontos in amostras_dict.items():
+        if len(pontos) > 0:
+            class_num = class_map[tipo]
+            for ponto in pontos:
+                features.append(ee.Feature(
+                    ee.Geometry.Point(ponto),
+                    {'class': class_num}
+                ))
+    return ee.FeatureCollection(features)
+
+
+# Bandas de reflectância usadas por sensor (TM: B1–B5, B7; demais: B2–B7) e índices calculados
+_BANDAS_SR = {
+    True: ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'],
+    False: ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'],
+}
+_INDICES = ['NDVI', 'SAVI', 'NBR', 'MNDWI']
+
+
+def _e_landsat5(sat):
+    return 'LANDSAT_5' in sat or 'LT05' in sat
+
+
+def sensor_landsat(sat):
+    """SPACECRAFT_ID (ou ID de coleção) → sensor: 'TM', 'ETM+' ou 'OLI' (Landsat 8 e 9 têm as mesmas bandas)"""
+    if _e_landsat5(sat):
+        return 'TM'
+    if 'LANDSAT_7' in sat or 'LE07' in sat:
+        return 'ETM+'
+    return 'OLI'
+
+
+def esquema_bandas(sat):
+    """Nomes das bandas, na ordem, que preparar_bandas entrega ao classificador para esse satélite"""
+    return _BANDAS_SR[_e_landsat5(sat)] + _INDICES
+
+
+def preparar_bandas(image, is_l5=False):
+    """Bandas SR + NDVI, SAVI, NBR e MNDWI usadas na classificação de cada período"""
+    if is_l5:
+        bands = image.select(_BANDAS_SR[True])
+        ndvi = image.normalizedDifference(['SR_B4', 'SR_B3']).rename('NDVI')
+        savi = image.expression(
+            '(((NIR - RED) / (NIR + RED + 0.5))*(1+0.5))',
+            {'NIR': image.select('SR_B4'), 'RED': image.select('SR_B3')}
+        ).rename('SAVI')
+        nbr = image.normalizedDifference(['SR_B4', 'SR_B7']).rename('NBR')
+        mndwi = image.normalizedDifference(['SR_B2', 'SR_B5']).rename('MNDWI')
+    else:
+        bands = image.select(_BANDAS_SR[False])
+        ndvi = image.normalizedDifference(['SR_B5', 'SR_B4']).rename('NDVI')
+        savi = image.expression(
+            '(((NIR - RED) / (NIR + RED + 0.5))*(1+0.5))',
+            {'NIR': image.select('SR_B5'), 'RED': image.select('SR_B4')}
+        ).rename('SAVI')
+        nbr = image.normalizedDifference(['SR_B5', 'SR_B7']).rename('NBR')
+        mndwi = image.normalizedDifference(['SR_B3', 'SR_B6']).rename('MNDWI')
+
+    return bands.addBands(ndvi).addBands(savi).addBands(nbr).addBands(mndwi)
+
+
+def amostrar_pontos(bands, pontos, projecao=None, janela=JANELA_AMOSTRAGEM):
+    """Extrai os valores das bandas em torno de cada ponto de treino (propriedade 'class').
+
+    Com janela=k, cada ponto é encaixado no pixel da grade que o contém (projeção da própria
+    cena, ou `projecao` para compostos) e lê uma janela fixa k×k via neighborhoodToArray: um
+    único pixel amostrado por ponto, desdobrado em k² amostras. Janelas com algum pixel
+    mascarado (nuvem, borda da cena) são descartadas inteiras, então todo ponto aproveitado
+    rende exatamente k² pixels.
+    """
+    import ee
+
+    if janela is None:
+        # Caminho antigo: buffer de 30 m por ponto (~5 pixels por amostra, replica GEE original)
+        return bands.sampleRegions(
+            collection=pontos.map(lambda f: f.buffer(30)),
+            properties=['class'],
+            scale=30
+        )
+
+    if projecao is None:
+        projecao = bands.select(0).projection()
+    nomes = bands.bandNames()
+    kernel = ee.Kernel.square(janela // 2, 'pixels')
+    completa = bands.mask().reduce(ee.Reducer.min()).reduceNeighborhood(ee.Reducer.min(), kernel)
+    janelas = bands.neighborhoodToArray(kernel).updateMask(completa).sampleRegions(
+        collection=pontos,
+        properties=['class'],
+        projection=projecao,
+        scale=30,
+        geometries=False
+    )
+
+    def _desdobrar(f):
+        # [k², n_bandas]: uma linha por pixel da janela
+        matriz = ee.Array.cat(nomes.map(lambda b: ee.Array(f.get(b)).reshape([-1, 1])), 1)
+        return ee.FeatureCollection(matriz.toList().map(
+            lambda linha: ee.Feature(None, ee.Dictionary.fromLists(nomes, linha)).set('class', f.get('class'))
+        ))
+
+    return janelas.map(_desdobrar).flatten()
+
+
+def _treinar_periodo(tarefa, rotulo, bands, samples_all, amostras, split, seed, roi, janela=JANELA_AMOSTRAGEM):
+    """Split treino/validação, treino do RF e acurácia de um período (ANTERIOR/POSTERIOR).
+
+    Retorna (classifier, classified, accuracy, kappa, matrix, class_names).
+    """
+    import ee
+
+    # Split treino/validação com randomColumn
+    if split is not None:
+        samples_all = samples_all.randomColumn('random', seed=seed)
+        training = samples_all.filter(ee.Filter.lt('random', split))
+        validation = samples_all.filter(ee.Filter.gte('random', split))
+        # Verificar tamanho da validação antes de prosseguir
+        if obter_info(validation.size(), PRIORIDADE_ANALISE) == 0:
+            raise ValueError(f"Validação {rotulo} vazia após split! Colete mais amostras (mínimo 10 por classe).")
+    else:
+        training = samples_all
+        validation = None
+
+    tarefa.etapa(f"Treinando período {rotulo}")
+    training_data = amostrar_pontos(bands, training, janela=janela)
+
+    # Verificar amostras extraídas
+    n_training = obter_info(training_data.size(), PRIORIDADE_ANALISE)
+    if n_training == 0:
+        raise ValueError(f"Amostras {rotulo} fora da imagem!")
+
+    # VALIDAÇÃO CRÍTICA: Verificar classes únicas
+    classes_unicas = obter_info(training_data.aggregate_array('class').distinct().size(), PRIORIDADE_ANALISE)
+    tarefa.aviso('info', f"🎯 Período {rotulo}: {n_training} amostras, {classes_unicas} classes")
+    if classes_unicas < 2:
+        raise ValueError(f"Apenas {classes_unicas} classe no período {rotulo}! "
+                         "Colete amostras de pelo menos 2 tipos diferentes")
+
+    classifier = ee.Classifier.smileRandomForest(**PARAMS_RF).train(
+        features=training_data,
+        classProperty='class',
+        inputProperties=bands.bandNames()
+    )
+    classified = bands.classify(classifier).clip(roi)
+
+    tarefa.etapa(f"Calculando acurácia {rotulo}")
+    if validation is not None:
+        test = classified.sampleRegions(
+            collection=validation,
+            properties=['class'],
+            scale=30
+        )
+        confusion = test.errorMatrix('class', 'classification')
+        # Acurácia, kappa e matriz numa única chamada ao servidor
+        metricas = obter_info(ee.Dictionary({
+            'accuracy': confusion.accuracy(),
+            'kappa': confusion.kappa(),
+            'matrix': confusion.array()
+        }), PRIORIDADE_ANALISE)
+        accuracy, kappa, matrix = metricas['accuracy'], metricas['kappa'], metricas['matrix']
+    else:
+        accuracy = kappa = matrix = None
+
+    # Nomes de classes como dict {índice: nome} — robusto contra gaps na sequência
+    class_map = {tipo: i for i, tipo in enumerate(tipos_cobertura.keys())}
+    class_names = {class_map[t]: t for t in tipos_cobertura.keys() if len(amostras[t]) > 0}
+    return classifier, classified, accuracy, kappa, matrix, class_names
+
+
+def arvores_classificador(classifier):
+    """Árvores do Random Forest treinado (explain()['trees']), lidas do servidor numa chamada.
+
+    O treino roda uma vez aqui; o classificador refeito com classificador_de_arvores não depende
+    mais da cena nem das amostras do treino.
+    """
+    return obter_info(classifier.explain().get('trees'), PRIORIDADE_ANALISE)
+
+
+def classificador_de_arvores(arvores):
+    """Classificador do GEE a partir das árvores salvas (decisionTreeEnsemble), sem amostras nem treino"""
+    import ee
+
+    return ee.Classifier.decisionTreeEnsemble(arvores)
+
+
+def _aplicar_modelo(tarefa, rotulo, bands, sat, modelo, roi):
+    """Classifica um período com um classificador do registro de modelos, sem amostras nem treino.
+
+    Retorna a mesma tupla de _treinar_periodo; acurácia, kappa e matriz ficam None (não há validação).
+    """
+    tarefa.etapa(f"Aplicando modelo registrado ({rotulo})")
+    if modelo['sensor'] != sensor_landsat(sat) or modelo['esquema_bandas'] != esquema_bandas(sat):
+        raise ValueError(f"Modelo '{modelo['nome']}' foi treinado com {modelo['sensor']} "
+                         f"e não serve para a cena {rotulo} ({sat}).")
+    classifier = classificador_de_arvores(modelo['arvores'])
+    classified = bands.classify(classifier).clip(roi)
+    tarefa.aviso('info', f"📚 Período {rotulo}: modelo registrado '{modelo['nome']}' "
+                         f"({modelo['sensor']}, cena {modelo['cena_id']}) — sem retreino")
+    class_names = {int(c): nome for c, nome in modelo['class_names'].items()}
+    return classifier, classified, None, None, None, class_names
+
+
+def classificar_periodos(tarefa, img_anterior, img_posterior, sat_ant, sat_pos,
+                         samples_ant_all, samples_pos_all, amostras_anterior, amostras_posterior, roi,
+                         periodos=('ant', 'pos'), modelos=None, janela=JANELA_AMOSTRAGEM):
+    """Treina um Random Forest por período e classifica as imagens (roda como Tarefa).
+
+    `periodos` restringe o trabalho aos períodos que mudaram ('ant', 'pos' ou ambos); os demais
+    são reaproveitados pelo chamador. Cada período usa só as próprias amostras e seed, então o
+    resultado de um período não depende do outro; a imagem de um período fora de `periodos` pode
+    ser None.
+    `modelos` ({periodo: modelo de darc.modelos}) classifica esses períodos com um classificador
+    registrado, sem amostras nem treino. `janela`: lado da janela de amostragem do treino (amostrar_pontos).
+    Retorna as chaves de sessão do resultado dos períodos pedidos: classifier_*, classified_*, accuracy_*,
+    kappa_*, matrix_*, class_names_*, modelo_* (ID do modelo aplicado ou None).
+    """
+    import ee
+
+    modelos = modelos or {}
+    treinados = tuple(p for p in periodos if p not in modelos)
+
+    tarefa.etapa("Contando amostras")
+    bands_ant = preparar_bandas(img_anterior, _e_landsat5(sat_ant)) if 'ant' in periodos else None
+    bands_pos = preparar_bandas(img_posterior, _e_landsat5(sat_pos)) if 'pos' in periodos else None
+
+    samples = {'ant': samples_ant_all, 'pos': samples_pos_all}
+    if treinados:
+        n_samples = obter_info(ee.Dictionary({p: samples[p].size() for p in treinados}), PRIORIDADE_ANALISE)
+        tarefa.aviso('info', "📊 Total de amostras: " + ", ".join(
+            f"{'Anterior' if p == 'ant' else 'Posterior'}={n_samples[p]}" for p in treinados
+        ))
+
+    # Split adaptativo baseado na menor classe de cada período
+    splits = {}
+    for periodo, rotulo, amostras in [('ant', 'Anterior', amostras_anterior), ('pos', 'Posterior', amostras_posterior)]:
+        if periodo not in treinados:
+            continue
+        menor = min((len(v) for v in amostras.values() if v), default=0)
+        if menor < 6:
+            splits[periodo] = None
+            tarefa.aviso('warning', f"⚠️ Período {rotulo}: alguma classe tem menos de 6 amostras. Usando todos os pontos para treino — indicadores de acurácia não serão calculados.")
+        elif menor < 10:
+            splits[periodo] = 0.8
+            tarefa.aviso('info', f"ℹ️ Período {rotulo}: poucas amostras — usando divisão 80/20 para maximizar o treino.")
+        else:
+            splits[periodo] = 0.7
+
+    resultado = {}
+    for periodo, rotulo, bands, sat, samples_all, amostras, seed in [
+        ('ant', 'ANTERIOR', bands_ant, sat_ant, samples_ant_all, amostras_anterior, 0),
+        ('pos', 'POSTERIOR', bands_pos, sat_pos, samples_pos_all, amostras_posterior, 42),
+    ]:
+        if periodo not in periodos:
+            continue
+        if periodo in modelos:
+            classifier, classified, accuracy, kappa, matrix, class_names = _aplicar_modelo(
+                tarefa, rotulo, bands, sat, modelos[periodo], roi
+            )
+        else:
+            classifier, classified, accuracy, kappa, matrix, class_names = _treinar_periodo(
+                tarefa, rotulo, bands, samples_all, amostras, splits[periodo], seed, roi, janela
+            )
+        resultado.update({
+            f'modelo_{periodo}': modelos[periodo]['modelo_id'] if periodo in modelos else None,
+            f'classifier_{periodo}': classifier,
+            f'classified_{periodo}': classified,
+            f'accuracy_{periodo}': accuracy,
+            f'kappa_{periodo}': kappa,
+            f'matrix_{periodo}': matrix,
+            f'class_names_{periodo}': class_names,
+        })
+    tarefa.aviso('success', "✅ Classificação concluída! Role para baixo!")
+    return resultado
+
+
+# Harmonização entre sensores (Roy et al. 2016): TM/ETM+ → OLI, reflectância de superfície
+BANDAS_HARMONIZADAS = ['BLUE', 'GREEN', 'RED', 'NIR', 'SWIR1', 'SWIR2']
+_ROY_SLOPES = [0.8474, 0.8483, 0.9047, 0.8462, 0.8937, 0.9071]
+_ROY_ITCPS = [0.0003, 0.0088, 0.0061, 0.0412, 0.0254, 0.0172]
+
+
+def _harmonizar(image, oli):
+    """Aplica QA_PIXEL, fatores de escala e renomeia para BANDAS_HARMONIZADAS (domínio OLI)"""
+    image = mascara_qa_pixel(image)
+    if oli:
+        bands = image.select(['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'])
+    else:
+        bands = image.select(['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'])
+    bands = bands.multiply(0.0000275).add(-0.2).rename(BANDAS_HARMONIZADAS)
+    if not oli:
+        bands = bands.multiply(_ROY_SLOPES).add(_ROY_ITCPS).rename(BANDAS_HARMONIZADAS)
+    return bands.copyProperties(image, ['system:time_start'])
+
+
+def preparar_bandas_harmonizadas(image):
+    """Mesmo conjunto de 10 bandas de preparar_bandas, com nomes independentes do sensor"""
+    ndvi = image.normalizedDifference(['NIR', 'RED']).rename('NDVI')
+    savi = image.expression(
+        '(((NIR - RED) / (NIR + RED + 0.5))*(1+0.5))',
+        {'NIR': image.select('NIR'), 'RED': image.select('RED')}
+    ).rename('SAVI')
+    nbr = image.normalizedDifference(['NIR', 'SWIR2']).rename('NBR')
+    mndwi = image.normalizedDifference(['GREEN', 'SWIR1']).rename('MNDWI')
+    return image.select(BANDAS_HARMONIZADAS).addBands(ndvi).addBands(savi).addBands(nbr).addBands(mndwi)
+
+
+def composicao_anual(ano, mes, roi):
+    """Mediana sem nuvens de todos os sensores do ano, harmonizados, numa janela de ±3 meses do mês alvo"""
+    import ee
+
+    centro = ee.Date.fromYMD(ano, mes, 15)
+    colecao = None
+    for col_name in colecoes_landsat(ano):
+        oli = 'LC08' in col_name or 'LC09' in col_name
+        col = ee.ImageCollection(col_name) \
+            .filterBounds(roi) \
+            .filterDate(centro.advance(-3, 'month'), centro.advance(3, 'month')) \
+            .map(lambda img: _harmonizar(img, oli))
+        colecao = col if colecao is None else colecao.merge(col)
+    return preparar_bandas_harmonizadas(colecao.median()).set('ano', ano)
+
+
+def classificar_serie_anual(anos, mes, roi, treino, parcelas_fc=None, janela=JANELA_AMOSTRAGEM):
+    """Classifica um composto por ano com um único Random Forest e reduz tudo em lote.
+
+    treino: lista de (ano, FeatureCollection de pontos com 'class') — amostras de cada período
+    são extraídas do composto harmonizado do próprio ano e unidas num só treinamento.
+    Todas as áreas (por classe, desmatamento ano a ano, por lote) saem de uma única imagem
+    multibanda reduzida numa só chamada getInfo().
+
+    Retorna {'roi': {banda: m²}, 'lotes': [{'lote_id', banda: m²}, ...]}. Bandas:
+    '<ano>_c<classe>' (área de cada classe) e '<ano>_DI' (floresta do ano anterior perdida).
+    """
+    import ee
+
+    compostos = {ano: composicao_anual(ano, mes, roi) for ano in anos}
+    # Compostos (median) não têm grade própria: a janela usa a mesma grade de 30 m em todos os anos
+    grade = ee.Projection('EPSG:4326').atScale(30)
+
+    amostras = None
+    for ano, pontos in treino:
+        extraidas = amostrar_pontos(compostos[ano], pontos, grade, janela)
+        amostras = extraidas if amostras is None else amostras.merge(extraidas)
+
+    classifier = ee.Classifier.smileRandomForest(**PARAMS_RF).train(
+        features=amostras,
+        classProperty='class',
+        inputProperties=compostos[anos[0]].bandNames()
+    )
+
+    area = ee.Image.pixelArea()
+    n_classes = len(tipos_cobertura)
+    pilha = []
+    floresta_anterior = None
+    for ano in anos:
+        classificado = compostos[ano].classify(classifier).clip(roi)
+        for c in range(n_classes):
+            pilha.append(classificado.eq(c).multiply(area).rename(f"{ano}_c{c}"))
+        floresta = classificado.eq(0)
+        if floresta_anterior is not None:
+            perda = floresta_anterior.And(floresta.Not())
+            pilha.append(perda.multiply(area).rename(f"{ano}_DI"))
+        floresta_anterior = floresta
+    pilha = ee.Image.cat(pilha).unmask(0)
+
+    resultado = {
+        'roi': pilha.reduceRegion(
+            reducer=ee.Reducer.sum(),
+            geometry=roi,
+            scale=30,
+            maxPixels=1e13
+        )
+    }
+    if parcelas_fc is not None:
+        # Sem geometria no retorno — só as somas por lote
+        resultado['lotes'] = pilha.reduceRegions(
+            collection=parcelas_fc,
+            reducer=ee.Reducer.sum(),
+            scale=30
+        ).map(lambda f: ee.Feature(None, f.toDictionary()))
+
+    info = obter_info(ee.Dictionary(resultado), PRIORIDADE_LOTE)
+    if 'lotes' in info:
+        info['lotes'] = [f['properties'] for f in info['lotes']['features']]
+    return info
+
+
+def anos_com_imagens(anos, mes, roi):
+    """Filtra os anos que têm ao menos uma cena na janela do composto (uma chamada getInfo)"""
+    import ee
+
+    tamanhos = []
+    for ano in anos:
+        centro = ee.Date.fromYMD(ano, mes, 15)
+        n = ee.Number(0)
+        for col_name in colecoes_landsat(ano):
+            n = n.add(ee.ImageCollection(col_name)
+                      .filterBounds(roi)
+                      .filterDate(centro.advance(-3, 'month'), centro.advance(3, 'month'))
+                      .size())
+        tamanhos.append(n)
+    tamanhos = obter_info(ee.List(tamanhos), PRIORIDADE_LOTE)
+    return [ano for ano, n in zip(anos, tamanhos) if n > 0]
+
+
+def tabela_serie_anual(anos, areas_roi):
+    """Tabela ano × classe (ha) + coluna de desmatamento anual a partir das somas da série"""
+    import pandas as pd
+
+    linhas = []
+    for ano in anos:
+        linha = {'Ano': ano}
+        for c, tipo in enumerate(tipos_cobertura.keys()):
+            linha[tipo] = round((areas_roi.get(f"{ano}_c{c}") or 0) / 10000, 2)
+        linha['Desmatamento'] = round((areas_roi.get(f"{ano}_DI") or 0) / 10000, 2) if ano != anos[0] else None
+        linhas.append(linha)
+    return pd.DataFrame(linhas).set_index('Ano')
+
+
+def processar_serie_anual(tarefa, ano_ant, ano_pos, mes, roi, treino, parcelas_fc=None, lotes_info=None,
+                          janela=JANELA_AMOSTRAGEM):
+    """Série anual entre dois anos (roda como Tarefa): anos com imagens, classificação e tabelas.
+
+    treino e parcelas_fc como em classificar_serie_anual; lotes_info ({lote_id: {'nome'}}) de preparar_lotes.
+    Retorna {'anos', 'tabela' (tabela_serie_anual), 'lotes' (DataFrame lote × ano em ha, ou None)}.
+    """
+    import pandas as pd
+
+    tarefa.etapa("Conferindo anos com imagens")
+    anos = anos_com_imagens(list(range(ano_ant, ano_pos + 1)), mes, roi)
+    if ano_ant not in anos or ano_pos not in anos:
+        raise ValueError("Sem imagens Landsat para o ano anterior ou posterior nesta janela.")
+    anos_sem = sorted(set(range(ano_ant, ano_pos + 1)) - set(anos))
+    if anos_sem:
+        tarefa.aviso('warning', f"⚠️ Anos sem imagens (ignorados): {', '.join(map(str, anos_sem))}")
+
+    tarefa.etapa(f"Classificando {len(anos)} anos")
+    res = classificar_serie_anual(anos, mes, roi, treino, parcelas_fc, janela)
+
+    tarefa.etapa("Montando tabelas")
+    linhas_lotes = []
+    for props in res.get('lotes', []):
+        info = (lotes_info or {}).get(props['lote_id'], {})
+        for ano in anos:
+            linha = {'Lote': info.get('nome'), 'Ano': ano}
+            for c, tipo in enumerate(tipos_cobertura.keys()):
+                linha[f"{tipo}_ha"] = round((props.get(f"{ano}_c{c}") or 0) / 10000, 2)
+            linha['DI_ha'] = round((props.get(f"{ano}_DI") or 0) / 10000, 2) if ano != anos[0] else None
+            linhas_lotes.append(linha)
+
+    tarefa.aviso('success', f"✅ Série anual concluída: {len(anos)} anos classificados!")
+    return {
+        'anos': anos,
+        'tabela': tabela_serie_anual(anos, res['roi']),
+        'lotes': pd.DataFrame(linhas_lotes) if linhas_lotes else None,
+    }
+
+
+def calcular_mudanca(classified_ant, classified_pos, roi):
+    """Análise booleana da Reserva Legal: FF=1, AC=2, CH=3, DI=4 (desmatamento), FR=5 (regeneração)"""
+    import ee
+
+    from_list = list(range(len(tipos_cobertura)))
+    to_list = [1 if i == 0 else (3 if i == 2 else 2) for i in range(len(tipos_cobertura))]
+    
+    class_ant_remap = classified_ant.remap(from_list, to_list, 0)
+    class_pos_remap = classified_pos.remap(from_list, to_list, 0)
+    
+    FF = 1
+    AC = 2
+    CH = 3
+    DI = 4
+    FR = 5
+    
+    return ee.Image(1) \
+        .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(FF)), FF) \
+        .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(AC)), DI) \
+        .where(class_ant_remap.eq(FF).And(class_pos_remap.eq(CH)), DI) \
+        .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(AC)), AC) \
+        .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(FF)), FR) \
+        .where(class_ant_remap.eq(AC).And(class_pos_remap.eq(CH)), CH) \
+        .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(CH)), CH) \
+        .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(FF)), FR) \
+        .where(class_ant_remap.eq(CH).And(class_pos_remap.eq(AC)), AC) \
+        .clip(roi)
+
+
+# Reduções em blocos para PAs muito grandes: o ROI é particionado nas células de uma grade alinhada
+# à grade de 30 m (EPSG:4326) e cada bloco é reduzido em paralelo, com novas tentativas; um bloco que
+# estoura memória/tempo do servidor é dividido em quatro. Os blocos não se sobrepõem, então as somas
+# por grupo dos blocos somam exatamente a do ROI inteiro.
+_RES_GRAUS_30M = 0.00026949458523585647
+_LADO_BLOCO = 1024 * _RES_GRAUS_30M  # ~0,28° (~30 km): ~1 milhão de pixels de 30 m por bloco
+_ERROS_DIVISIVEIS = ('memory limit', 'timed out', 'too many pixels')
+
+
+def blocos_roi(roi_local, lado=_LADO_BLOCO):
+    """Partição do ROI (Shapely, EPSG:4326) nas células de uma grade de `lado` graus: [(bounds da célula, parte)]"""
+    import math
+
+    import shapely
+
+    x0, y0, x1, y1 = roi_local.bounds
+    colunas = range(math.floor(x0 / lado), math.ceil(x1 / lado))
+    linhas = range(math.floor(y0 / lado), math.ceil(y1 / lado))
+    celulas = [(i * lado, j * lado, (i + 1) * lado, (j + 1) * lado) for j in linhas for i in colunas]
+    shapely.prepare(roi_local)
+    partes = shapely.intersection(shapely.box(*zip(*celulas)), roi_local) if celulas else []
+    return [(celula, parte) for celula, parte in zip(celulas, partes) if parte.area > 0]
+
+
+def reduzir_agrupado_em_blocos(imagem, roi_local, escala=30, lado=_LADO_BLOCO, reduzir_bloco=None,
+                               max_workers=4, tentativas=3, max_divisoes=2):
+    """Soma agrupada (banda 0 somada por valor da banda 1) no ROI, bloco a bloco e em paralelo.
+
+    Mesmo formato de retorno do reduceRegion com sum().group(1) — {'groups': [{'group', 'sum'}]} — mais
+    'blocos': tempo, tentativas e divisão de cada bloco. reduzir_bloco(parte) -> dict permite trocar a
+    origem das somas (por padrão, reduceRegion no GEE).
+    """
+    import math
+    import random
+    import time
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    import ee
+    import shapely
+
+    if reduzir_bloco is None:
+        def reduzir_bloco(parte):
+            return obter_info(imagem.reduceRegion(
+                reducer=ee.Reducer.sum().group(1),
+                geometry=geom_para_gee(parte),
+                scale=escala,
+                maxPixels=1e13
+            ), PRIORIDADE_ANALISE)
+
+    def _reduzir(rotulo, celula, parte, divisao):
+        """Reduz um bloco com novas tentativas; estouro de memória/tempo devolve as quatro subdivisões"""
+        for tentativa in range(1, tentativas + 1):
+            inicio = time.perf_counter()
+            try:
+                resultado = reduzir_bloco(parte)
+                return [(resultado, {'bloco': rotulo, 'bounds': celula, 'segundos': time.perf_counter() - inicio,
+                                     'tentativas': tentativa, 'divisao': divisao})], []
+            except Exception as e:
+                if any(t in str(e).lower() for t in _ERROS_DIVISIVEIS):
+                    if divisao >= max_divisoes:
+                        raise
+                    break
+                # Outros erros (autenticação, geometria, cota): só novas tentativas, sem dividir
+                if tentativa == tentativas:
+                    raise
+                time.sleep(2 ** (tentativa - 1) + random.random())
+        x0, y0, x1, y1 = celula
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        subdivisoes = []
+        for k, sub in enumerate(((x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1))):
+            sub_parte = shapely.intersection(shapely.box(*sub), parte)
+            if sub_parte.area > 0:
+                subdivisoes.append((f"{rotulo}.{k + 1}", sub, sub_parte, divisao + 1))
+        return [], subdivisoes
+
+    parciais = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # As subdivisões de um bloco voltam para o pool em vez de rodar em sequência no mesmo worker
+        pendentes = [pool.submit(_reduzir, str(n), celula, parte, 0)
+                     for n, (celula, parte) in enumerate(blocos_roi(roi_local, lado), 1)]
+        while pendentes:
+            concluidos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            pendentes = list(pendentes)
+            for futuro in concluidos:
+                try:
+                    prontos, subdivisoes = futuro.result()
+                except Exception:
+                    for pendente in pendentes:
+                        pendente.cancel()
+                    raise
+                parciais += prontos
+                pendentes += [pool.submit(_reduzir, *args) for args in subdivisoes]
+    parciais.sort(key=lambda item: [int(n) for n in item[1]['bloco'].split('.')])
+
+    somas = {}
+    for resultado, _ in parciais:
+        for g in (resultado or {}).get('groups', []):
+            somas.setdefault(int(g['group']), []).append(g['sum'])
+    return {
+        'groups': [{'group': grupo, 'sum': math.fsum(valores)} for grupo, valores in sorted(somas.items())],
+        'blocos': [relatorio for _, relatorio in parciais],
+    }
+
+
+def calcular_areas_mudanca(change_image, roi, escala=30, roi_local=None):
+    """Área (m²) de cada classe de mudança no ROI, agrupada numa única redução.
+
+    Com escala > 30 (prévia) o GEE classifica e reduz direto na pirâmide da cena: áreas aproximadas.
+    Com roi_local (Shapely) de área maior que um bloco da grade, a redução roda em blocos paralelos
+    (reduzir_agrupado_em_blocos) e o retorno traz também o tempo de cada bloco em 'blocos'.
+    """
+    import ee
+
+    imagem = ee.Image.pixelArea().addBands(change_image)
+    if roi_local is not None and roi_local.area > _LADO_BLOCO ** 2:
+        return reduzir_agrupado_em_blocos(imagem, roi_local, escala)
+
+    return obter_info(imagem.reduceRegion(
+        reducer=ee.Reducer.sum().group(1),
+        geometry=roi,
+        scale=escala,
+        maxPixels=1e13
+    ), PRIORIDADE_ANALISE)
+
+
+COLUNAS_MUDANCA = {1: 'FF_ha', 2: 'AC_ha', 3: 'CH_ha', 4: 'DI_ha', 5: 'FR_ha'}
+
+
+def mudanca_por_lote(change_image, parcelas_fc):
+    """Áreas (ha) das classes de mudança por lote numa única redução agrupada (sum().group).
+
+    Retorna [(propriedades do lote, {coluna de COLUNAS_MUDANCA: ha})]; classes abaixo de 0,05 ha ficam de fora.
+    """
+    import ee
+
+    reduzidos = obter_info(ee.Image.pixelArea().addBands(change_image).reduceRegions(
+        collection=parcelas_fc,
+        reducer=ee.Reducer.sum().group(1),
+        scale=30
+    ), PRIORIDADE_LOTE)
+
+    linhas = []
+    for feature in reduzidos['features']:
+        props = feature['properties']
+        areas = {}
+        for g in props.pop('groups', []):
+            coluna = COLUNAS_MUDANCA.get(int(g['group']))
+            if coluna and g['sum'] / 10000 > 0.05:
+                areas[coluna] = round(g['sum'] / 10000, 2)
+        linhas.append((props, areas))
+    return linhas
+
+
+def colunas_tabela_lotes():
+    """Colunas da tabela por lote: Lote, Area_Total_ha, classes de 2008 e classes de mudança"""
+    return (['Lote', 'Area_Total_ha']
+            + [f"{tipo}_2008_ha" for tipo in tipos_cobertura.keys()]
+            + list(COLUNAS_MUDANCA.values()))
+
+
+def calcular_tabela_lotes(tarefa, gdf_parcelas, classified_ant, change_image, anteriores=None):
+    """Tabela por lote: área total, classes da classificação anterior e classes de mudança (roda como Tarefa).
+
+    anteriores: tabela de uma análise anterior com a MESMA classificação (cenas, modelos ou amostras),
+    indexada pela impressão de cada lote (lotes_por_impressao). Lotes com geometria idêntica herdam as
+    áreas de lá e só os lotes novos ou redesenhados passam pelas reduções no servidor.
+    Retorna um DataFrame tipado, indexado por lote_id (índice do lote em gdf_parcelas), com as
+    colunas de colunas_tabela_lotes(): Lote (string, em Arrow) e áreas em ha (float64, NaN = classe ausente).
+    """
+    import ee
+
+    # Converter parcelas para FeatureCollection do GEE
+    tarefa.etapa(f"Preparando {len(gdf_parcelas)} lotes")
+    feature_collection, lotes_info, lotes_com_erro = lotes_para_geojson(gdf_parcelas)
+    for idx, erro in lotes_com_erro:
+        if erro:
+            tarefa.aviso('warning', f"⚠️ Erro no lote {idx}: {erro}")
+
+    if lotes_com_erro:
+        tarefa.aviso('warning', f"⚠️ {len(lotes_com_erro)} lotes com geometrias inválidas foram ignorados.")
+
+    if not feature_collection['features']:
+        raise ValueError("Nenhum lote válido para processar!")
+
+    # Diff com a análise anterior: lotes inalterados (mesma impressão) não vão ao servidor
+    herdados = {}
+    if anteriores is not None and len(anteriores):
+        impressoes = impressoes_lotes(gdf_parcelas)
+        herdados = {idx: impressoes[idx] for idx in lotes_info if impressoes[idx] in anteriores.index}
+        feature_collection['features'] = [
+            f for f in feature_collection['features'] if f['properties']['lote_id'] not in herdados
+        ]
+        tarefa.aviso('info', f"♻️ {len(herdados)} lotes sem mudança de geometria reaproveitados; "
+                             f"{len(feature_collection['features'])} novos ou alterados recalculados.")
+    parcelas_fc = ee.FeatureCollection(feature_collection) if feature_collection['features'] else None
+
+    # Dicionário para armazenar áreas das classes de 2008
+    classes_2008 = {tipo: {} for tipo in tipos_cobertura.keys()}
+
+    # Processar cada classe de 2008 em BATCH
+    for idx_tipo, tipo in enumerate(tipos_cobertura.keys()):
+        tarefa.etapa(f"Classificação 2008 → {tipo}")
+        if parcelas_fc is None:
+            continue
+        try:
+            classe_mask = classified_ant.eq(idx_tipo).multiply(ee.Image.pixelArea())
+
+            results = obter_info(classe_mask.reduceRegions(
+                collection=parcelas_fc,
+                reducer=ee.Reducer.sum(),
+                scale=30
+            ), PRIORIDADE_LOTE)
+
+            for feature in results['features']:
+                lote_id = feature['properties']['lote_id']
+                area_m2 = feature['properties'].get('sum') or 0
+                area_ha = area_m2 / 10000
+                classes_2008[tipo][lote_id] = round(area_ha, 2) if area_ha > 0.05 else 0.0
+
+        except Exception as e:
+            tarefa.aviso('warning', f"⚠️ Erro ao processar classe '{tipo}': {e}")
+            # Inicializar com zeros para não quebrar CSV
+            for idx in lotes_info.keys():
+                classes_2008[tipo][idx] = 0.0
+
+    # Dicionário para armazenar áreas das 5 classes de mudança
+    classes_mudanca = {
+        1: {},  # FF - Floresta mantida
+        2: {},  # AC - Área consolidada
+        3: {},  # CH - Corpos d'água
+        4: {},  # DI - Desmatamento
+        5: {}   # FR - Floresta regenerada
+    }
+
+    # Processar cada classe de mudança em BATCH
+    nomes_classes = {
+        1: 'FF (Floresta Mantida)',
+        2: 'AC (Área Consolidada)',
+        3: 'CH (Corpos d\'Água)',
+        4: 'DI (Desmatamento)',
+        5: 'FR (Regeneração)'
+    }
+
+    for classe_num in [1, 2, 3, 4, 5]:
+        tarefa.etapa(f"Mudança → {nomes_classes[classe_num]}")
+        if parcelas_fc is None:
+            continue
+        try:
+            classe_mask = change_image.eq(classe_num).multiply(ee.Image.pixelArea())
+
+            results = obter_info(classe_mask.reduceRegions(
+                collection=parcelas_fc,
+                reducer=ee.Reducer.sum(),
+                scale=30
+            ), PRIORIDADE_LOTE)
+
+            for feature in results['features']:
+                lote_id = feature['properties']['lote_id']
+                area_m2 = feature['properties'].get('sum') or 0
+                area_ha = area_m2 / 10000
+                classes_mudanca[classe_num][lote_id] = round(area_ha, 2) if area_ha > 0.05 else 0.0
+
+        except Exception as e:
+            tarefa.aviso('warning', f"⚠️ Erro ao processar {nomes_classes[classe_num]}: {e}")
+            # Inicializar com zeros
+            for idx in lotes_info.keys():
+                classes_mudanca[classe_num][idx] = 0.0
+
+    # Áreas herdadas dos lotes inalterados (NaN na tabela anterior = classe ausente)
+    if herdados:
+        linhas = anteriores[~anteriores.index.duplicated()].loc[list(herdados.values())].fillna(0.0)
+        for idx, (_, linha) in zip(herdados, linhas.iterrows()):
+            for tipo in tipos_cobertura.keys():
+                classes_2008[tipo][idx] = linha[f"{tipo}_2008_ha"]
+            for classe_num, coluna in COLUNAS_MUDANCA.items():
+                classes_mudanca[classe_num][idx] = linha[coluna]
+
+    tarefa.etapa("Montando planilha")
+    return montar_tabela_lotes(lotes_info, classes_2008, classes_mudanca)
+
+
+def lotes_por_impressao(df_lotes, gdf_parcelas, anteriores=None):
+    """Tabela por lote reindexada pela impressão da geometria, para o diff da próxima análise.
+
+    Com `anteriores` (mesma classificação), os lotes de lá que não estão em df_lotes são mantidos no fim.
+    """
+    import pandas as pd
+
+    impressoes = impressoes_lotes(gdf_parcelas)
+    tabela = df_lotes.set_index(impressoes.loc[df_lotes.index].rename('impressao'))
+    if anteriores is None or not len(anteriores):
+        return tabela
+    return pd.concat([tabela, anteriores[~anteriores.index.isin(tabela.index)]])
+
+
+def montar_tabela_lotes(lotes_info, classes_2008, classes_mudanca):
+    """Monta a tabela por lote coluna a coluna (FORMATO COMPLETO conforme solicitado pela professora).
+
+    Entradas como em calcular_tabela_lotes: {idx: {'nome', 'area_ha'}}, {tipo: {idx: ha}} e
+    {classe_mudanca: {idx: ha}}. Áreas zeradas viram NaN (célula vazia no CSV).
+    """
+    import numpy as np
+    import pandas as pd
+
+    ids = np.array(sorted(lotes_info.keys()), dtype='int64')
+
+    def _coluna(areas):
+        valores = np.fromiter((areas.get(idx, 0.0) for idx in ids), dtype='float64', count=len(ids))
+        return np.where(valores > 0, valores, np.nan)
+
+    colunas = {
+        'Lote': pd.array([lotes_info[idx]['nome'] for idx in ids], dtype='string[pyarrow]'),
+        'Area_Total_ha': np.fromiter((lotes_info[idx]['area_ha'] for idx in ids), dtype='float64', count=len(ids)),
+    }
+    for tipo in tipos_cobertura.keys():
+        colunas[f"{tipo}_2008_ha"] = _coluna(classes_2008[tipo])
+    for classe_num, coluna in COLUNAS_MUDANCA.items():
+        colunas[coluna] = _coluna(classes_mudanca[classe_num])
+
+    return pd.DataFrame(colunas, index=pd.Index(ids, name='lote_id'), columns=colunas_tabela_lotes())
@@ -0,0 +1,87 @@
+"""Pipeline em estágios com invalidação por hash de conteúdo (cache em st.session_state)."""
+import hashlib
+
+import streamlit as st
+
+
+# ===== Pipeline em estágios =====
+# ingest → roi → cenas → amostras → classificacao → mudanca → areas / lotes → relatorio
+# Cada estágio guarda (hash das entradas, saída) em st.session_state['_estagios'].
+# Num rerun, um estágio só é recalculado se o hash das entradas mudou; estágios seguintes
+# usam o hash do anterior como entrada, então a invalidação se propaga pela cadeia.
+
+def impressao(*valores):
+    """Hash de conteúdo (sha256) de valores Python, GeoDataFrames, arrays e objetos do GEE.
+
+    Objetos do GEE são identificados pela expressão serializada (local, sem chamada ao servidor).
+    """
+    import geopandas as gpd
+    import shapely
+
+    h = hashlib.sha256()
+
+    def _atualizar(v):
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            h.update(b'b'); h.update(bytes(v))
+        elif isinstance(v, str):
+            h.update(b's'); h.update(v.encode('utf-8'))
+        elif v is None or isinstance(v, (bool, int, float)):
+            h.update(repr(v).encode())
+        elif isinstance(v, (list, tuple)):
+            h.update(b'[')
+            for item in v:
+                _atualizar(item)
+            h.update(b']')
+        elif isinstance(v, dict):
+            h.update(b'{')
+            for k in sorted(v, key=repr):
+                _atualizar(k); _atualizar(v[k])
+            h.update(b'}')
+        elif isinstance(v, gpd.GeoDataFrame):
+            _atualizar(list(v.columns))
+            _atualizar(shapely.to_wkb(v.geometry.values, hex=False).tolist())
+            _atualizar(v.drop(columns='geometry').astype(str).values.tolist())
+        elif hasattr(v, 'serialize') and hasattr(v, 'getInfo'):
+            h.update(b'ee'); h.update(v.serialize().encode('utf-8'))
+        elif hasattr(v, 'tobytes') and hasattr(v, 'shape'):
+            _atualizar(list(v.shape)); _atualizar(str(v.dtype)); h.update(v.tobytes())
+        else:
+            h.update(repr(v).encode())
+
+    for v in valores:
+        _atualizar(v)
+    return h.hexdigest()
+
+
+def hash_estagio(nome):
+    """Hash das entradas da última execução do estágio (None se nunca rodou)"""
+    cache = st.session_state.get('_estagios', {})
+    return cache[nome][0] if nome in cache else None
+
+
+def estagio_em_cache(nome, h):
+    """True se o estágio já foi calculado com exatamente estas entradas"""
+    return hash_estagio(nome) == h
+
+
+def saida_estagio(nome):
+    return st.session_state.get('_estagios', {}).get(nome, (None, None))[1]
+
+
+def registrar_estagio(nome, h, saida):
+    st.session_state.setdefault('_estagios', {})[nome] = (h, saida)
+    return saida
+
+
+def executar_estagio(nome, entradas, funcao):
+    """Executa funcao() só se o hash de `entradas` mudou desde a última execução do estágio"""
+    h = impressao(nome, entradas)
+    if estagio_em_cache(nome, h):
+        return saida_estagio(nome)
+    return registrar_estagio(nome, h, funcao())
+
+
+def invalidar_estagios(*nomes):
+    cache = st.session_state.get('_estagios', {})
+    for nome in nomes:
+        cache.pop(nome, None)
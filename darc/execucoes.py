@@ -0,0 +1,247 @@
+"""Armazenamento local de execuções (SQLite + COG/Parquet) e visualização sem GEE."""
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import streamlit as st
+
+from darc.classificacao import palette_mudanca, tipos_cobertura
+from darc.exportacao import arquivo_tabela_lotes, png_resultado, raster_para_cog
+
+
+# ===== Armazenamento local de execuções =====
+# SQLite com os metadados (entradas, cenas, parâmetros, acurácias, áreas) e, por execução,
+# uma pasta com os artefatos: rasters em COG, PA e tabela por lote em Parquet.
+# Reabrir uma execução só lê o disco — nenhuma chamada ao GEE. Estágios cuja saída em sessão não
+# corresponde às entradas atuais (cenas, lotes) ficam de fora e são listados em `parcial`.
+# A tabela por lote também é gravada indexada pela impressão de cada lote, com a identidade da
+# classificação (cenas, modelos ou amostras): uma revisão posterior dos lotes ou do perímetro com a
+# mesma classificação só recalcula os lotes novos ou redesenhados (tabela_lotes_salva).
+
+DIR_EXECUCOES = os.environ.get('DARC_DIR_EXECUCOES', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'execucoes'))
+_RASTERS_EXECUCAO = ('ant', 'pos', 'mudanca')
+_CAMPOS_JSON_EXECUCAO = ('parametros', 'acuracia', 'areas', 'amostras', 'parcial')
+
+
+def _conectar_execucoes():
+    os.makedirs(DIR_EXECUCOES, exist_ok=True)
+    con = sqlite3.connect(os.path.join(DIR_EXECUCOES, 'execucoes.sqlite'))
+    con.row_factory = sqlite3.Row
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS execucoes (
+            run_id TEXT PRIMARY KEY,
+            criado_em TEXT NOT NULL,
+            nome_pa TEXT,
+            date_ant TEXT,
+            date_pos TEXT,
+            intervalo_anos REAL,
+            cena_ant TEXT,
+            cena_pos TEXT,
+            sat_ant TEXT,
+            sat_pos TEXT,
+            parametros TEXT,
+            acuracia TEXT,
+            areas TEXT,
+            amostras TEXT,
+            n_lotes INTEGER,
+            parcial TEXT,
+            identidade_lotes TEXT
+        )
+    """)
+    colunas = {linha['name'] for linha in con.execute("PRAGMA table_info(execucoes)")}
+    for coluna in ('parcial', 'identidade_lotes'):
+        if coluna not in colunas:
+            with con:
+                con.execute(f"ALTER TABLE execucoes ADD COLUMN {coluna} TEXT")
+    return con
+
+
+def salvar_execucao(run_id, registro, rasters, gdf, df_lotes=None, lotes_impressao=None):
+    """Grava uma execução completa: metadados no SQLite e artefatos (COG/Parquet) em DIR_EXECUCOES/run_id.
+
+    Os artefatos são gravados antes da linha no SQLite, então uma execução listada tem todos os seus
+    arquivos. registro['parcial']: estágios deixados de fora por estarem desatualizados (ex.: ['lotes']).
+    lotes_impressao: tabela por lote indexada pela impressão (lotes_por_impressao), gravada junto com
+    registro['identidade_lotes'] para o diff de revisões posteriores.
+    """
+    pasta = os.path.join(DIR_EXECUCOES, run_id)
+    os.makedirs(pasta, exist_ok=True)
+
+    for chave in _RASTERS_EXECUCAO:
+        if chave in rasters:
+            with open(os.path.join(pasta, f"{chave}.tif"), 'wb') as f:
+                f.write(raster_para_cog(*rasters[chave]))
+    gdf.to_parquet(os.path.join(pasta, 'pa.parquet'))
+    if df_lotes is not None:
+        df_lotes.to_parquet(os.path.join(pasta, 'lotes.parquet'))
+    if lotes_impressao is not None:
+        lotes_impressao.to_parquet(os.path.join(pasta, 'lotes_impressao.parquet'))
+
+    linha = {campo: registro.get(campo) for campo in (
+        'nome_pa', 'date_ant', 'date_pos', 'intervalo_anos', 'cena_ant', 'cena_pos', 'sat_ant', 'sat_pos'
+    )}
+    for campo in _CAMPOS_JSON_EXECUCAO:
+        linha[campo] = json.dumps(registro.get(campo), ensure_ascii=False, default=str)
+    linha['run_id'] = run_id
+    linha['criado_em'] = datetime.now().isoformat(timespec='seconds')
+    linha['n_lotes'] = None if df_lotes is None else len(df_lotes)
+    linha['identidade_lotes'] = registro.get('identidade_lotes') if lotes_impressao is not None else None
+
+    con = _conectar_execucoes()
+    try:
+        with con:
+            con.execute(
+                f"INSERT OR REPLACE INTO execucoes ({', '.join(linha)}) VALUES ({', '.join('?' * len(linha))})",
+                list(linha.values())
+            )
+    finally:
+        con.close()
+    return run_id
+
+
+def listar_execucoes():
+    """Execuções salvas (lista de dicts), mais recentes primeiro — sem pandas, roda na primeira tela"""
+    if not os.path.exists(os.path.join(DIR_EXECUCOES, 'execucoes.sqlite')):
+        return []
+    con = _conectar_execucoes()
+    try:
+        linhas = [dict(linha) for linha in con.execute(
+            "SELECT run_id, criado_em, nome_pa, date_ant, date_pos, n_lotes, parcial FROM execucoes ORDER BY criado_em DESC"
+        )]
+    finally:
+        con.close()
+    for linha in linhas:
+        linha['parcial'] = json.loads(linha['parcial']) if linha['parcial'] else None
+    return linhas
+
+
+def tabela_lotes_salva(identidade_lotes):
+    """Tabela por impressão de lote da execução salva mais recente com esta classificação (None se não houver)"""
+    import pandas as pd
+
+    if not os.path.exists(os.path.join(DIR_EXECUCOES, 'execucoes.sqlite')):
+        return None
+    con = _conectar_execucoes()
+    try:
+        run_ids = [linha['run_id'] for linha in con.execute(
+            "SELECT run_id FROM execucoes WHERE identidade_lotes = ? ORDER BY criado_em DESC", (identidade_lotes,)
+        )]
+    finally:
+        con.close()
+    for run_id in run_ids:
+        caminho = os.path.join(DIR_EXECUCOES, run_id, 'lotes_impressao.parquet')
+        if os.path.exists(caminho):
+            return pd.read_parquet(caminho)
+    return None
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def carregar_execucao(run_id):
+    """Lê uma execução salva (metadados, rasters, PA e tabela por lote) sem acessar o GEE"""
+    import geopandas as gpd
+    import pandas as pd
+    import rasterio
+
+    con = _conectar_execucoes()
+    try:
+        linha = con.execute("SELECT * FROM execucoes WHERE run_id = ?", (run_id,)).fetchone()
+    finally:
+        con.close()
+    if linha is None:
+        raise KeyError(f"Execução {run_id} não encontrada em {DIR_EXECUCOES}")
+
+    execucao = dict(linha)
+    for campo in _CAMPOS_JSON_EXECUCAO:
+        execucao[campo] = json.loads(execucao[campo]) if execucao[campo] else None
+
+    pasta = os.path.join(DIR_EXECUCOES, run_id)
+    execucao['rasters'] = {}
+    for chave in _RASTERS_EXECUCAO:
+        caminho = os.path.join(pasta, f"{chave}.tif")
+        if os.path.exists(caminho):
+            with rasterio.open(caminho) as src:
+                execucao['rasters'][chave] = (src.read(1), src.transform)
+    execucao['gdf'] = gpd.read_parquet(os.path.join(pasta, 'pa.parquet'))
+    caminho_lotes = os.path.join(pasta, 'lotes.parquet')
+    execucao['lotes'] = pd.read_parquet(caminho_lotes) if os.path.exists(caminho_lotes) else None
+    return execucao
+
+
+def mostrar_execucao(execucao):
+    """Exibe uma execução salva (acurácia, mapas, áreas, downloads) só com dados do disco"""
+    import pandas as pd
+
+    run_id = execucao['run_id']
+    st.header(f"📂 Execução salva: {run_id}")
+    st.caption(
+        f"PA: {execucao['nome_pa'] or '—'} | {execucao['date_ant']} ({execucao['sat_ant'] or '—'}) → "
+        f"{execucao['date_pos']} ({execucao['sat_pos'] or '—'}) | salva em {execucao['criado_em']}"
+    )
+    if execucao['parcial']:
+        st.warning(f"⚠️ Execução parcial: {', '.join(execucao['parcial'])} não correspondia(m) a esta análise "
+                   "quando foi salva e ficou(aram) de fora.")
+    if st.button("✖️ Fechar execução"):
+        del st.session_state['execucao_aberta']
+        st.rerun()
+
+    st.subheader("🎯 Acurácia da Classificação")
+    acuracia = execucao['acuracia'] or {}
+    for col, periodo, rotulo in zip(st.columns(2), ('ant', 'pos'), ('Anterior', 'Posterior')):
+        with col:
+            st.write(f"**📅 Período {rotulo}**")
+            dados = acuracia.get(periodo) or {}
+            if dados.get('accuracy') is None:
+                st.warning("⚠️ Acurácia não calculada nesta execução.")
+                continue
+            st.metric("Precisão Global", f"{dados['accuracy']*100:.2f}%")
+            st.metric("Índice Kappa", f"{dados['kappa']:.4f}")
+            matriz = dados.get('matrix') or [[0]]
+            nomes = dados.get('class_names') or {}
+            nomes = [nomes.get(str(i), f"Classe {i}") for i in range(len(matriz[0]))]
+            st.dataframe(pd.DataFrame(matriz, columns=[f"Prev. {n}" for n in nomes],
+                                      index=[f"Real {n}" for n in nomes]), use_container_width=True)
+
+    st.subheader("🗺️ Mapas")
+    rasters = execucao['rasters']
+    palette_colors = list(tipos_cobertura.values())
+    for col, chave, titulo in zip(st.columns(2), ('ant', 'pos'), (execucao['date_ant'], execucao['date_pos'])):
+        with col:
+            st.write(f"**Classificação ({titulo})**")
+            if chave in rasters:
+                st.image(png_resultado(run_id, chave, palette_colors, 0, 1200, rasters[chave][0]),
+                         use_container_width=True)
+    if 'mudanca' in rasters:
+        st.image(png_resultado(run_id, 'mudanca', palette_mudanca, 1, 2048, rasters['mudanca'][0]),
+                 caption="Mapa de Mudanças - VERMELHO = Desmatamento", use_container_width=True)
+
+    st.subheader("📐 Áreas")
+    areas_dict = execucao['areas'] or {}
+    st.dataframe(pd.DataFrame([
+        {'Classe': k, 'Área (ha)': f"{v:,.2f}", 'Área (km²)': f"{v/100:,.2f}"}
+        for k, v in areas_dict.items()
+    ]), use_container_width=True)
+    if 'Desmatamento' in areas_dict and execucao['intervalo_anos']:
+        st.info(f"📈 Taxa anual de desmatamento: **{areas_dict['Desmatamento'] / execucao['intervalo_anos']:.2f} ha/ano**")
+
+    st.subheader("⬇️ Downloads")
+    pasta = os.path.join(DIR_EXECUCOES, run_id)
+    for col, chave in zip(st.columns(3), _RASTERS_EXECUCAO):
+        caminho = os.path.join(pasta, f"{chave}.tif")
+        if os.path.exists(caminho):
+            with col, open(caminho, 'rb') as f:
+                st.download_button(f"⬇️ {chave} (GeoTIFF)", data=f.read(), file_name=f"darc_{chave}_{run_id}.tif",
+                                   mime="image/tiff", use_container_width=True, key=f"dl_exec_{chave}")
+    if execucao['lotes'] is not None:
+        col_csv, col_parquet = st.columns(2)
+        with col_csv, open(arquivo_tabela_lotes(f"execucao_{run_id}", 'csv', execucao['lotes']), 'rb') as f:
+            st.download_button("📥 Baixar análise por lote (CSV)", data=f, file_name=f"analise_lotes_{run_id}.csv",
+                               mime="text/csv", use_container_width=True)
+        with col_parquet, open(os.path.join(pasta, 'lotes.parquet'), 'rb') as f:
+            st.download_button("📥 Baixar análise por lote (Parquet)", data=f, file_name=f"analise_lotes_{run_id}.parquet",
+                               mime="application/vnd.apache.parquet", use_container_width=True)
+        with st.expander(f"👁️ Análise por lote ({len(execucao['lotes'])} lotes)"):
+            st.dataframe(execucao['lotes'])
+
+    with st.expander("⚙️ Parâmetros e cenas"):
+        st.json({'cena_ant': execucao['cena_ant'], 'cena_pos': execucao['cena_pos'], **(execucao['parametros'] or {})})
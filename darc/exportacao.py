@@ -0,0 +1,234 @@
+"""Download dos rasters em blocos, GeoTIFF (COG) e PNG renderizados localmente."""
+import os
+import tempfile
+from io import BytesIO
+
+import streamlit as st
+
+from darc.gee import PRIORIDADE_LOTE, agendador_gee, sessao_http_gee
+
+
+# Exportação GeoTIFF em blocos: grade fixa em EPSG:4674 (~30 m), 255 = sem dado
+_RES_GRAUS_30M = 0.00026949458523585647
+_NODATA_EXPORT = 255
+
+
+def _grade_tiles(roi_geom, res=_RES_GRAUS_30M, tile_px=2048):
+    """Divide o envelope do ROI numa grade alinhada de blocos de até tile_px × tile_px pixels.
+
+    Retorna (transform_total, largura, altura, tiles), com tiles = [(col_off, row_off, w, h), ...]
+    apenas para os blocos que tocam o ROI.
+    """
+    from shapely.geometry import box
+    from shapely.prepared import prep
+    from rasterio.transform import from_origin
+
+    minx, miny, maxx, maxy = roi_geom.bounds
+    x0 = (minx // res) * res
+    y0 = -((-maxy) // res) * res  # arredonda para cima
+    largura = int(-(-(maxx - x0) // res))
+    altura = int(-(-(y0 - miny) // res))
+    roi_prep = prep(roi_geom)
+
+    tiles = []
+    for row_off in range(0, altura, tile_px):
+        for col_off in range(0, largura, tile_px):
+            w = min(tile_px, largura - col_off)
+            h = min(tile_px, altura - row_off)
+            celula = box(x0 + col_off * res, y0 - (row_off + h) * res,
+                         x0 + (col_off + w) * res, y0 - row_off * res)
+            if roi_prep.intersects(celula):
+                tiles.append((col_off, row_off, w, h))
+    return from_origin(x0, y0, res, res), largura, altura, tiles
+
+
+def _baixar_tile_gee(imagem, transform, w, h):
+    """Baixa um bloco da imagem como GeoTIFF via getDownloadURL na grade informada"""
+    def _baixar():
+        url = imagem.getDownloadURL({
+            'crs': 'EPSG:4674',
+            'crs_transform': [transform.a, 0, transform.c, 0, transform.e, transform.f],
+            'dimensions': f"{w}x{h}",
+            'format': 'GEO_TIFF'
+        })
+        resp = sessao_http_gee().get(url, timeout=300)
+        resp.raise_for_status()
+        return resp.content
+
+    return agendador_gee().executar(_baixar, prioridade=PRIORIDADE_LOTE)
+
+
+def baixar_raster(imagem, roi_geom, baixar_tile=None, max_workers=4, tentativas=3,
+                  tile_px=2048, progresso=None, res=_RES_GRAUS_30M):
+    """Baixa uma imagem classificada (uint8, 255 = sem dado) para um array numpy local.
+
+    O ROI é dividido em blocos baixados em paralelo (com novas tentativas e backoff)
+    e montados na grade comum em EPSG:4674.
+    baixar_tile(transform, w, h) -> bytes (GeoTIFF) permite trocar a origem dos blocos;
+    por padrão usa getDownloadURL do GEE. Retorna (array 2D, transform).
+    """
+    import time
+    import random
+    import numpy as np
+    import rasterio
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if baixar_tile is None:
+        _img = imagem.unmask(_NODATA_EXPORT).toUint8()
+        baixar_tile = lambda transform, w, h: _baixar_tile_gee(_img, transform, w, h)
+
+    transform, largura, altura, tiles = _grade_tiles(roi_geom, res=res, tile_px=tile_px)
+    if not tiles:
+        raise ValueError("ROI não intersecta nenhum bloco da grade")
+
+    def _com_retentativas(tile):
+        col_off, row_off, w, h = tile
+        t = transform * transform.translation(col_off, row_off)
+        for tentativa in range(tentativas):
+            try:
+                return tile, baixar_tile(t, w, h)
+            except Exception:
+                if tentativa == tentativas - 1:
+                    raise
+                time.sleep(2 ** tentativa + random.random())
+
+    array = np.full((altura, largura), _NODATA_EXPORT, dtype='uint8')
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futuros = [pool.submit(_com_retentativas, tile) for tile in tiles]
+        for n, futuro in enumerate(as_completed(futuros), 1):
+            (col_off, row_off, w, h), conteudo = futuro.result()
+            with rasterio.MemoryFile(conteudo) as mem, mem.open() as src:
+                array[row_off:row_off + h, col_off:col_off + w] = src.read(1, out_shape=(h, w))
+            if progresso:
+                progresso(n / len(tiles))
+    return array, transform
+
+
+def raster_para_cog(array, transform):
+    """Grava o array como Cloud Optimized GeoTIFF (EPSG:4674, blocos 512, overviews NEAREST, DEFLATE)"""
+    import rasterio
+    import rasterio.shutil
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        caminho_tmp = os.path.join(tmpdir, "mosaico.tif")
+        caminho_cog = os.path.join(tmpdir, "mosaico_cog.tif")
+        perfil = {
+            'driver': 'GTiff', 'width': array.shape[1], 'height': array.shape[0], 'count': 1,
+            'dtype': 'uint8', 'crs': 'EPSG:4674', 'transform': transform,
+            'nodata': _NODATA_EXPORT, 'tiled': True, 'blockxsize': 512, 'blockysize': 512
+        }
+        with rasterio.open(caminho_tmp, 'w', **perfil) as dst:
+            dst.write(array, 1)
+
+        rasterio.shutil.copy(
+            caminho_tmp, caminho_cog, driver='COG',
+            compress='DEFLATE', blocksize=512, overview_resampling='NEAREST'
+        )
+        with open(caminho_cog, 'rb') as f:
+            return f.read()
+
+
+def exportar_cog(imagem, roi_geom, **kwargs):
+    """Baixa a imagem em blocos paralelos e devolve os bytes do COG montado localmente"""
+    return raster_para_cog(*baixar_raster(imagem, roi_geom, **kwargs))
+
+
+def renderizar_png(array, paleta, valor_min=0, max_px=None):
+    """Renderiza um raster de classes como PNG com paleta (sem dado = transparente).
+
+    valor_min: valor do array que recebe paleta[0]. max_px limita o maior lado
+    (reamostragem por vizinho mais próximo, preserva as classes).
+    """
+    import numpy as np
+    from PIL import Image
+
+    if max_px and max(array.shape) > max_px:
+        passo = int(np.ceil(max(array.shape) / max_px))
+        array = array[::passo, ::passo]
+
+    idx = array.astype('int16') - valor_min
+    validos = (array != _NODATA_EXPORT) & (idx >= 0) & (idx < len(paleta))
+    indices = np.where(validos, idx, len(paleta)).astype('uint8')
+
+    cores = []
+    for cor in paleta:
+        cor = cor.lstrip('#')
+        cores.extend(int(cor[i:i + 2], 16) for i in (0, 2, 4))
+    cores.extend([0, 0, 0])  # índice extra = transparente
+
+    img = Image.fromarray(indices, mode='P')
+    img.putpalette(cores)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', transparency=len(paleta))
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def png_resultado(run_id, chave, paleta, valor_min, max_px, _array):
+    """PNG de um raster do resultado, memoizado por análise (run_id) e raster"""
+    return renderizar_png(_array, paleta, valor_min, max_px)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cog_resultado(run_id, chave, _array, _transform):
+    """COG de um raster do resultado, memoizado por análise (run_id) e raster"""
+    return raster_para_cog(_array, _transform)
+
+
+def baixar_rasters_resultado(tarefa, imagens, roi_geom, escala=30):
+    """Baixa os rasters do resultado ({chave: ee.Image}) em blocos (roda como Tarefa); escala em metros"""
+    rasters = {}
+    for chave, imagem in imagens.items():
+        tarefa.etapa(f"Baixando raster '{chave}'")
+        rasters[chave] = baixar_raster(imagem, roi_geom, progresso=lambda _: tarefa.verificar_cancelamento(),
+                                       res=_RES_GRAUS_30M * escala / 30)
+    return rasters
+
+
+# ===== Tabela por lote: Parquet, GeoPackage e CSV em blocos =====
+# A tabela por lote é um DataFrame tipado (ver calcular_tabela_lotes). Os arquivos são gravados
+# em disco uma vez por análise e formato; o CSV é escrito em blocos de linhas, sem montar a
+# planilha inteira como texto na memória.
+
+_DIR_TABELAS = os.path.join(tempfile.gettempdir(), 'darc_tabelas')
+
+
+def csv_lotes_em_blocos(df_lotes, linhas_por_bloco=10000):
+    """CSV da tabela por lote em blocos de bytes (cabeçalho no primeiro), no formato da planilha: aspas em tudo, CRLF"""
+    import csv
+
+    for inicio in range(0, max(len(df_lotes), 1), linhas_por_bloco):
+        bloco = df_lotes.iloc[inicio:inicio + linhas_por_bloco]
+        yield bloco.to_csv(index=False, header=inicio == 0, quoting=csv.QUOTE_ALL,
+                          lineterminator='\r\n').encode('utf-8')
+
+
+def gravar_tabela_lotes(df_lotes, caminho, formato, gdf_parcelas=None):
+    """Grava a tabela por lote em 'csv', 'parquet' ou 'gpkg' (este com as geometrias dos lotes)"""
+    import geopandas as gpd
+
+    raiz, extensao = os.path.splitext(caminho)
+    temporario = f"{raiz}.parcial{extensao}"
+    if formato == 'csv':
+        with open(temporario, 'wb') as arquivo:
+            for bloco in csv_lotes_em_blocos(df_lotes):
+                arquivo.write(bloco)
+    elif formato == 'parquet':
+        df_lotes.to_parquet(temporario, engine='pyarrow', compression='zstd')
+    elif formato == 'gpkg':
+        gdf = gpd.GeoDataFrame(df_lotes.reset_index(), crs=gdf_parcelas.crs,
+                               geometry=gdf_parcelas.geometry.loc[df_lotes.index].to_numpy())
+        gdf.to_file(temporario, driver='GPKG', layer='lotes', engine='pyogrio')
+    else:
+        raise ValueError(f"Formato desconhecido: {formato}")
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def arquivo_tabela_lotes(chave, formato, df_lotes, gdf_parcelas=None):
+    """Caminho do arquivo da tabela por lote, gravado só na primeira vez para esta análise (chave) e formato"""
+    os.makedirs(_DIR_TABELAS, exist_ok=True)
+    caminho = os.path.join(_DIR_TABELAS, f"lotes_{chave}.{formato}")
+    if not os.path.exists(caminho):
+        gravar_tabela_lotes(df_lotes, caminho, formato, gdf_parcelas)
+    return caminho
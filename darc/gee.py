@@ -0,0 +1,218 @@
+"""Cliente do Earth Engine por processo e agendador de requisições ao GEE."""
+import json
+import os
+import threading
+import time
+import traceback
+
+import streamlit as st
+
+
+# Cliente do GEE por PROCESSO: o estado do earthengine-api é global, então credenciais,
+# ee.Initialize e o pool de conexões HTTP são montados uma única vez e compartilhados por
+# todas as sessões (e pelas tarefas em segundo plano). Cada sessão só confere o cache.
+@st.cache_resource(show_spinner="🌍 Conectando ao Google Earth Engine...")
+def _cliente_gee():
+    """Inicializa o Earth Engine com uma requests.Session com pool e keep-alive (uma vez por processo)"""
+    import ee
+    import requests
+    from requests.adapters import HTTPAdapter
+    from ee import _cloud_api_utils
+
+    inicio = time.perf_counter()
+    sessao = requests.Session()
+    # Pool dimensionado para as sessões simultâneas + downloads paralelos de blocos
+    adaptador = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+    sessao.mount('https://', adaptador)
+    sessao.headers['Connection'] = 'keep-alive'
+    transporte = _cloud_api_utils._Http(sessao, timeout=300)
+
+    if 'earth_engine' in st.secrets:
+        # Streamlit Cloud: usar Service Account dos secrets
+        # Usa google.oauth2 diretamente para evitar ambiguidade de tipos
+        # do wrapper ee.ServiceAccountCredentials (espera str, não dict)
+        from google.oauth2 import service_account as _google_sa
+        from ee.oauth import SCOPES as _EE_SCOPES
+        service_account_info = json.loads(st.secrets['earth_engine']['service_account'])
+        credentials = _google_sa.Credentials.from_service_account_info(
+            service_account_info, scopes=_EE_SCOPES
+        )
+        ee.Initialize(credentials, http_transport=transporte)
+        projeto = service_account_info.get('project_id')
+    else:
+        # Desenvolvimento local: autenticação padrão
+        projeto = 'graceful-fin-479914-k9'
+        ee.Initialize(project=projeto, http_transport=transporte)
+
+    return {'sessao': sessao, 'projeto': projeto, 'segundos_inicializacao': time.perf_counter() - inicio, 'sessoes_atendidas': 0,
+            'lock': threading.Lock()}
+
+
+def sessao_http_gee():
+    """requests.Session do cliente do processo (conexões reaproveitadas entre chamadas e sessões)"""
+    return _cliente_gee()['sessao']
+
+
+def pasta_assets_gee():
+    """Pasta de assets do DARC no projeto do GEE (DARC_PASTA_ASSETS ou projects/<projeto>/assets/darc), criada se faltar"""
+    import ee
+
+    pasta = os.environ.get('DARC_PASTA_ASSETS') or f"projects/{_cliente_gee()['projeto']}/assets/darc"
+    try:
+        ee.data.getAsset(pasta)
+    except ee.EEException:
+        ee.data.createAsset({'type': 'FOLDER'}, pasta)
+    return pasta
+
+
+# Função para inicializar GEE apenas quando necessário (LAZY LOADING)
+def inicializar_gee():
+    """Garante o cliente do GEE do processo nesta sessão e mede o custo de partida evitado"""
+    if 'gee_initialized' not in st.session_state:
+        try:
+            inicio = time.perf_counter()
+            cliente = _cliente_gee()
+            # O cliente é do processo: sessões em threads diferentes contam ao mesmo tempo
+            with cliente['lock']:
+                cliente['sessoes_atendidas'] += 1
+                sessoes_atendidas = cliente['sessoes_atendidas']
+            st.session_state.gee_partida = {
+                'segundos_sessao': time.perf_counter() - inicio,
+                'segundos_inicializacao': cliente['segundos_inicializacao'],
+                'reaproveitado': sessoes_atendidas > 1,
+                'sessoes_atendidas': sessoes_atendidas,
+            }
+            st.session_state.gee_initialized = True
+        except Exception as e:
+            st.error(f"❌ Erro ao conectar GEE: {e}")
+            st.error("💡 Verifique sua conexão com a internet e tente novamente.")
+            st.code(traceback.format_exc())
+            st.stop()
+
+
+# ===== Agendador de requisições ao GEE =====
+# Todas as sessões do processo compartilham um limite de requisições simultâneas ao GEE.
+# A fila é por prioridade (mapa/busca interativa antes de análise, análise antes de lotes/downloads)
+# e erros de limite de taxa (HTTP 429, "Too many concurrent aggregations") são repetidos com
+# backoff exponencial com jitter, em vez de derrubar a execução.
+
+PRIORIDADE_INTERATIVA = 0   # busca de cenas, metadados, tiles de mapa
+PRIORIDADE_ANALISE = 1      # treino, acurácia, áreas do PA
+PRIORIDADE_LOTE = 2         # reduções por lote, série anual, download de rasters
+_NOMES_PRIORIDADE = {PRIORIDADE_INTERATIVA: 'interativa', PRIORIDADE_ANALISE: 'análise', PRIORIDADE_LOTE: 'lote'}
+
+# Mensagens de limite de taxa do GEE; o código HTTP 429 é lido da resposta, não do texto do erro
+# (um '429' solto pode ser ID de asset, valor de banda, coordenada ou contagem)
+_ERROS_LIMITE_TAXA = ('too many concurrent aggregations', 'too many requests')
+
+
+def _status_http(erro):
+    """Código HTTP da resposta do erro ou da causa encadeada (HttpError do googleapiclient, HTTPError do requests)"""
+    while erro is not None:
+        resp = getattr(erro, 'resp', None)
+        if getattr(resp, 'status', None) is not None:
+            return int(resp.status)
+        resposta = getattr(erro, 'response', None)
+        if getattr(resposta, 'status_code', None) is not None:
+            return int(resposta.status_code)
+        erro = erro.__cause__ or erro.__context__
+    return None
+
+
+def _eh_limite_de_taxa(erro):
+    if _status_http(erro) == 429:
+        return True
+    texto = str(erro).lower()
+    return any(trecho in texto for trecho in _ERROS_LIMITE_TAXA)
+
+
+class AgendadorGEE:
+    """Limite de concorrência + fila com prioridade + retentativas para chamadas ao GEE"""
+
+    def __init__(self, max_simultaneas=8, tentativas=6, espera_base=1.0, espera_max=60.0):
+        import heapq
+        import itertools
+        from collections import deque
+
+        self._heapq = heapq
+        self.max_simultaneas = max_simultaneas
+        self.tentativas = tentativas
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self._cond = threading.Condition()
+        self._fila = []                 # heap de (prioridade, ordem de chegada)
+        self._ordem = itertools.count()
+        self._ativas = 0
+        self._esperas = {p: deque(maxlen=200) for p in _NOMES_PRIORIDADE}
+        self._contadores = {'concluidas': 0, 'retentativas': 0, 'falhas': 0}
+
+    def _entrar(self, prioridade):
+        chegada = time.perf_counter()
+        with self._cond:
+            ficha = (prioridade, next(self._ordem))
+            self._heapq.heappush(self._fila, ficha)
+            while self._fila[0] != ficha or self._ativas >= self.max_simultaneas:
+                self._cond.wait()
+            self._heapq.heappop(self._fila)
+            self._ativas += 1
+            self._esperas[prioridade].append(time.perf_counter() - chegada)
+            self._cond.notify_all()
+
+    def _sair(self):
+        with self._cond:
+            self._ativas -= 1
+            self._cond.notify_all()
+
+    def executar(self, funcao, *args, prioridade=PRIORIDADE_INTERATIVA, **kwargs):
+        """Executa funcao(*args, **kwargs) quando houver vaga; repete em erro de limite de taxa"""
+        import random
+
+        for tentativa in range(self.tentativas):
+            self._entrar(prioridade)
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as e:
+                if not _eh_limite_de_taxa(e) or tentativa == self.tentativas - 1:
+                    with self._cond:
+                        self._contadores['falhas'] += 1
+                    raise
+            else:
+                with self._cond:
+                    self._contadores['concluidas'] += 1
+                return resultado
+            finally:
+                self._sair()
+            # Backoff fora da vaga: outras requisições seguem enquanto esta espera
+            with self._cond:
+                self._contadores['retentativas'] += 1
+            time.sleep(min(self.espera_max, self.espera_base * 2 ** tentativa) * (0.5 + random.random()))
+
+    def metricas(self):
+        """Profundidade da fila, requisições ativas, contadores e espera por prioridade (s)"""
+        with self._cond:
+            esperas = {}
+            for p, valores in self._esperas.items():
+                ordenadas = sorted(valores)
+                esperas[_NOMES_PRIORIDADE[p]] = {
+                    'n': len(ordenadas),
+                    'media': sum(ordenadas) / len(ordenadas) if ordenadas else 0.0,
+                    'p95': ordenadas[int(0.95 * (len(ordenadas) - 1))] if ordenadas else 0.0,
+                }
+            return {
+                'na_fila': len(self._fila),
+                'ativas': self._ativas,
+                'max_simultaneas': self.max_simultaneas,
+                **self._contadores,
+                'espera': esperas,
+            }
+
+
+@st.cache_resource
+def agendador_gee():
+    """Agendador único do processo (limite configurável por DARC_GEE_MAX_SIMULTANEAS)"""
+    return AgendadorGEE(max_simultaneas=int(os.environ.get('DARC_GEE_MAX_SIMULTANEAS', 8)))
+
+
+def obter_info(objeto_ee, prioridade=PRIORIDADE_INTERATIVA):
+    """objeto_ee.getInfo() passando pelo agendador do processo"""
+    return agendador_gee().executar(objeto_ee.getInfo, prioridade=prioridade)
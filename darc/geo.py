@@ -0,0 +1,294 @@
+"""Leitura dos arquivos do PA, perímetro, áreas e conversão de geometrias para o GEE."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+
+import streamlit as st
+
+from darc.estagios import executar_estagio
+from darc.gee import inicializar_gee
+
+
+def obter_roi():
+    """Obtém ou cria o ROI (Region of Interest) do GEE — estágio 'roi', recriado só se o perímetro mudar"""
+    import shapely
+
+    if st.session_state.gdf is not None:
+        geom = st.session_state.gdf.geometry.iloc[0]
+
+        def _criar_roi():
+            inicializar_gee()  # Garante que GEE está inicializado
+            return geom_para_gee(geom)
+
+        st.session_state.roi = executar_estagio('roi', [shapely.to_wkb(geom)], _criar_roi)
+    return st.session_state.get('roi')
+
+
+def ler_arquivo_geo(nome_arquivo, conteudo):
+    """Lê ZIP com shapefile ou GeoJSON (bytes) para GeoDataFrame em EPSG:4326"""
+    import geopandas as gpd
+
+    if nome_arquivo.endswith('.zip'):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, "arquivo.zip")
+            with open(zip_path, "wb") as f:
+                f.write(conteudo)
+            
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(tmpdir)
+            
+            shp_files = [
+                os.path.join(dp, fname)
+                for dp, _, fnames in os.walk(tmpdir)
+                for fname in fnames if fname.endswith('.shp')
+            ]
+            if len(shp_files) == 0:
+                raise ValueError("Nenhum arquivo .shp encontrado no ZIP.")
+            gdf = gpd.read_file(shp_files[0])
+    elif nome_arquivo.endswith(('.geojson', '.json')):
+        geojson_data = json.loads(conteudo)
+        gdf = gpd.GeoDataFrame.from_features(geojson_data['features'], crs="EPSG:4326")
+    else:
+        raise ValueError(f"Formato não suportado: {nome_arquivo}")
+
+    if not gdf.crs or not gdf.crs.equals("EPSG:4326"):
+        gdf = gdf.to_crs("EPSG:4326")
+    return gdf
+
+
+def perimetro_dos_lotes(gdf_parcelas):
+    """Calcula o perímetro do PA a partir dos lotes - SEM divisões internas.
+
+    Retorna (gdf_parcelas com geometrias corrigidas, gdf_perimetro, num_areas, sem_remocao_buracos).
+    """
+    import geopandas as gpd
+    from shapely.geometry import Polygon, MultiPolygon
+    from shapely.ops import unary_union
+
+    gdf_parcelas = gdf_parcelas.copy()
+    # Garantir geometrias válidas
+    gdf_parcelas['geometry'] = gdf_parcelas['geometry'].buffer(0)
+    uniao = unary_union(gdf_parcelas.geometry).buffer(0)
+    
+    # Normalizar GeometryCollection → extrair só polígonos
+    if uniao.geom_type == 'GeometryCollection':
+        polys = [g for g in uniao.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
+        if not polys:
+            raise ValueError("Os lotes não contêm geometrias poligonais válidas.")
+        uniao = unary_union(polys)
+
+    # Remover buracos (holes) e manter só contornos externos
+    sem_remocao_buracos = False
+    if uniao.geom_type == 'MultiPolygon':
+        poligonos_limpos = [Polygon(poly.exterior.coords) for poly in uniao.geoms]
+        perimetro_auto = MultiPolygon(poligonos_limpos)
+    elif uniao.geom_type == 'Polygon':
+        perimetro_auto = Polygon(uniao.exterior.coords)
+    else:
+        sem_remocao_buracos = True
+        perimetro_auto = uniao
+
+    gdf_perimetro = gpd.GeoDataFrame({'nome': ['PA']}, geometry=[perimetro_auto], crs="EPSG:4326")
+    num_areas = len(list(perimetro_auto.geoms)) if perimetro_auto.geom_type == 'MultiPolygon' else 1
+    return gdf_parcelas, gdf_perimetro, num_areas, sem_remocao_buracos
+
+
+def limpar_gdf_para_folium(gdf):
+    """
+    Remove colunas problemáticas (Timestamp, datetime) do GeoDataFrame
+    para evitar erro 'Timestamp is not JSON serializable' no folium
+    """
+    if gdf is None:
+        return None
+    
+    # Criar cópia só com geometria
+    gdf_limpo = gdf[['geometry']].copy()
+    
+    # Adicionar atributo 'nome' se existir (útil para popup)
+    if 'nome' in gdf.columns:
+        gdf_limpo['nome'] = gdf['nome'].astype(str)
+    elif 'Name' in gdf.columns:
+        gdf_limpo['nome'] = gdf['Name'].astype(str)
+    
+    return gdf_limpo
+
+
+# ===== Métricas de geometria (áreas) =====
+# Áreas numa projeção cônica equivalente de Albers para o Brasil (GRS80/SIRGAS 2000), válida para
+# PAs que cruzam fusos UTM. Cada feição é reprojetada uma única vez: a área fica num cache do
+# processo indexado pelo hash da geometria, e upload, lotes e relatório PDF consultam o cache.
+
+CRS_AREA_BRASIL = ("+proj=aea +lat_0=-12 +lon_0=-54 +lat_1=-2 +lat_2=-22 "
+                   "+x_0=5000000 +y_0=10000000 +ellps=GRS80 +units=m +no_defs")
+_MAX_AREAS_CACHE = 1_000_000
+
+
+@st.cache_resource
+def _cache_areas():
+    """Áreas (m²) já calculadas, compartilhadas por todas as sessões: {hash da geometria: área}"""
+    return {'areas': {}, 'lock': threading.Lock()}
+
+
+def areas_m2(geometrias, crs="EPSG:4326"):
+    """Área (m²) de cada geometria em Albers/Brasil; só as que ainda não estão no cache são reprojetadas.
+
+    Geometria nula ou vazia tem área 0. Geometrias inválidas são corrigidas com buffer(0) já projetadas.
+    """
+    import numpy as np
+    import shapely
+    from pyproj import Transformer
+
+    geoms = np.asarray(geometrias, dtype=object)
+    presentes = np.flatnonzero(~(shapely.is_missing(geoms) | shapely.is_empty(geoms)))
+    prefixo = str(crs).encode()
+    chaves = [hashlib.blake2b(prefixo + wkb, digest_size=16).digest() for wkb in shapely.to_wkb(geoms[presentes])]
+
+    cache = _cache_areas()
+    with cache['lock']:
+        faltando = [i for i, chave in enumerate(chaves) if chave not in cache['areas']]
+
+    if faltando:
+        transformer = Transformer.from_crs(crs, CRS_AREA_BRASIL, always_xy=True)
+        projetadas = shapely.transform(
+            geoms[presentes[faltando]],
+            lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+        )
+        invalidas = ~shapely.is_valid(projetadas)
+        projetadas[invalidas] = shapely.buffer(projetadas[invalidas], 0)
+        novas = shapely.area(projetadas)
+        with cache['lock']:
+            if len(cache['areas']) + len(faltando) > _MAX_AREAS_CACHE:
+                cache['areas'].clear()
+            cache['areas'].update((chaves[i], float(area)) for i, area in zip(faltando, novas))
+            areas_presentes = [cache['areas'][chave] for chave in chaves]
+    else:
+        with cache['lock']:
+            areas_presentes = [cache['areas'][chave] for chave in chaves]
+
+    areas = np.zeros(len(geoms))
+    areas[presentes] = areas_presentes
+    return areas
+
+
+def calcular_area_ha(gdf):
+    """Área total em hectares (soma das feições em Albers/Brasil, via cache de áreas)"""
+    return float(areas_m2(gdf.geometry.array, gdf.crs).sum() / 10000)
+
+
+def _sanear_geometrias(geoms):
+    """Sanitiza um array de geometrias Shapely para aceite pelo GEE (operações vetorizadas do shapely 2).
+    1. Corrige invalidade via buffer(0) + make_valid()
+    2. De GeometryCollection resultante, mantém só os polígonos
+    3. Garante winding order CCW exterior (exigido pelo GeoJSON do GEE)
+    4. Arredonda coordenadas para 7 casas decimais (~1 cm), em 2D
+    """
+    import numpy as np
+    import shapely
+
+    geoms = np.array(geoms, dtype=object)
+    invalidas = ~shapely.is_valid(geoms)
+    geoms[invalidas] = shapely.make_valid(shapely.buffer(geoms[invalidas], 0))
+
+    # make_valid() pode retornar GeometryCollection — extrair só polígonos (casos raros, um a um)
+    for i in np.flatnonzero(shapely.get_type_id(geoms) == 7):
+        partes = shapely.get_parts(geoms[i])
+        polys = partes[np.isin(shapely.get_type_id(partes), [3, 6])]
+        geoms[i] = shapely.union_all(polys) if len(polys) else shapely.buffer(geoms[i], 0)
+
+    geoms = shapely.orient_polygons(geoms, exterior_cw=False)  # exterior CCW, interior CW
+    return shapely.transform(geoms, lambda coords: np.round(coords, 7))
+
+
+def geom_para_gee(geom):
+    """Sanitiza uma geometria Shapely (ver _sanear_geometrias) e a converte em ee.Geometry"""
+    import ee
+    import shapely
+
+    return ee.Geometry(json.loads(shapely.to_geojson(_sanear_geometrias([geom])[0])))
+
+
+# Colunas com o nome/número do lote, em ordem de preferência
+_COLS_LOTE = ['NOM_LOT', 'nom_lot', 'NUM_LOTE', 'num_lote',
+              'Lote', 'lote', 'LOTE', 'PARCELA', 'parcela',
+              'Name', 'name', 'ID_LOTE', 'id_lote']
+
+
+def nomes_dos_lotes(gdf_parcelas):
+    """Nome de cada lote: primeira coluna de _COLS_LOTE com valor preenchido, senão 'Lote_<idx + 1>'"""
+    import pandas as pd
+
+    nomes = pd.Series(None, index=gdf_parcelas.index, dtype=object)
+    for col in _COLS_LOTE:
+        if col in gdf_parcelas.columns:
+            valores = gdf_parcelas[col].astype(str).str.strip()
+            nomes = nomes.where(nomes.notna(), valores.where(~valores.isin(['nan', 'None', ''])))
+    padrao = pd.Series([f'Lote_{idx + 1}' for idx in gdf_parcelas.index], index=gdf_parcelas.index)
+    return nomes.where(nomes.notna(), padrao)
+
+
+def impressoes_lotes(gdf_parcelas):
+    """Impressão digital de cada lote (hex): hash do WKB da geometria em EPSG:4326, normalizada e na grade de 1e-7°.
+
+    Independe do vértice inicial, do sentido dos anéis, da ordem das partes e do arredondamento do
+    arquivo; None para geometria nula ou vazia. Série alinhada ao índice de gdf_parcelas.
+    """
+    import numpy as np
+    import pandas as pd
+    import shapely
+
+    gdf = gdf_parcelas if gdf_parcelas.crs is None or gdf_parcelas.crs.to_epsg() == 4326 else gdf_parcelas.to_crs(4326)
+    geoms = np.asarray(gdf.geometry.array, dtype=object)
+    presentes = np.flatnonzero(~(shapely.is_missing(geoms) | shapely.is_empty(geoms)))
+    canonicas = shapely.normalize(shapely.set_precision(geoms[presentes], 1e-7))
+    impressoes = np.full(len(geoms), None, dtype=object)
+    impressoes[presentes] = [hashlib.blake2b(wkb, digest_size=16).hexdigest() for wkb in shapely.to_wkb(canonicas)]
+    return pd.Series(impressoes, index=gdf_parcelas.index, name='impressao')
+
+
+def lotes_para_geojson(gdf_parcelas):
+    """Prepara os lotes de uma vez: nomes, áreas e uma FeatureCollection GeoJSON (propriedade 'lote_id').
+
+    Retorna (feature_collection, lotes_info, lotes_com_erro) como em preparar_lotes, com a
+    FeatureCollection ainda como dict GeoJSON (sem objetos do GEE).
+    """
+    import numpy as np
+    import shapely
+
+    geoms = np.asarray(gdf_parcelas.geometry.array, dtype=object)
+    vazias = shapely.is_missing(geoms) | shapely.is_empty(geoms)
+    lotes_com_erro = [(idx, '') for idx in gdf_parcelas.index[vazias]]
+    gdf_validos = gdf_parcelas[~vazias]
+    ids = gdf_validos.index
+
+    areas_ha = np.round(areas_m2(geoms[~vazias], gdf_parcelas.crs) / 10000, 2)
+
+    nomes = nomes_dos_lotes(gdf_validos)
+    lotes_info = {idx: {'nome': nome, 'area_ha': float(area)} for idx, nome, area in zip(ids, nomes, areas_ha)}
+
+    # GeoJSON de todas as geometrias de uma vez; o JSON da coleção é montado como texto e lido uma vez só
+    geometrias = shapely.to_geojson(_sanear_geometrias(geoms[~vazias]))
+    features = ','.join(
+        f'{{"type":"Feature","geometry":{geometria},"properties":{{"lote_id":{int(idx)}}}}}'
+        for idx, geometria in zip(ids, geometrias)
+    )
+    feature_collection = json.loads(f'{{"type":"FeatureCollection","features":[{features}]}}')
+    return feature_collection, lotes_info, lotes_com_erro
+
+
+def preparar_lotes(gdf_parcelas):
+    """Converte os lotes em FeatureCollection do GEE (propriedade 'lote_id' = índice do lote).
+
+    Retorna (parcelas_fc, lotes_info, lotes_com_erro):
+    - parcelas_fc: ee.FeatureCollection ou None se nenhum lote for válido
+    - lotes_info: {idx: {'nome', 'area_ha'}} com área em Albers/Brasil (areas_m2)
+    - lotes_com_erro: lista de (idx, mensagem) — mensagem vazia para geometria nula/vazia
+    """
+    import ee
+
+    feature_collection, lotes_info, lotes_com_erro = lotes_para_geojson(gdf_parcelas)
+    if not feature_collection['features']:
+        return None, lotes_info, lotes_com_erro
+    return ee.FeatureCollection(feature_collection), lotes_info, lotes_com_erro
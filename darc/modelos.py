@@ -0,0 +1,158 @@
+"""Registro de classificadores treinados, reaplicáveis a outros PAs e anos do mesmo sensor."""
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import streamlit as st
+
+from darc.classificacao import arvores_classificador, esquema_bandas, sensor_landsat
+from darc.execucoes import DIR_EXECUCOES
+
+
+# ===== Registro de modelos =====
+# Cada classificador treinado pode ser registrado com o esquema de bandas, o sensor, a cena e a
+# impressão do treino (cena, amostras, parâmetros do RF, janela de amostragem e ROI). O
+# classificador é guardado como o modelo treinado — as árvores do Random Forest (explain()['trees']),
+# refeitas com ee.Classifier.decisionTreeEnsemble —, não como a expressão de treino: aplicá-lo em
+# outra cena do mesmo sensor, de outro PA ou outro ano não amostra a cena original nem retreina.
+
+DIR_MODELOS = os.path.join(DIR_EXECUCOES, 'modelos')
+_CAMPOS_JSON_MODELO = ('esquema_bandas', 'parametros', 'class_names', 'arvores')
+
+
+def _conectar_modelos():
+    os.makedirs(DIR_MODELOS, exist_ok=True)
+    con = sqlite3.connect(os.path.join(DIR_MODELOS, 'modelos.sqlite'), timeout=30)
+    con.row_factory = sqlite3.Row
+    colunas = {linha['name'] for linha in con.execute("PRAGMA table_info(modelos)")}
+    if 'classificador' in colunas:
+        # Registros antigos guardavam a expressão de treino (retreinavam a cada uso): ficam de lado
+        with con:
+            con.execute("ALTER TABLE modelos RENAME TO modelos_expressao_treino")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS modelos (
+            modelo_id TEXT PRIMARY KEY,
+            criado_em TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            esquema_bandas TEXT NOT NULL,
+            sat TEXT,
+            cena_id TEXT,
+            data TEXT,
+            nome_pa TEXT,
+            impressao_treino TEXT NOT NULL,
+            parametros TEXT,
+            class_names TEXT,
+            n_amostras INTEGER,
+            accuracy REAL,
+            kappa REAL,
+            arvores TEXT NOT NULL
+        )
+    """)
+    return con
+
+
+def registrar_modelo(nome, classificador, sat, impressao_treino, registro):
+    """Registra um classificador treinado: as árvores são lidas do servidor uma vez e guardadas.
+
+    impressao_treino: impressão do estágio de classificação do período; o mesmo treino registrado
+    de novo só troca o nome. registro: cena_id, data, nome_pa, parametros, class_names, amostras
+    ({classe: [[lon, lat], ...]}), accuracy e kappa.
+    Retorna o modelo_id.
+    """
+    modelo_id = impressao_treino[:16]
+    linha = {
+        'modelo_id': modelo_id,
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'nome': nome,
+        'sensor': sensor_landsat(sat),
+        'esquema_bandas': esquema_bandas(sat),
+        'sat': sat,
+        'cena_id': registro.get('cena_id'),
+        'data': registro.get('data'),
+        'nome_pa': registro.get('nome_pa'),
+        'impressao_treino': impressao_treino,
+        'parametros': registro.get('parametros'),
+        'class_names': registro.get('class_names'),
+        'n_amostras': sum(len(pontos) for pontos in (registro.get('amostras') or {}).values()),
+        'accuracy': registro.get('accuracy'),
+        'kappa': registro.get('kappa'),
+        'arvores': arvores_classificador(classificador),
+    }
+    for campo in _CAMPOS_JSON_MODELO:
+        linha[campo] = json.dumps(linha[campo], ensure_ascii=False, default=str)
+
+    con = _conectar_modelos()
+    try:
+        with con:
+            con.execute(
+                f"INSERT OR REPLACE INTO modelos ({', '.join(linha)}) VALUES ({', '.join('?' * len(linha))})",
+                list(linha.values())
+            )
+    finally:
+        con.close()
+    carregar_modelo.clear()
+    return modelo_id
+
+
+def listar_modelos(sat=None):
+    """Modelos registrados (sem o classificador), mais recentes primeiro.
+
+    Com `sat`, só os compatíveis com a cena: mesmo sensor e mesmo esquema de bandas.
+    """
+    if not os.path.exists(os.path.join(DIR_MODELOS, 'modelos.sqlite')):
+        return []
+    con = _conectar_modelos()
+    try:
+        linhas = [dict(linha) for linha in con.execute("""
+            SELECT modelo_id, criado_em, nome, sensor, esquema_bandas, sat, cena_id, data, nome_pa,
+                   n_amostras, accuracy, kappa, parametros
+            FROM modelos ORDER BY criado_em DESC
+        """)]
+    finally:
+        con.close()
+    for linha in linhas:
+        linha['esquema_bandas'] = json.loads(linha['esquema_bandas'])
+        linha['janela_amostragem'] = json.loads(linha.pop('parametros') or '{}').get('janela_amostragem')
+    if sat is not None:
+        linhas = [linha for linha in linhas
+                  if linha['sensor'] == sensor_landsat(sat) and linha['esquema_bandas'] == esquema_bandas(sat)]
+    return linhas
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def carregar_modelo(modelo_id):
+    """Modelo registrado completo, com as árvores do classificador (só disco)"""
+    con = _conectar_modelos()
+    try:
+        linha = con.execute("SELECT * FROM modelos WHERE modelo_id = ?", (modelo_id,)).fetchone()
+    finally:
+        con.close()
+    if linha is None:
+        raise KeyError(f"Modelo {modelo_id} não encontrado em {DIR_MODELOS}")
+
+    modelo = dict(linha)
+    for campo in _CAMPOS_JSON_MODELO:
+        modelo[campo] = json.loads(modelo[campo]) if modelo[campo] else None
+    return modelo
+
+
+def remover_modelo(modelo_id):
+    """Apaga um modelo do registro (análises já feitas com ele não mudam)"""
+    con = _conectar_modelos()
+    try:
+        with con:
+            con.execute("DELETE FROM modelos WHERE modelo_id = ?", (modelo_id,))
+    finally:
+        con.close()
+    carregar_modelo.clear()
+
+
+def rotulo_modelo(modelo):
+    """Texto curto de um modelo para listas de seleção"""
+    acuracia = f", acurácia {modelo['accuracy']:.1%}" if modelo.get('accuracy') is not None else ""
+    janela = modelo.get('janela_amostragem')
+    janela = f", janela {janela}×{janela}" if janela else ""
+    return (f"{modelo['nome']} — {modelo['sensor']}, {modelo.get('data') or 's/ data'}, "
+            f"{modelo.get('nome_pa') or 's/ PA'}, {modelo.get('n_amostras') or 0} amostras{janela}{acuracia}")
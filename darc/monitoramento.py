@@ -0,0 +1,476 @@
+"""Monitoramento contínuo: linha de base congelada e novas datas acumuladas num histórico por lote."""
+import json
+import os
+import sqlite3
+from datetime import date, datetime
+
+import streamlit as st
+
+from darc.cenas import aplicar_fatores_escala, buscar_cena, imagem_da_escolha, metadados_da_escolha
+from darc.classificacao import (
+    COLUNAS_MUDANCA, arvores_classificador, calcular_areas_mudanca, calcular_mudanca, classificar_periodos,
+    criar_samples, mudanca_por_lote, tipos_cobertura
+)
+from darc.execucoes import DIR_EXECUCOES
+from darc.gee import inicializar_gee, pasta_assets_gee
+from darc.geo import geom_para_gee, impressoes_lotes, preparar_lotes
+from darc.tarefas import acompanhar_tarefa, submeter_tarefa
+
+
+# ===== Monitoramento contínuo =====
+# Um PA é reanalisado a cada poucos meses contra a mesma data de referência. A linha de base guarda
+# o período anterior como dado, não como expressão: a imagem classificada é exportada para um asset
+# do GEE (coluna 'classificada' = ID do asset) e o classificador vira as árvores do Random Forest
+# treinado. Também guarda a cena (expressão serializada, só como referência), as amostras e as áreas
+# por lote. Cada nova data só busca a cena nova, treina e classifica esse período e reduz a mudança
+# contra o asset da base — cena, treino e classificação da base não são refeitos no servidor; o
+# resultado é acrescentado ao histórico (SQLite), consultável por lote ao longo das datas. O período
+# posterior da análise congelada fica pendente como primeira data e passa pelo mesmo caminho
+# (processar_nova_data) quando a exportação do asset termina.
+
+DIR_MONITORAMENTO = os.path.join(DIR_EXECUCOES, 'monitoramento')
+
+
+def _conectar_monitoramento():
+    os.makedirs(DIR_MONITORAMENTO, exist_ok=True)
+    con = sqlite3.connect(os.path.join(DIR_MONITORAMENTO, 'monitoramento.sqlite'), timeout=30)
+    con.row_factory = sqlite3.Row
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS linhas_base (
+            base_id TEXT PRIMARY KEY,
+            criado_em TEXT NOT NULL,
+            run_id TEXT,
+            nome_pa TEXT,
+            date_base TEXT,
+            cena_base TEXT,
+            sat_base TEXT,
+            imagem TEXT NOT NULL,
+            classificada TEXT NOT NULL,
+            classificador TEXT,
+            amostras TEXT,
+            n_lotes INTEGER,
+            tarefa_exportacao TEXT,
+            primeira_data TEXT
+        );
+        CREATE TABLE IF NOT EXISTS datas_monitoramento (
+            base_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            cena TEXT,
+            sat TEXT,
+            accuracy REAL,
+            kappa REAL,
+            areas TEXT,
+            processado_em TEXT NOT NULL,
+            PRIMARY KEY (base_id, data)
+        );
+        CREATE TABLE IF NOT EXISTS historico_lotes (
+            base_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            lote_id INTEGER NOT NULL,
+            FF_ha REAL, AC_ha REAL, CH_ha REAL, DI_ha REAL, FR_ha REAL,
+            PRIMARY KEY (base_id, data, lote_id)
+        );
+    """)
+    colunas = {linha['name'] for linha in con.execute("PRAGMA table_info(linhas_base)")}
+    for coluna in ('tarefa_exportacao', 'primeira_data'):
+        if coluna not in colunas:
+            with con:
+                con.execute(f"ALTER TABLE linhas_base ADD COLUMN {coluna} TEXT")
+    return con
+
+
+def _exportar_classificada(base_id, classificada, roi_local):
+    """Exporta a classificação da base para um asset do GEE; retorna (ID do asset, ID da exportação ou None)"""
+    import ee
+
+    asset_id = f"{pasta_assets_gee()}/{base_id}"
+    try:
+        ee.data.getAsset(asset_id)
+        return asset_id, None  # mesma análise congelada de novo: o asset já existe
+    except ee.EEException:
+        pass
+    exportacao = ee.batch.Export.image.toAsset(
+        image=classificada.toUint8(),
+        description=f"darc_{base_id}",
+        assetId=asset_id,
+        region=geom_para_gee(roi_local),
+        crs='EPSG:4674',
+        scale=30,
+        maxPixels=1e13,
+        pyramidingPolicy={'.default': 'mode'},
+    )
+    exportacao.start()
+    return asset_id, exportacao.id
+
+
+def estado_exportacao_base(base):
+    """Situação do asset da classificação da base: ('COMPLETED' | 'READY' | 'RUNNING' | 'FAILED' | ..., mensagem)"""
+    import ee
+
+    if base['classificada'].startswith('{'):
+        return 'FORMATO_ANTIGO', "linha de base congelada como expressão; congele a análise de novo"
+    try:
+        ee.data.getAsset(base['classificada'])
+        return 'COMPLETED', None
+    except ee.EEException:
+        pass
+    if not base.get('tarefa_exportacao'):
+        return 'FAILED', f"asset {base['classificada']} não encontrado"
+    status = ee.data.getTaskStatus(base['tarefa_exportacao'])[0]
+    return status['state'], status.get('error_message')
+
+
+def _areas_por_coluna(areas_roi):
+    """Saída de calcular_areas_mudanca → {coluna de COLUNAS_MUDANCA: ha}"""
+    return {COLUNAS_MUDANCA[int(g['group'])]: round(g['sum'] / 10000, 2)
+            for g in (areas_roi or {}).get('groups', []) if int(g['group']) in COLUNAS_MUDANCA}
+
+
+def congelar_linha_base(run_id, registro, gdf, gdf_parcelas=None, df_lotes=None, primeira_data=None):
+    """Congela o período anterior de uma análise como linha de base de monitoramento.
+
+    registro: nome_pa, date_base, cena_base, sat_base, amostras ({'anterior', 'posterior'}) e os objetos
+    do GEE 'imagem' (serializada como referência), 'classificada' (exportada para asset; a exportação
+    segue no servidor) e 'classificador' (árvores lidas do servidor) — ou 'arvores', se já conhecidas.
+    df_lotes (tabela por lote da análise) fornece as áreas por classe da base em cada lote.
+    primeira_data ({'data', 'cena', 'sat', 'imagem'}): o período posterior da própria análise, guardado
+    como primeira data pendente do histórico (imagem serializada); é processado como as demais datas,
+    com as amostras do período posterior, depois que o asset da base fica pronto.
+    Retorna o base_id.
+    """
+    import shapely
+
+    base_id = f"base_{run_id}"
+    pasta = os.path.join(DIR_MONITORAMENTO, base_id)
+    os.makedirs(pasta, exist_ok=True)
+    gdf.to_parquet(os.path.join(pasta, 'pa.parquet'))
+    if gdf_parcelas is not None:
+        gdf_parcelas.to_parquet(os.path.join(pasta, 'parcelas.parquet'))
+    if df_lotes is not None:
+        colunas_base = ['Lote', 'Area_Total_ha', *(f"{tipo}_2008_ha" for tipo in tipos_cobertura)]
+        df_lotes[colunas_base].to_parquet(os.path.join(pasta, 'lotes_base.parquet'))
+
+    linha = {
+        'base_id': base_id,
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'run_id': run_id,
+        'nome_pa': registro.get('nome_pa'),
+        'date_base': registro.get('date_base'),
+        'cena_base': registro.get('cena_base'),
+        'sat_base': registro.get('sat_base'),
+        'amostras': json.dumps(registro.get('amostras'), ensure_ascii=False),
+        'n_lotes': None if df_lotes is None else len(df_lotes),
+    }
+    linha['imagem'] = registro['imagem'].serialize()
+    linha['classificada'], linha['tarefa_exportacao'] = _exportar_classificada(
+        base_id, registro['classificada'], shapely.make_valid(gdf.geometry.union_all())
+    )
+    arvores = registro.get('arvores')
+    if arvores is None and registro.get('classificador') is not None:
+        arvores = arvores_classificador(registro['classificador'])
+    linha['classificador'] = json.dumps(arvores) if arvores is not None else None
+    if primeira_data is not None:
+        linha['primeira_data'] = json.dumps({**primeira_data, 'imagem': primeira_data['imagem'].serialize()})
+
+    con = _conectar_monitoramento()
+    try:
+        with con:
+            con.execute(
+                f"INSERT OR REPLACE INTO linhas_base ({', '.join(linha)}) VALUES ({', '.join('?' * len(linha))})",
+                list(linha.values())
+            )
+    finally:
+        con.close()
+
+    return base_id
+
+
+def listar_linhas_base():
+    """Linhas de base salvas com o número de datas monitoradas — sem pandas, roda na primeira tela"""
+    if not os.path.exists(os.path.join(DIR_MONITORAMENTO, 'monitoramento.sqlite')):
+        return []
+    con = _conectar_monitoramento()
+    try:
+        return [dict(linha) for linha in con.execute("""
+            SELECT b.base_id, b.criado_em, b.nome_pa, b.date_base, b.n_lotes,
+                   COUNT(d.data) AS n_datas, MAX(d.data) AS ultima_data
+            FROM linhas_base b LEFT JOIN datas_monitoramento d ON d.base_id = b.base_id
+            GROUP BY b.base_id ORDER BY b.criado_em DESC
+        """)]
+    finally:
+        con.close()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def carregar_linha_base(base_id):
+    """Metadados, asset da classificação, árvores, PA, lotes e áreas da base por lote (só disco)"""
+    import geopandas as gpd
+    import pandas as pd
+
+    con = _conectar_monitoramento()
+    try:
+        linha = con.execute("SELECT * FROM linhas_base WHERE base_id = ?", (base_id,)).fetchone()
+    finally:
+        con.close()
+    if linha is None:
+        raise KeyError(f"Linha de base {base_id} não encontrada em {DIR_MONITORAMENTO}")
+
+    base = dict(linha)
+    base['amostras'] = json.loads(base['amostras']) if base['amostras'] else None
+    base['primeira_data'] = json.loads(base['primeira_data']) if base.get('primeira_data') else None
+    if base['classificador'] and not base['classificador'].startswith('{'):
+        base['classificador'] = json.loads(base['classificador'])
+    pasta = os.path.join(DIR_MONITORAMENTO, base_id)
+    base['gdf'] = gpd.read_parquet(os.path.join(pasta, 'pa.parquet'))
+    caminho = os.path.join(pasta, 'parcelas.parquet')
+    base['gdf_parcelas'] = gpd.read_parquet(caminho) if os.path.exists(caminho) else None
+    caminho = os.path.join(pasta, 'lotes_base.parquet')
+    base['lotes_base'] = pd.read_parquet(caminho) if os.path.exists(caminho) else None
+    return base
+
+
+def processar_nova_data(tarefa, base, img_nova, sat_nova, samples_all, amostras):
+    """Classifica só a nova data e reduz a mudança contra o asset da base congelada (roda como Tarefa).
+
+    Retorna {'accuracy', 'kappa', 'areas' (ha por classe de mudança no PA), 'lotes' ({lote_id: {coluna: ha}})}.
+    """
+    import ee
+    import shapely
+
+    tarefa.etapa("Abrindo a linha de base")
+    if base['classificada'].startswith('{'):
+        raise ValueError("Linha de base congelada como expressão (formato antigo): congele a análise de novo.")
+    classificada_base = ee.Image(base['classificada'])
+    roi_local = shapely.make_valid(base['gdf'].geometry.union_all())
+    roi = geom_para_gee(roi_local)
+
+    resultado = classificar_periodos(tarefa, None, img_nova, base['sat_base'] or '', sat_nova,
+                                     None, samples_all, None, amostras, roi, ('pos',))
+    change = calcular_mudanca(classificada_base, resultado['classified_pos'], roi)
+
+    tarefa.etapa("Mudanças no PA e por lote")
+    areas = _areas_por_coluna(calcular_areas_mudanca(change, roi, roi_local=roi_local))
+
+    lotes = {}
+    if base['gdf_parcelas'] is not None:
+        parcelas_fc, _, _ = preparar_lotes(base['gdf_parcelas'])
+        if parcelas_fc is not None:
+            lotes = {props['lote_id']: areas_lote for props, areas_lote in mudanca_por_lote(change, parcelas_fc)}
+
+    return {'accuracy': resultado['accuracy_pos'], 'kappa': resultado['kappa_pos'], 'areas': areas, 'lotes': lotes}
+
+
+def registrar_nova_data(base_id, data, cena, sat, resultado):
+    """Acrescenta (ou substitui) uma data no histórico da linha de base: totais do PA e áreas por lote"""
+    con = _conectar_monitoramento()
+    try:
+        with con:
+            con.execute(
+                "INSERT OR REPLACE INTO datas_monitoramento VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (base_id, data, cena, sat, resultado.get('accuracy'), resultado.get('kappa'),
+                 json.dumps(resultado['areas']), datetime.now().isoformat(timespec='seconds'))
+            )
+            con.execute("DELETE FROM historico_lotes WHERE base_id = ? AND data = ?", (base_id, data))
+            con.executemany(
+                f"INSERT INTO historico_lotes VALUES (?, ?, ?, {', '.join('?' * len(COLUNAS_MUDANCA))})",
+                [(base_id, data, int(lote_id), *(areas.get(c) for c in COLUNAS_MUDANCA.values()))
+                 for lote_id, areas in resultado['lotes'].items()]
+            )
+    finally:
+        con.close()
+
+
+def datas_monitoradas(base_id):
+    """Datas já gravadas no histórico da linha de base (conjunto de 'AAAA-MM-DD')"""
+    if not os.path.exists(os.path.join(DIR_MONITORAMENTO, 'monitoramento.sqlite')):
+        return set()
+    con = _conectar_monitoramento()
+    try:
+        return {linha['data'] for linha in con.execute(
+            "SELECT data FROM datas_monitoramento WHERE base_id = ?", (base_id,)
+        )}
+    finally:
+        con.close()
+
+
+def validar_nova_data(base, data, registradas):
+    """Motivo pelo qual `data` ('AAAA-MM-DD') não pode entrar no histórico da base, ou None se pode"""
+    if base['date_base'] and data <= base['date_base']:
+        return f"a data ({data}) precisa ser posterior à linha de base ({base['date_base']})"
+    if data in registradas:
+        return f"{data} já está no histórico desta linha de base"
+    return None
+
+
+def historico_monitoramento(base_id):
+    """Uma linha por data monitorada: cena, acurácia e áreas de mudança no PA (ha)"""
+    import pandas as pd
+
+    con = _conectar_monitoramento()
+    try:
+        linhas = [dict(linha) for linha in con.execute(
+            "SELECT * FROM datas_monitoramento WHERE base_id = ? ORDER BY data", (base_id,)
+        )]
+    finally:
+        con.close()
+    for linha in linhas:
+        linha.update(json.loads(linha.pop('areas') or '{}'))
+    colunas = ['data', 'cena', 'sat', 'accuracy', 'kappa', *COLUNAS_MUDANCA.values()]
+    return pd.DataFrame(linhas, columns=colunas).set_index('data')
+
+
+def tendencia_lotes(base_id, coluna='DI_ha', lotes_base=None):
+    """Área de uma classe de mudança por lote ao longo das datas (lotes × datas, ha)"""
+    import pandas as pd
+
+    if coluna not in COLUNAS_MUDANCA.values():
+        raise ValueError(f"Coluna desconhecida: {coluna}")
+    con = _conectar_monitoramento()
+    try:
+        df = pd.read_sql_query(
+            f"SELECT lote_id, data, {coluna} FROM historico_lotes WHERE base_id = ?", con, params=(base_id,)
+        )
+    finally:
+        con.close()
+    tabela = df.pivot(index='lote_id', columns='data', values=coluna)
+    if lotes_base is not None:
+        tabela.insert(0, 'Lote', lotes_base['Lote'].reindex(tabela.index))
+    return tabela
+
+
+def _base_pronta(base):
+    """True se o asset da base já foi exportado; senão avisa (exportação em curso) ou mostra o erro"""
+    estado, mensagem = estado_exportacao_base(base)
+    if estado in ('READY', 'RUNNING'):
+        st.warning(f"⏳ A classificação da linha de base ainda está sendo exportada para o GEE ({estado}). "
+                   "Tente de novo em alguns minutos.")
+    elif estado != 'COMPLETED':
+        st.error(f"❌ Linha de base indisponível ({estado}): {mensagem}")
+    return estado == 'COMPLETED'
+
+
+def _submeter_data(base, data, cena, sat, imagem, amostras):
+    """Agenda processar_nova_data para uma data e grava o resultado no histórico ao concluir"""
+    class_map = {tipo: i for i, tipo in enumerate(tipos_cobertura.keys())}
+    amostras_copia = {t: list(p) for t, p in amostras.items()}
+    submeter_tarefa(
+        'monitoramento', f"Monitoramento {data}", processar_nova_data,
+        base, imagem, sat or '', criar_samples(amostras_copia, class_map), amostras_copia,
+        total_etapas=5,
+        ao_concluir=lambda resultado: registrar_nova_data(base['base_id'], data, cena, sat, resultado)
+    )
+    st.rerun()
+
+
+def mostrar_monitoramento(base):
+    """Histórico da linha de base, tendência por lote e processamento de uma nova data"""
+    import shapely
+
+    base_id = base['base_id']
+    st.header(f"📡 Monitoramento: {base['nome_pa'] or base_id}")
+    st.caption(f"Linha de base: {base['date_base']} ({base['sat_base'] or '—'}, cena {base['cena_base'] or '—'}) "
+               f"| congelada em {base['criado_em']}")
+    if st.button("✖️ Fechar monitoramento"):
+        del st.session_state['monitoramento_aberto']
+        st.rerun()
+
+    registradas = datas_monitoradas(base_id)
+    primeira = base['primeira_data']
+    amostras_base = (base['amostras'] or {}).get('posterior') or {}
+    if primeira and primeira['data'] not in registradas:
+        # Primeira data pendente: o período posterior da análise, pelo mesmo caminho das novas datas
+        registradas = registradas | {primeira['data']}
+        st.subheader(f"⏳ Primeira data pendente: {primeira['data']}")
+        sem_amostras = sum(1 for pontos in amostras_base.values() if pontos) < 2
+        if sem_amostras:
+            st.warning("⚠️ O período posterior da análise não tem amostras de 2 classes (modelo registrado?): "
+                       "processe uma nova data com amostras.")
+        if st.button("▶️ Processar primeira data", disabled=sem_amostras):
+            import ee
+
+            inicializar_gee()
+            try:
+                if _base_pronta(base):
+                    _submeter_data(base, primeira['data'], primeira.get('cena'), primeira.get('sat'),
+                                   ee.Image(ee.deserializer.fromJSON(primeira['imagem'])), amostras_base)
+            except Exception as e:
+                st.error(f"❌ Erro ao processar a primeira data: {e}")
+
+    st.subheader("➕ Nova data")
+    # Amostras da nova data: as salvas com esta linha de base ou as coletadas nesta sessão no mesmo PA,
+    # que valem só para a data da cena em que foram coletadas (período posterior da sessão)
+    fontes = {'base': "Amostras do período posterior salvas na linha de base"}
+    amostras_sessao = st.session_state.get('amostras_posterior') or {}
+    data_sessao = st.session_state.get('date_pos')
+    if any(amostras_sessao.values()) and data_sessao:
+        fontes['sessao'] = f"Amostras coletadas nesta sessão na cena de {data_sessao}"
+    fonte = st.radio("📍 Amostras de treino", list(fontes), format_func=fontes.get, key='monitoramento_fonte')
+
+    erro_amostras = None
+    if fonte == 'sessao':
+        amostras = amostras_sessao
+        gdf_sessao = st.session_state.get('gdf')
+        if gdf_sessao is None or set(impressoes_lotes(gdf_sessao)) != set(impressoes_lotes(base['gdf'])):
+            erro_amostras = "as amostras desta sessão foram coletadas em outro PA"
+    else:
+        amostras = amostras_base
+    if sum(1 for pontos in amostras.values() if pontos) < 2:
+        erro_amostras = erro_amostras or "são necessárias amostras de pelo menos 2 classes"
+
+    col_data, col_nuvens = st.columns(2)
+    with col_data:
+        if fonte == 'sessao':
+            nova_data = date.fromisoformat(data_sessao)
+            st.date_input("Data", value=nova_data, disabled=True, key='monitoramento_data_sessao',
+                          help="Amostras da sessão valem só para a cena em que foram coletadas.")
+        else:
+            nova_data = st.date_input("Data", value=date.today(), min_value=date(1985, 1, 1), key='monitoramento_data')
+    with col_nuvens:
+        cloud_max = st.slider("Nuvens máx. (%)", 0, 100, 80, key='monitoramento_nuvens')
+
+    erro_data = validar_nova_data(base, nova_data.isoformat(), registradas)
+    for erro in (erro_amostras, erro_data):
+        if erro:
+            st.error(f"❌ Não é possível processar: {erro}.")
+
+    if st.button("▶️ Processar nova data", type="primary", disabled=bool(erro_amostras or erro_data)):
+        inicializar_gee()
+        try:
+            if _base_pronta(base):
+                roi_local = shapely.make_valid(base['gdf'].geometry.union_all())
+                escolha = buscar_cena(nova_data.strftime('%Y-%m-%d'), cloud_max, roi_local)
+                meta = metadados_da_escolha(escolha, 'nova') if escolha is not None else None
+                # A cena encontrada pode ser de outro dia: o histórico é gravado pela data da cena
+                erro_cena = validar_nova_data(base, meta['date_nova'], registradas) if meta else None
+                if meta and fonte == 'sessao' and meta['date_nova'] != data_sessao:
+                    erro_cena = f"as amostras da sessão foram coletadas na cena de {data_sessao}, não na de {meta['date_nova']}"
+                if escolha is None:
+                    st.error(f"❌ Nenhuma imagem encontrada para {nova_data}")
+                elif erro_cena:
+                    st.error(f"❌ Cena mais próxima ({meta['id_nova']}) não serve para o histórico: {erro_cena}.")
+                else:
+                    _submeter_data(base, meta['date_nova'], meta['id_nova'], meta['sat_nova'],
+                                   aplicar_fatores_escala(imagem_da_escolha(escolha)), amostras)
+        except Exception as e:
+            st.error(f"❌ Erro ao processar nova data: {e}")
+    acompanhar_tarefa('monitoramento')
+
+    st.subheader("📈 Histórico")
+    historico = historico_monitoramento(base_id)
+    if historico.empty:
+        st.info("Nenhuma data monitorada ainda.")
+        return
+    st.dataframe(historico, use_container_width=True)
+    st.line_chart(historico[['DI_ha', 'FR_ha']].fillna(0))
+
+    coluna = st.selectbox("Classe por lote", list(COLUNAS_MUDANCA.values()), index=3, key='monitoramento_coluna')
+    tendencia = tendencia_lotes(base_id, coluna, base['lotes_base'])
+    if not tendencia.empty:
+        st.write(f"**{coluna} por lote ao longo das datas:**")
+        st.dataframe(tendencia, use_container_width=True)
+        st.download_button(
+            label="📥 Baixar histórico por lote (CSV)",
+            data=tendencia.to_csv(),
+            file_name=f"monitoramento_{base_id}_{coluna}.csv",
+            mime="text/csv"
+        )
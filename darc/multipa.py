@@ -0,0 +1,110 @@
+"""Modo multi-PA: PAs vizinhos agrupados pelas cenas Landsat (WRS-2) que os cobrem."""
+from darc.cenas import aplicar_fatores_escala, buscar_candidatas, colecoes_landsat, escolher_cena, imagem_da_escolha
+from darc.classificacao import COLUNAS_MUDANCA, JANELA_AMOSTRAGEM, calcular_mudanca, classificar_periodos, mudanca_por_lote
+from darc.geo import geom_para_gee, lotes_para_geojson
+
+
+# ===== Multi-PA =====
+# PAs vizinhos costumam cair no mesmo path/row do Landsat. Em vez de uma busca por PA e data, as
+# candidatas são buscadas uma vez por data para a união de todos os PAs; cada PA escolhe a cena
+# localmente (mesma regra de buscar_cena) e os PAs com a mesma escolha nas duas datas formam um
+# grupo. Por grupo: um empilhamento de bandas por cena, um treino/classificação, um mapa de mudanças
+# e uma única redução por lote para todos os lotes de todos os PAs do grupo.
+
+def _tiles(escolha):
+    return sorted({(c['props'].get('WRS_PATH'), c['props'].get('WRS_ROW')) for c in escolha['cenas']})
+
+
+def agrupar_pas_por_cenas(tarefa, pas, data_ant, data_pos, cloud_max):
+    """Agrupa os PAs ({nome: GeoDataFrame em EPSG:4326}) pelas cenas escolhidas nas duas datas (roda como Tarefa).
+
+    Uma consulta de candidatas por data ao catálogo local para a união dos PAs (o servidor só é
+    chamado se o catálogo precisar ser sincronizado).
+    Retorna (grupos, sem_cena): grupos = [{'pas', 'escolha_ant', 'escolha_pos', 'tiles_ant', 'tiles_pos'}],
+    sem_cena = nomes dos PAs sem cena em alguma das datas.
+    """
+    import shapely
+
+    geoms = {nome: shapely.make_valid(gdf.geometry.union_all()) for nome, gdf in pas.items()}
+    uniao = shapely.union_all(list(geoms.values()))
+
+    escolhas = {nome: {} for nome in pas}
+    for periodo, data in (('ant', data_ant), ('pos', data_pos)):
+        tarefa.etapa(f"Buscando cenas de {data} para {len(pas)} PAs")
+        candidatos = buscar_candidatas(data, uniao, cloud_max, limite=None)
+        collections = colecoes_landsat(int(data.split('-')[0]))
+        for nome, geom in geoms.items():
+            escolhas[nome][periodo] = escolher_cena(candidatos, collections, geom) if candidatos else None
+
+    grupos, sem_cena = {}, []
+    for nome, escolha in escolhas.items():
+        if escolha['ant'] is None or escolha['pos'] is None:
+            sem_cena.append(nome)
+            continue
+        chave = (tuple(c['id'] for c in escolha['ant']['cenas']), tuple(c['id'] for c in escolha['pos']['cenas']))
+        grupo = grupos.setdefault(chave, {
+            'pas': [], 'escolha_ant': escolha['ant'], 'escolha_pos': escolha['pos'],
+            'tiles_ant': _tiles(escolha['ant']), 'tiles_pos': _tiles(escolha['pos']),
+        })
+        grupo['pas'].append(nome)
+    return list(grupos.values()), sem_cena
+
+
+def _lotes_do_grupo(pas, nomes):
+    """Uma FeatureCollection GeoJSON com os lotes de todos os PAs do grupo (propriedades 'pa' e 'lote_id')"""
+    features, lotes_info = [], {}
+    for nome in nomes:
+        fc, info, _ = lotes_para_geojson(pas[nome])
+        for feature in fc['features']:
+            feature['properties']['pa'] = nome
+        features.extend(fc['features'])
+        lotes_info.update({(nome, idx): dados for idx, dados in info.items()})
+    return {'type': 'FeatureCollection', 'features': features}, lotes_info
+
+
+def processar_multipa(tarefa, grupos, pas, samples_ant_all, samples_pos_all, amostras_ant, amostras_pos,
+                      janela=JANELA_AMOSTRAGEM):
+    """Classificação e mudança uma vez por grupo de cenas, áreas por lote de todos os PAs do grupo (roda como Tarefa).
+
+    janela: lado da janela de amostragem do treino, a mesma da análise do PA atual.
+
+    Retorna {'lotes': DataFrame (PA, Lote, áreas por classe de mudança), 'grupos': [resumo por grupo]}.
+    """
+    import ee
+    import pandas as pd
+    import shapely
+
+    linhas, resumo = [], []
+    for n, grupo in enumerate(grupos, start=1):
+        rotulo = f"Grupo {n}/{len(grupos)} ({len(grupo['pas'])} PAs)"
+        tarefa.etapa(f"{rotulo}: empilhando bandas")
+        img_ant = aplicar_fatores_escala(imagem_da_escolha(grupo['escolha_ant']))
+        img_pos = aplicar_fatores_escala(imagem_da_escolha(grupo['escolha_pos']))
+        sat_ant = grupo['escolha_ant']['cenas'][0]['props'].get('SPACECRAFT_ID', '')
+        sat_pos = grupo['escolha_pos']['cenas'][0]['props'].get('SPACECRAFT_ID', '')
+        fc_lotes, lotes_info = _lotes_do_grupo(pas, grupo['pas'])
+        roi_grupo = geom_para_gee(shapely.union_all([pas[nome].geometry.union_all() for nome in grupo['pas']]))
+
+        try:
+            resultado = classificar_periodos(tarefa, img_ant, img_pos, sat_ant, sat_pos, samples_ant_all,
+                                             samples_pos_all, amostras_ant, amostras_pos, roi_grupo,
+                                             janela=janela)
+        except ValueError as e:
+            # Tipicamente: amostras coletadas fora das cenas deste grupo
+            tarefa.aviso('warning', f"⚠️ {rotulo} ({', '.join(grupo['pas'])}): não classificado — {e}")
+            resumo.append({'grupo': n, 'pas': grupo['pas'], 'classificado': False})
+            continue
+
+        tarefa.etapa(f"{rotulo}: mudanças e áreas por lote")
+        change = calcular_mudanca(resultado['classified_ant'], resultado['classified_pos'], roi_grupo)
+        # Uma redução agrupada por classe para todos os lotes de todos os PAs do grupo
+        for props, areas in mudanca_por_lote(change, ee.FeatureCollection(fc_lotes)):
+            info = lotes_info[(props['pa'], props['lote_id'])]
+            linhas.append({'PA': props['pa'], 'Lote': info['nome'], 'Area_Total_ha': info['area_ha'], **areas})
+        resumo.append({
+            'grupo': n, 'pas': grupo['pas'], 'classificado': True,
+            'accuracy_ant': resultado['accuracy_ant'], 'accuracy_pos': resultado['accuracy_pos'],
+        })
+
+    df = pd.DataFrame(linhas, columns=['PA', 'Lote', 'Area_Total_ha', *COLUNAS_MUDANCA.values()])
+    return {'lotes': df, 'grupos': resumo}
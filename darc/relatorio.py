@@ -0,0 +1,274 @@
+"""Relatório PDF da análise (fpdf só é importado ao gerar o relatório)."""
+import os
+from io import BytesIO
+
+
+def gerar_relatorio_pdf(area_ha, date_ant, date_pos, intervalo_anos,
+                        accuracy_ant, kappa_ant, accuracy_pos, kappa_pos, areas_dict=None):
+    """Monta o relatório da análise e devolve os bytes do PDF"""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, "DARC - Relatorio de Analise de Desmatamento", ln=True, align="C")
+    pdf.ln(5)
+
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, "Instituto Federal de Rondonia", ln=True, align="C")
+    pdf.ln(10)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "1. Informacoes do Projeto", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 7, f"Area Total: {area_ha:,.2f} ha", ln=True)
+    pdf.cell(0, 7, f"Periodo Anterior: {date_ant}", ln=True)
+    pdf.cell(0, 7, f"Periodo Posterior: {date_pos}", ln=True)
+    pdf.cell(0, 7, f"Intervalo: {intervalo_anos:.1f} anos", ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "2. Acuracia da Classificacao", ln=True)
+    pdf.set_font("Arial", "", 11)
+
+    pdf.cell(0, 7, f"Periodo Anterior (2008):", ln=True)
+    if accuracy_ant is not None:
+        pdf.cell(0, 7, f"  - Precisao Global: {accuracy_ant*100:.2f}%", ln=True)
+        pdf.cell(0, 7, f"  - Indice Kappa: {kappa_ant:.4f}", ln=True)
+    else:
+        pdf.cell(0, 7, "  - Precisao Global: N/A (poucas amostras)", ln=True)
+        pdf.cell(0, 7, "  - Indice Kappa: N/A (poucas amostras)", ln=True)
+    pdf.ln(3)
+
+    pdf.cell(0, 7, f"Periodo Posterior (2025):", ln=True)
+    if accuracy_pos is not None:
+        pdf.cell(0, 7, f"  - Precisao Global: {accuracy_pos*100:.2f}%", ln=True)
+        pdf.cell(0, 7, f"  - Indice Kappa: {kappa_pos:.4f}", ln=True)
+    else:
+        pdf.cell(0, 7, "  - Precisao Global: N/A (poucas amostras)", ln=True)
+        pdf.cell(0, 7, "  - Indice Kappa: N/A (poucas amostras)", ln=True)
+    pdf.ln(5)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "3. Areas de Mudanca", ln=True)
+    pdf.set_font("Arial", "", 11)
+
+    if areas_dict:
+        for classe, area in areas_dict.items():
+            pdf.cell(0, 7, f"{classe}: {area:,.2f} ha", ln=True)
+
+        if 'Desmatamento' in areas_dict:
+            taxa = areas_dict['Desmatamento'] / intervalo_anos
+            pdf.ln(5)
+            pdf.set_font("Arial", "B", 11)
+            pdf.cell(0, 7, f"Taxa Anual: {taxa:.2f} ha/ano", ln=True)
+
+    # Gerar PDF em memória
+    pdf_output = BytesIO()
+    pdf_content = pdf.output()
+
+    # FPDF retorna bytearray, converter para bytes
+    if isinstance(pdf_content, bytearray):
+        pdf_output.write(bytes(pdf_content))
+    elif isinstance(pdf_content, bytes):
+        pdf_output.write(pdf_content)
+    else:
+        pdf_output.write(pdf_content.encode('latin1'))
+
+    pdf_output.seek(0)
+    return pdf_output.getvalue()
+
+
+# ===== Relatórios por lote em lote (ZIP) =====
+# Cada lote vira um PDF (áreas das classes, transições e recorte do mapa de mudanças). Os PDFs
+# são renderizados num pool de processos e gravados no ZIP em disco à medida que ficam prontos;
+# no máximo 2 × processos lotes ficam em voo, então a memória não cresce com o número de lotes.
+
+_NOMES_MUDANCA = {
+    'FF_ha': 'FF - Floresta Mantida',
+    'AC_ha': 'AC - Area Consolidada',
+    'CH_ha': 'CH - Corpos d\'Agua',
+    'DI_ha': 'DI - Desmatamento',
+    'FR_ha': 'FR - Floresta Regenerada',
+}
+
+
+def _latin1(texto):
+    """FPDF com fontes padrão só escreve latin-1"""
+    return str(texto).encode('latin-1', 'replace').decode('latin-1')
+
+
+def _recorte_png(recorte, aneis, paleta, lado_px=480):
+    """PNG do recorte do mapa de mudanças ampliado, com o contorno do lote"""
+    from PIL import Image, ImageDraw
+
+    from darc.exportacao import renderizar_png
+
+    img = Image.open(BytesIO(renderizar_png(recorte, paleta, valor_min=1))).convert('RGBA')
+    escala = max(1, lado_px // max(recorte.shape))
+    img = img.resize((recorte.shape[1] * escala, recorte.shape[0] * escala), Image.NEAREST)
+    fundo = Image.new('RGBA', img.size, (255, 255, 255, 255))
+    fundo.alpha_composite(img)
+    desenho = ImageDraw.Draw(fundo)
+    for anel in aneis:
+        desenho.line([(c * escala, l * escala) for c, l in anel], fill=(0, 0, 0, 255), width=2)
+    buffer = BytesIO()
+    fundo.convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def gerar_relatorio_lote_pdf(lote, date_ant, date_pos, recorte_png=None):
+    """PDF de um lote: área, classes do período anterior, transições e recorte do mapa.
+
+    lote: {'nome', 'area_ha', 'classes': {classe: ha}, 'mudancas': {coluna: ha}}
+    """
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, _latin1(f"DARC - Relatorio do Lote {lote['nome']}"), ln=True, align="C")
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 7, f"Periodo: {date_ant} a {date_pos}", ln=True, align="C")
+    pdf.ln(5)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "1. Informacoes do Lote", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 7, f"Area Total: {lote['area_ha']:,.2f} ha", ln=True)
+    pdf.ln(3)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, _latin1(f"2. Cobertura em {str(date_ant)[:4]}"), ln=True)
+    pdf.set_font("Arial", "", 11)
+    for classe, area in lote['classes'].items():
+        pdf.cell(0, 7, _latin1(f"{classe}: {area:,.2f} ha"), ln=True)
+    pdf.ln(3)
+
+    pdf.set_font("Arial", "B", 14)
+    pdf.cell(0, 10, "3. Transicoes", ln=True)
+    pdf.set_font("Arial", "", 11)
+    for coluna, area in lote['mudancas'].items():
+        pdf.cell(0, 7, _latin1(f"{_NOMES_MUDANCA.get(coluna, coluna)}: {area:,.2f} ha"), ln=True)
+
+    if recorte_png is not None:
+        pdf.ln(5)
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(0, 10, "4. Mapa de Mudancas", ln=True)
+        pdf.image(BytesIO(recorte_png), w=120)
+
+    return bytes(pdf.output())
+
+
+def _relatorio_lote_processo(trabalho):
+    """Executado no pool de processos: recorte em PNG + PDF do lote"""
+    recorte_png = None
+    if trabalho['recorte'] is not None:
+        recorte_png = _recorte_png(trabalho['recorte'], trabalho['aneis'], trabalho['paleta'])
+    pdf = gerar_relatorio_lote_pdf(trabalho['lote'], trabalho['date_ant'], trabalho['date_pos'], recorte_png)
+    return trabalho['arquivo'], pdf
+
+
+def _hectares(valor):
+    """Célula da tabela de lotes em ha (vazia/NaN = 0)"""
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    return valor if valor == valor else 0.0
+
+
+def _trabalhos_lotes(df_lotes, lote_ids, gdf_parcelas, raster_mudanca, paleta, date_ant, date_pos):
+    """Gera, lote a lote, o que cada processo precisa: linha da tabela, recorte do raster e contorno"""
+    import re
+
+    colunas_classes = [c for c in df_lotes.columns if c.endswith('_2008_ha')]
+    colunas_mudanca = [c for c in _NOMES_MUDANCA if c in df_lotes.columns]
+    array, transform = raster_mudanca if raster_mudanca is not None else (None, None)
+    usados = set()
+
+    for idx, linha in zip(lote_ids, df_lotes.itertuples(index=False, name=None)):
+        valores = dict(zip(df_lotes.columns, linha))
+        lote = {
+            'nome': valores['Lote'],
+            'area_ha': _hectares(valores['Area_Total_ha']),
+            'classes': {c[:-len('_2008_ha')]: _hectares(valores[c]) for c in colunas_classes if _hectares(valores[c]) > 0},
+            'mudancas': {c: _hectares(valores[c]) for c in colunas_mudanca if _hectares(valores[c]) > 0},
+        }
+
+        recorte, aneis = None, []
+        geom = gdf_parcelas.geometry.loc[idx]
+        if array is not None and geom is not None and not geom.is_empty:
+            inv = ~transform
+            minx, miny, maxx, maxy = geom.bounds
+            c0, l0 = inv * (minx, maxy)
+            c1, l1 = inv * (maxx, miny)
+            c0, l0 = max(int(c0) - 2, 0), max(int(l0) - 2, 0)
+            c1, l1 = min(int(c1) + 3, array.shape[1]), min(int(l1) + 3, array.shape[0])
+            if c1 > c0 and l1 > l0:
+                recorte = array[l0:l1, c0:c1].copy()
+                poligonos = geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]
+                for poligono in poligonos:
+                    if poligono.geom_type != 'Polygon':
+                        continue
+                    aneis.append([((inv * xy)[0] - c0, (inv * xy)[1] - l0) for xy in poligono.exterior.coords])
+
+        base = re.sub(r'[^\w.-]+', '_', str(lote['nome'])).strip('_') or f"lote_{idx}"
+        arquivo = f"{base}.pdf"
+        if arquivo in usados:
+            arquivo = f"{base}_{idx}.pdf"
+        usados.add(arquivo)
+
+        yield {'arquivo': arquivo, 'lote': lote, 'recorte': recorte, 'aneis': aneis, 'paleta': paleta,
+               'date_ant': date_ant, 'date_pos': date_pos}
+
+
+def gerar_relatorios_lotes_zip(tarefa, df_lotes, lote_ids, gdf_parcelas, raster_mudanca, paleta,
+                               date_ant, date_pos, caminho_zip, processos=None):
+    """Um PDF por lote, renderizados em paralelo e gravados em streaming num ZIP (roda como Tarefa).
+
+    raster_mudanca: (array, transform) do mapa de mudanças, ou None para relatórios sem mapa.
+    Retorna {'caminho', 'n_relatorios', 'bytes'}.
+    """
+    import multiprocessing
+    import zipfile
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    processos = processos or max(1, min(os.cpu_count() or 1, 8))
+    max_em_voo = 2 * processos
+    trabalhos = _trabalhos_lotes(df_lotes, lote_ids, gdf_parcelas, raster_mudanca, paleta, date_ant, date_pos)
+    n_relatorios = 0
+
+    tarefa.etapa(f"Iniciando {processos} processos")
+    # spawn: o processo do Streamlit tem várias threads, e fork com threads não é seguro
+    contexto = multiprocessing.get_context('spawn')
+    os.makedirs(os.path.dirname(caminho_zip) or '.', exist_ok=True)
+    temporario = f"{caminho_zip}.parcial"
+    try:
+        with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as executor, \
+                zipfile.ZipFile(temporario, 'w', compression=zipfile.ZIP_STORED) as zip_saida:
+            # PDFs e PNGs já são comprimidos: ZIP_STORED evita recomprimir
+            em_voo = set()
+            try:
+                for trabalho in trabalhos:
+                    em_voo.add(executor.submit(_relatorio_lote_processo, trabalho))
+                    if len(em_voo) >= max_em_voo:
+                        prontos, em_voo = wait(em_voo, return_when=FIRST_COMPLETED)
+                        for futuro in prontos:
+                            zip_saida.writestr(*futuro.result())
+                            n_relatorios += 1
+                            tarefa.etapa(f"Relatório {n_relatorios}/{len(lote_ids)}")
+                for futuro in wait(em_voo).done:
+                    zip_saida.writestr(*futuro.result())
+                    n_relatorios += 1
+                    tarefa.etapa(f"Relatório {n_relatorios}/{len(lote_ids)}")
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    os.replace(temporario, caminho_zip)
+    return {'caminho': caminho_zip, 'n_relatorios': n_relatorios, 'bytes': os.path.getsize(caminho_zip)}
@@ -0,0 +1,213 @@
+"""Tarefas em segundo plano com progresso, cancelamento e desfecho aplicado na sessão."""
+import threading
+import time
+import traceback
+import uuid
+
+import streamlit as st
+
+from darc.estagios import estagio_em_cache, impressao, registrar_estagio, saida_estagio
+
+
+# ===== Tarefas em segundo plano =====
+# Estágios longos (classificação, rasters, lotes) rodam num executor do processo, fora da thread
+# do script: a sessão continua respondendo, o progresso é consultado por um fragment e uma
+# reconexão não interrompe o trabalho. As funções das tarefas não usam st.* — avisos e
+# progresso passam pelo objeto Tarefa, e o resultado é aplicado na sessão quando termina.
+
+class TarefaCancelada(Exception):
+    pass
+
+
+class Tarefa:
+    """Trabalho em segundo plano: estado, etapa atual, avisos e resultado"""
+
+    def __init__(self, nome, total_etapas=1, sessao=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.nome = nome
+        self.sessao = sessao  # sessão do Streamlit dona da tarefa
+        self.total_etapas = total_etapas
+        self.etapas_concluidas = 0
+        self.etapa_atual = "Na fila"
+        self.estado = 'fila'  # fila → executando → concluida | erro | cancelada
+        self.avisos = []      # [(nivel st.*, texto)]
+        self.resultado = None
+        self.erro = None
+        self.inicio = time.time()
+        self.fim = None
+        self._cancelar = threading.Event()
+
+    def etapa(self, descricao):
+        """Marca o início de uma nova etapa (e é o ponto onde o cancelamento é atendido)"""
+        self.verificar_cancelamento()
+        if self.etapa_atual != "Na fila":
+            self.etapas_concluidas = min(self.etapas_concluidas + 1, self.total_etapas)
+        self.etapa_atual = descricao
+
+    def aviso(self, nivel, texto):
+        self.avisos.append((nivel, texto))
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    def verificar_cancelamento(self):
+        if self._cancelar.is_set():
+            raise TarefaCancelada()
+
+    @property
+    def ativa(self):
+        return self.estado in ('fila', 'executando')
+
+    @property
+    def progresso(self):
+        if not self.ativa:
+            return 1.0
+        return self.etapas_concluidas / max(self.total_etapas, 1)
+
+
+def _id_sessao():
+    """Id da sessão do Streamlit que está rodando o script (None fora do `streamlit run`)"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+@st.cache_resource
+def _executor_tarefas():
+    """Executor e registro de tarefas compartilhados por todas as sessões do processo"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    return {'executor': ThreadPoolExecutor(max_workers=4, thread_name_prefix='darc-tarefa'), 'tarefas': {}}
+
+
+def _rodar_tarefa(tarefa, funcao, args):
+    tarefa.estado = 'executando'
+    try:
+        tarefa.verificar_cancelamento()
+        tarefa.resultado = funcao(tarefa, *args)
+        tarefa.estado = 'concluida'
+    except TarefaCancelada:
+        tarefa.estado = 'cancelada'
+    except Exception as e:
+        tarefa.erro = f"{e}\n\n{traceback.format_exc()}"
+        tarefa.estado = 'erro'
+    finally:
+        tarefa.fim = time.time()
+
+
+def submeter_tarefa(chave, nome, funcao, *args, total_etapas=1, ao_concluir=None, hash_entradas=None):
+    """Agenda funcao(tarefa, *args) em segundo plano e associa a tarefa à sessão sob `chave`.
+
+    ao_concluir(resultado) roda depois na thread do script (com acesso a st.session_state).
+    Uma tarefa anterior com a mesma chave é cancelada.
+    """
+    anterior = tarefa_da_sessao(chave)
+    if anterior is not None and anterior.ativa:
+        anterior.cancelar()
+
+    registro = _executor_tarefas()
+    tarefa = Tarefa(nome, total_etapas, _id_sessao())
+    tarefa.ao_concluir = ao_concluir
+    tarefa.hash_entradas = hash_entradas
+    registro['tarefas'][tarefa.id] = tarefa
+    registro['executor'].submit(_rodar_tarefa, tarefa, funcao, args)
+
+    st.session_state.setdefault('_tarefas', {})[chave] = tarefa.id
+    st.session_state.get('_desfechos_tarefas', {}).pop(chave, None)
+    st.query_params[f"tarefa_{chave}"] = tarefa.id  # permite reencontrar a tarefa após reconectar
+    return tarefa
+
+
+def tarefa_da_sessao(chave):
+    tarefas = _executor_tarefas()['tarefas']
+    id_tarefa = st.session_state.get('_tarefas', {}).get(chave)
+    if id_tarefa:
+        return tarefas.get(id_tarefa)
+    # Pelo parâmetro da URL só a própria sessão dona reencontra a tarefa: uma URL copiada ou
+    # compartilhada não pode se apossar da tarefa (nem do ao_concluir) de outra sessão
+    tarefa = tarefas.get(st.query_params.get(f"tarefa_{chave}"))
+    if tarefa is not None and tarefa.sessao is not None and tarefa.sessao == _id_sessao():
+        st.session_state.setdefault('_tarefas', {})[chave] = tarefa.id
+        return tarefa
+    return None
+
+
+def _encerrar_tarefa(chave, tarefa):
+    """Leva o desfecho da tarefa para a sessão (resultado, avisos, erro) e a desassocia"""
+    if tarefa.estado == 'concluida' and tarefa.ao_concluir is not None:
+        tarefa.ao_concluir(tarefa.resultado)
+    st.session_state.setdefault('_desfechos_tarefas', {})[chave] = {
+        'nome': tarefa.nome, 'estado': tarefa.estado, 'avisos': list(tarefa.avisos),
+        'erro': tarefa.erro, 'duracao': (tarefa.fim or time.time()) - tarefa.inicio,
+        'hash_entradas': tarefa.hash_entradas
+    }
+    st.session_state.get('_tarefas', {}).pop(chave, None)
+    if f"tarefa_{chave}" in st.query_params:
+        del st.query_params[f"tarefa_{chave}"]
+    _executor_tarefas()['tarefas'].pop(tarefa.id, None)
+
+
+@st.fragment(run_every=1.5)
+def _painel_tarefa(chave):
+    tarefa = tarefa_da_sessao(chave)
+    if tarefa is None:
+        return
+    if not tarefa.ativa:
+        _encerrar_tarefa(chave, tarefa)
+        st.rerun()
+
+    st.progress(
+        tarefa.progresso,
+        text=f"⏳ {tarefa.nome} — {tarefa.etapa_atual} "
+             f"({tarefa.etapas_concluidas}/{tarefa.total_etapas}, {time.time() - tarefa.inicio:.0f}s)"
+    )
+    if st.button("⛔ Cancelar", key=f"cancelar_tarefa_{chave}"):
+        tarefa.cancelar()
+        tarefa.etapa_atual = "Cancelando..."
+
+
+def acompanhar_tarefa(chave):
+    """Mostra o progresso da tarefa em andamento ou o desfecho da última tarefa desta chave.
+
+    Retorna True enquanto a tarefa estiver rodando.
+    """
+    tarefa = tarefa_da_sessao(chave)
+    if tarefa is not None:
+        if tarefa.ativa:
+            _painel_tarefa(chave)
+            return True
+        _encerrar_tarefa(chave, tarefa)
+
+    desfecho = st.session_state.get('_desfechos_tarefas', {}).get(chave)
+    if desfecho is not None:
+        for nivel, texto in desfecho['avisos']:
+            getattr(st, nivel)(texto)
+        if desfecho['estado'] == 'cancelada':
+            st.warning(f"⛔ {desfecho['nome']}: cancelada.")
+        elif desfecho['estado'] == 'erro':
+            st.error(f"❌ {desfecho['nome']}: {desfecho['erro'].splitlines()[0]}")
+            with st.expander("Detalhes do erro"):
+                st.code(desfecho['erro'])
+        if desfecho['estado'] != 'concluida' and st.button("🔄 Tentar novamente", key=f"repetir_tarefa_{chave}"):
+            st.session_state['_desfechos_tarefas'].pop(chave)
+            st.rerun()
+    return False
+
+
+def estagio_em_segundo_plano(chave, nome, entradas, rotulo, funcao, *args, total_etapas=1):
+    """Como executar_estagio, mas calculado numa tarefa em segundo plano.
+
+    Devolve a saída se o estágio já estiver calculado para estas entradas; senão agenda a tarefa
+    (uma vez por hash de entradas), mostra o progresso e devolve None.
+    """
+    h = impressao(nome, entradas)
+    tarefa = tarefa_da_sessao(chave)
+    if not estagio_em_cache(nome, h) and (tarefa is None or tarefa.hash_entradas != h):
+        desfecho = st.session_state.get('_desfechos_tarefas', {}).get(chave)
+        # Depois de erro/cancelamento com as mesmas entradas, só repete se o usuário pedir
+        if desfecho is None or desfecho['hash_entradas'] != h or desfecho['estado'] == 'concluida':
+            submeter_tarefa(chave, rotulo, funcao, *args, total_etapas=total_etapas, hash_entradas=h,
+                            ao_concluir=lambda resultado: registrar_estagio(nome, h, resultado))
+    acompanhar_tarefa(chave)
+    return saida_estagio(nome) if estagio_em_cache(nome, h) else None